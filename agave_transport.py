@@ -0,0 +1,224 @@
+"""
+Retries, timeouts and connection pooling around an Agave client
+
+AgaveTransport stands in for the Reactor's client: client.files.list(...),
+client.jobs.submit(...) and so on go through call(), which
+
+- applies a per-operation timeout to the pooled HTTP session underneath,
+- retries transient failures (connection errors, 429 and 5xx responses)
+  with jittered exponential backoff, but only for operations that are
+  safe to repeat; jobs.submit is retried only when it was throttled,
+- rewinds file-like arguments (uploads) before each retry, so a repeated
+  call sends the whole stream again,
+- refreshes the access token once on a 401, sharing that refresh with
+  every thread that hit the same expired token,
+- counts calls, retries, failures and seconds spent per operation.
+
+Attributes other than the wrapped resources are passed through to the
+client, so code written against the client works unchanged.
+"""
+import random
+import threading
+import time
+
+from retry_backoff import backoff
+
+RESOURCES = ('files', 'jobs', 'apps', 'meta', 'systems', 'profiles')
+# Operations that can be repeated without changing the outcome. Uploads go
+# to content-addressed run directories, so repeating one rewrites the same
+# bytes to the same path (call() rewinds the stream first).
+IDEMPOTENT = frozenset([
+    'files.list', 'files.download', 'files.importData', 'files.delete',
+    'files.manage', 'jobs.get', 'jobs.list', 'apps.get', 'apps.list',
+    'meta.getMetadata', 'meta.listMetadata', 'systems.get'])
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+# Sent back when a request was turned away before it was processed
+THROTTLED_STATUS = frozenset([429])
+SESSION_PATHS = (('http_client', 'session'), ('session',), ('_session',))
+
+_local = threading.local()
+
+
+def status_code(error):
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def _timeout_adapter(pool_size):
+    '''HTTPAdapter that applies the calling operation's timeout, or None'''
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return None
+
+    class TimeoutAdapter(HTTPAdapter):
+
+        def send(self, request, **kwargs):
+            if kwargs.get('timeout', None) is None:
+                kwargs['timeout'] = getattr(_local, 'timeout', None)
+            return super(TimeoutAdapter, self).send(request, **kwargs)
+
+    return TimeoutAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=0)
+
+
+def _streams(args, kwargs):
+    '''(stream, position) for each seekable argument of a call'''
+    streams = []
+    for value in list(args) + list(kwargs.values()):
+        if hasattr(value, 'seek') and hasattr(value, 'tell'):
+            streams.append((value, value.tell()))
+    return streams
+
+
+def find_session(client):
+    '''The requests.Session an Agave client sends through, if it has one'''
+    for path in SESSION_PATHS:
+        obj = client
+        for attr in path:
+            obj = getattr(obj, attr, None)
+        if obj is not None and hasattr(obj, 'mount'):
+            return obj
+    return None
+
+
+class _Resource(object):
+
+    def __init__(self, transport, name, resource):
+        self._transport = transport
+        self._name = name
+        self._resource = resource
+
+    def __getattr__(self, operation):
+        func = getattr(self._resource, operation)
+        if not callable(func):
+            return func
+        name = '{}.{}'.format(self._name, operation)
+
+        def call(*args, **kwargs):
+            return self._transport.call(name, func, *args, **kwargs)
+        return call
+
+
+class AgaveTransport(object):
+
+    def __init__(self, client, timeouts=None, retries=4, backoff_seconds=1,
+                 max_backoff_seconds=30, pool_size=16, logger=None,
+                 sleep=time.sleep, clock=time.time, rng=random):
+        self.client = client
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.logger = logger
+        self.sleep = sleep
+        self.clock = clock
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.token_lock = threading.Lock()
+        self.token_generation = 0
+        self.stats = {}
+        self.pooled = False
+        session = find_session(client)
+        adapter = _timeout_adapter(pool_size) if session is not None else None
+        if adapter is not None:
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self.pooled = True
+
+    def __getattr__(self, name):
+        if name == 'client':
+            raise AttributeError(name)
+        attr = getattr(self.client, name)
+        if name in RESOURCES:
+            return _Resource(self, name, attr)
+        return attr
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.warning(message)
+
+    def _count(self, operation, seconds, retried=0, failed=False):
+        with self.lock:
+            entry = self.stats.setdefault(operation, {
+                'calls': 0, 'retries': 0, 'failures': 0,
+                'seconds': 0.0, 'max_seconds': 0.0})
+            entry['calls'] += 1
+            entry['retries'] += retried
+            entry['failures'] += 1 if failed else 0
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    def _retryable(self, operation, error):
+        status = status_code(error)
+        if operation not in IDEMPOTENT:
+            return status in THROTTLED_STATUS
+        if status is None:
+            # requests' connection errors and timeouts are IOErrors
+            return isinstance(error, IOError)
+        return status in RETRY_STATUS
+
+    def _refresh_token(self, generation):
+        '''Refresh once per expiry however many threads saw the 401'''
+        with self.token_lock:
+            if self.token_generation != generation:
+                return True
+            token = getattr(self.client, 'token', None)
+            refresh = getattr(token, 'refresh', None) or \
+                getattr(self.client, 'refresh_tokens', None)
+            if refresh is None:
+                return False
+            refresh()
+            self.token_generation += 1
+            return True
+
+    def call(self, operation, func, *args, **kwargs):
+        '''Run one Agave operation under the retry and timeout policy'''
+        started = self.clock()
+        retried = 0
+        refreshed = False
+        previous = getattr(_local, 'timeout', None)
+        _local.timeout = self.timeouts.get(
+            operation, self.timeouts.get('default', None))
+        streams = _streams(args, kwargs)
+        try:
+            while True:
+                generation = self.token_generation
+                # A failed attempt may have read part or all of an upload
+                for (stream, position) in streams:
+                    stream.seek(position)
+                try:
+                    result = func(*args, **kwargs)
+                    self._count(operation, self.clock() - started, retried)
+                    return result
+                except Exception as e:
+                    if status_code(e) == 401 and not refreshed and \
+                            self._refresh_token(generation):
+                        refreshed = True
+                        continue
+                    if retried >= self.retries or \
+                            not self._retryable(operation, e):
+                        self._count(operation, self.clock() - started,
+                                    retried, failed=True)
+                        raise
+                    retried += 1
+                    wait = backoff(retried, self.backoff_seconds,
+                                   self.max_backoff_seconds, self.rng)
+                    self._log('{} failed ({}); retry {} of {} in '
+                              '{:.1f}s'.format(operation, e, retried,
+                                               self.retries, wait))
+                    self.sleep(wait)
+        finally:
+            _local.timeout = previous
+
+    def counters(self):
+        '''Per-operation totals since the transport was created'''
+        with self.lock:
+            return dict((op, dict(entry)) for op, entry in self.stats.items())
+
+    def totals(self):
+        '''calls, retries, failures and seconds summed over operations'''
+        totals = {'calls': 0, 'retries': 0, 'failures': 0, 'seconds': 0.0}
+        for entry in self.counters().values():
+            for key in totals:
+                totals[key] += entry[key]
+        return totals
@@ -0,0 +1,66 @@
+"""
+Serialize TASBE artifacts and pack them into one upload
+
+dump_json() produces either the indented layout the reactor has always
+written or compact JSON. write_bundle() packs artifacts into a gzipped
+tar together with bundle.json, which maps each app input name to the
+member holding it. Member metadata and the gzip header carry no
+timestamps, so identical artifacts always give an identical bundle.
+Everything is built in memory and returned as bytes.
+"""
+import gzip
+import io
+import json
+import tarfile
+
+INDEX_MEMBER = 'bundle.json'
+
+
+def dump_json(document, compact=False):
+    '''UTF-8 JSON bytes for an artifact document'''
+    if compact:
+        text = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    else:
+        text = json.dumps(document, sort_keys=True, indent=4,
+                          separators=(',', ': '))
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return text
+
+
+def _add(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_bundle(members):
+    '''tar.gz bytes of members, a dict of input name -> (member, bytes)'''
+    index = dict((name, member) for name, (member, data) in members.items())
+    raw = io.BytesIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0)
+    try:
+        tar = tarfile.open(fileobj=gz, mode='w')
+        try:
+            _add(tar, INDEX_MEMBER, json.dumps(
+                index, sort_keys=True).encode('utf-8'))
+            for name in sorted(members):
+                (member, data) = members[name]
+                _add(tar, member, data)
+        finally:
+            tar.close()
+    finally:
+        gz.close()
+    return raw.getvalue()
+
+
+def read_bundle(data):
+    '''Return (index, {member: bytes}) for a bundle written above'''
+    contents = {}
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+        for info in tar.getmembers():
+            contents[info.name] = tar.extractfile(info).read()
+    index = json.loads(contents.pop(INDEX_MEMBER).decode('utf-8'))
+    return (index, contents)
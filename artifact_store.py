@@ -0,0 +1,51 @@
+"""
+Named artifacts held in memory for the length of one manifest
+
+Downloaded inputs and generated artifacts are kept as bytes under the
+file name they are uploaded as, so a run reads and writes nothing in the
+working directory and several runs can share a process. Given a
+debug_dir, every artifact is also written there as it is stored.
+"""
+import io
+import json
+import os
+
+from artifact_bundle import dump_json
+
+
+class ArtifactStore(object):
+
+    def __init__(self, debug_dir=None):
+        self.data = {}
+        self.debug_dir = debug_dir
+        if debug_dir is not None and not os.path.isdir(debug_dir):
+            os.makedirs(debug_dir)
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def put(self, name, data):
+        self.data[name] = data
+        if self.debug_dir is not None:
+            with open(os.path.join(self.debug_dir, name), 'wb') as fh:
+                fh.write(data)
+        return name
+
+    def put_json(self, name, document, compact=False):
+        return self.put(name, dump_json(document, compact))
+
+    def get(self, name):
+        return self.data[name]
+
+    def load_json(self, name):
+        return json.loads(self.data[name].decode('utf-8'))
+
+    def open(self, name):
+        '''A read-only file object over an artifact, named like it'''
+        fh = io.BytesIO(self.data[name])
+        fh.name = name
+        return fh
+
+    def size(self, *names):
+        '''Total bytes of the artifacts present among names'''
+        return sum(len(self.data[n]) for n in names if n in self.data)
@@ -0,0 +1,33 @@
+"""
+Atomic replacement of small local files
+
+Caches, indexes and queue stores shared between threads and between
+executions are rewritten whole. write_atomic() writes to a temporary file
+next to the target, named for the process and thread, and renames it
+over the target, so a reader sees either the old contents or the new,
+never a partial file.
+"""
+import os
+import threading
+
+
+def write_atomic(path, write, mode='w'):
+    '''Replace path with what write(fh) writes to an open file'''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created meanwhile by another thread or execution
+            if not os.path.isdir(directory):
+                raise
+    tmp = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                threading.current_thread().ident)
+    try:
+        with open(tmp, mode) as fh:
+            write(fh)
+        os.rename(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
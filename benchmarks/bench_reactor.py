@@ -0,0 +1,196 @@
+"""
+Offline throughput and memory benchmark for the reactor
+
+For each scale a synthetic manifest, plan and FCS files are generated
+and three things are timed: extract_experimental_data,
+build_process_control_data, and a full process_manifest run against
+FakeAgave (download, verify, pre-scan, build, mkdir, upload, submit).
+Every scale runs in its own interpreter so the reported peak RSS belongs
+to that scale alone.
+
+The full run uses the shipped config.yml. Only where state would leave
+the benchmark is it moved: cache files and the submission queue go to a
+scratch directory and the artifact cache to a FakeCache. --variants adds
+comparison runs with settings changed, reported under their own labels
+(see VARIANTS).
+
+Usage:
+    python benchmarks/bench_reactor.py [--scales 10,100,1000,10000,100000]
+                                       [--latency 0.05] [--channels 1]
+                                       [--variants shipped,mounted]
+
+Needs the reactor's runtime imports (reactors, attrdict, yaml), e.g. via
+`make shell`, but no network, credentials or Abaco context.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+DEFAULT_SCALES = '10,100,1000,10000,100000'
+# Settings changed from config.yml for each labelled run
+VARIANTS = {
+    'shipped': {},
+    # FCS files read in place, as where the storage system is mounted
+    # (relative to the scratch directory the run starts in)
+    'mounted': {'source': {'local_root': 'mount'}},
+    # Without the FCS file checks, which read every file
+    'no-preflight': {'verification': {'enabled': False},
+                     'prescan': {'enabled': False}},
+    # Every cache, the pre-flight checks and the queue off: the reactor
+    # before those features, for comparison only
+    'bare': {'cache': {'enabled': False},
+             'download_cache': {'enabled': False},
+             'verification': {'enabled': False},
+             'prescan': {'enabled': False},
+             'sizing': {'history_file': None, 'history_uri': None},
+             'submission_queue': {'enabled': False}},
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def local_settings(settings, workdir):
+    '''Point the cache files and submission queue at workdir'''
+    settings['download_cache']['directory'] = os.path.join(
+        workdir, 'downloads')
+    for section in ('verification', 'prescan'):
+        settings[section]['cache_file'] = os.path.join(
+            workdir, section + '.json')
+    settings['sizing']['history_file'] = os.path.join(
+        workdir, 'job_history.jsonl')
+    settings['submission_queue']['directory'] = os.path.join(
+        workdir, 'submissions')
+
+
+def run_scale(files, latency, channels, workdir, variant='shipped'):
+    '''Benchmark one scale in this process; returns a result dict'''
+    os.chdir(workdir)
+    import fake_agave
+    import synthetic
+    import reactor
+    from reactors.utils import agaveutils
+
+    (manifest, plan) = synthetic.build(files, channels=channels)
+    cytometer = synthetic.cytometer_configuration(channels)
+    chans = cytometer['tasbe_cytometer_configuration']['channels']
+    result = {'files': files, 'plan_states': len(plan['initialState']),
+              'latency': latency, 'channels': channels, 'variant': variant}
+
+    start = time.time()
+    index = reactor.PlanIndex(plan)
+    experimental_data = reactor.extract_experimental_data(manifest, index)
+    result['extract_s'] = time.time() - start
+
+    start = time.time()
+    reactor.build_process_control_data(
+        index, chans, experimental_data, synthetic.CYTOMETER_URI, manifest)
+    result['process_control_s'] = time.time() - start
+
+    agave = fake_agave.FakeAgave(latency=latency)
+    agave.install(agaveutils)
+    agave.put(synthetic.MANIFEST_PATH, manifest)
+    agave.put('/plan/bench-plan.json', plan)
+    agave.put('/biofab/instruments/accuri/bench/cytometer_configuration.json',
+              cytometer)
+    r = fake_agave.FakeReactor(agave)
+    local_settings(r.settings, workdir)
+    for (section, values) in VARIANTS[variant].items():
+        r.settings[section].update(values)
+    mount = r.settings['source'].get('local_root', None)
+    for (path, contents) in synthetic.fcs_files(manifest, channels):
+        agave.store(path, contents)
+        if mount is not None:
+            local = os.path.join(mount, path.lstrip('/'))
+            if not os.path.isdir(os.path.dirname(local)):
+                os.makedirs(os.path.dirname(local))
+            with open(local, 'wb') as fh:
+                fh.write(contents)
+    del manifest, plan, index, experimental_data
+    cache = fake_agave.FakeCache()
+    reactor.artifact_cache = lambda r: cache if r.settings.get(
+        'cache', {}).get('enabled', True) else None
+
+    start = time.time()
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'bench')
+    result['full_s'] = time.time() - start
+    result['api_calls'] = agave.calls
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def report(results):
+    header = ('{:<13} {:>8} {:>11} {:>11} {:>11} {:>12} {:>10}'.format(
+        'config', 'files', 'extract/s', 'pcd/s', 'full/s', 'full (s)',
+        'peak MB'))
+    print(header)
+    for res in results:
+        def rate(key):
+            return res['files'] / res[key] if res[key] > 0 else float('inf')
+        print('{:<13} {:>8} {:>11.0f} {:>11.0f} {:>11.0f} {:>12.3f} '
+              '{:>10.1f}'.format(
+                  res['variant'], res['files'], rate('extract_s'),
+                  rate('process_control_s'), rate('full_s'), res['full_s'],
+                  res['peak_rss_mb']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scales', default=DEFAULT_SCALES)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds slept per fake Agave call')
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--variants', default='shipped',
+                        help='comma-separated runs from {} (default '
+                        '%(default)s)'.format(', '.join(sorted(VARIANTS))))
+    parser.add_argument('--json', action='store_true',
+                        help='print raw results as JSON')
+    parser.add_argument('--child', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    variants = args.variants.split(',')
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        parser.error('unknown variant(s) {}'.format(', '.join(unknown)))
+
+    if args.child is not None:
+        workdir = tempfile.mkdtemp(prefix='fcs-etl-bench-')
+        try:
+            print(json.dumps(run_scale(args.child, args.latency,
+                                       args.channels, workdir, variants[0])))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return
+
+    results = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        for variant in variants:
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--child', str(scale), '--latency', str(args.latency),
+                 '--channels', str(args.channels), '--variants', variant])
+            results.append(json.loads(
+                out.decode('utf-8').strip().splitlines()[-1]))
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
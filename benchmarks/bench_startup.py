@@ -0,0 +1,111 @@
+"""
+Cold-start benchmark for the reactor
+
+Each run starts a fresh interpreter, as Abaco does for every execution,
+and times two things in it: importing reactor.py (and which heavy
+modules that import left for later, and what importing those costs),
+and validating one message the way Reactor.validate_message does it
+(read message.jsonschema, check it against the meta-schema, validate).
+Medians over --runs interpreters are reported.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--json]
+
+Needs the reactor's runtime imports (reactors, attrdict, yaml,
+jsonschema), e.g. via `make shell`, but no network or Abaco context.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+# Imported on first use by the reactor rather than at startup
+DEFERRED = ('numpy', 'uuid', 'jsonschema', 'fcs_header', 'fcs_verify',
+            'job_sizing', 'processed_index', 'replicate_groups',
+            'submit_queue')
+MESSAGE = {'uri': 'agave://data-sd2e-community/sample/manifest.json'}
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def run_child():
+    '''Timings for one fresh interpreter, as a dict'''
+    schema = os.path.join(PARENT, 'message.jsonschema')
+    result = {}
+
+    started = time.time()
+    import reactor  # noqa: F401
+    result['import_s'] = time.time() - started
+    result['deferred'] = [m for m in DEFERRED if m not in sys.modules]
+
+    import jsonschema
+    started = time.time()
+    with open(schema) as f:
+        document = json.loads(f.read())
+    jsonschema.validate(MESSAGE, document)
+    result['schema_file_s'] = time.time() - started
+
+    started = time.time()
+    for module in result['deferred']:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    result['deferred_s'] = time.time() - started
+    return result
+
+
+def report(results):
+    def ms(key):
+        return 1000 * median([res[key] for res in results])
+    print('{} runs, medians'.format(len(results)))
+    print('{:<34} {:>9.1f} ms'.format('import reactor', ms('import_s')))
+    deferred = ', '.join(results[0]['deferred']) or 'none'
+    print('{:<34} {:>9.1f} ms'.format(
+        'deferred imports ({})'.format(deferred), ms('deferred_s')))
+    print('{:<34} {:>9.1f} ms'.format('validate via schema file',
+                                      ms('schema_file_s')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--json', action='store_true',
+                        help='print raw results as JSON')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child()))
+        return
+
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child'])
+        results.append(json.loads(
+            out.decode('utf-8').strip().splitlines()[-1]))
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark: cached TASBE templates vs. concatenate-and-parse
+
+The old builders spliced channel entries into one large JSON string and
+ran json.loads over it on every call. This times that approach against
+tasbe_templates.load() plus structured assignment, across channel counts.
+
+Usage: python benchmarks/bench_templates.py [repeats]
+"""
+from __future__ import print_function
+import json
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import tasbe_templates
+
+
+def legacy_color_model(channels):
+    '''Rebuild the color model the way the pre-template builder did'''
+    entry = tasbe_templates.TEMPLATES['color_model_channel']
+    text = tasbe_templates.TEMPLATES['color_model'].replace(
+        '"channel_parameters": []',
+        '"channel_parameters": [' + ',\n'.join(
+            [entry.replace('"name": "placeholder"',
+                           '"name": "' + c['name'] + '"')
+             for c in channels]) + ']').replace(
+        '"ERF_channel_name": "placeholder"',
+        '"ERF_channel_name": "' + channels[0]['name'] + '"')
+    return json.loads(text)
+
+
+def cached_color_model(channels):
+    '''Same document from the parsed-once template'''
+    color_model = tasbe_templates.load('color_model')
+    params = color_model['tasbe_color_model_parameters']
+    for channel in channels:
+        entry = tasbe_templates.load('color_model_channel')
+        entry['name'] = channel['name']
+        params['channel_parameters'].append(entry)
+    params['ERF_channel_name'] = channels[0]['name']
+    return color_model
+
+
+def main(repeats=2000):
+    print('{:>9} {:>12} {:>12} {:>8}'.format(
+        'channels', 'legacy us', 'cached us', 'speedup'))
+    for count in (1, 4, 16, 64, 256):
+        channels = [{'name': 'FL{}-A'.format(i)} for i in range(count)]
+        assert legacy_color_model(channels) == cached_color_model(channels)
+        number = max(1, repeats // count)
+        legacy = min(timeit.repeat(lambda: legacy_color_model(channels),
+                                   number=number, repeat=3)) / number
+        cached = min(timeit.repeat(lambda: cached_color_model(channels),
+                                   number=number, repeat=3)) / number
+        print('{:>9} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+            count, legacy * 1e6, cached * 1e6, legacy / cached))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,251 @@
+"""
+In-process stand-in for the Agave files and jobs APIs
+
+FakeAgave keeps remote files in a dict and sleeps `latency` seconds per
+call to approximate a storage system round trip. install() points the
+agaveutils helpers the reactor uses at it, and FakeReactor carries just
+enough of the Reactor interface (settings, loggers, ids, client) for
+reactor.process_manifest to run with no network or Abaco context.
+FakeCache stands in for the key-value store behind the artifact cache.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import yaml
+from attrdict import AttrDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG = os.path.join(os.path.dirname(HERE), 'config.yml')
+
+
+class FakeAgave(object):
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.remote = {}
+        self.modified = {}
+        self.calls = {}
+        self.submitted = []
+        self.messages = []
+        self.listed = []
+        # Bumped whenever remote changes, so directory listings are reused
+        self.version = 0
+        self.lock = threading.Lock()
+        self.files = _Files(self)
+        self.jobs = _Jobs(self)
+        self.apps = _Apps(self)
+        self.actors = _Actors(self)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, path, document):
+        '''Place a JSON document at a remote absolute path'''
+        self.store(path, json.dumps(document))
+
+    def store(self, path, contents):
+        self.remote[path] = contents
+        self.version += 1
+        self.modified[path] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                            time.gmtime())
+
+    # Signatures follow reactors.utils.agaveutils
+    def download(self, agaveClient, agaveAbsolutePath, systemId,
+                 localFilename):
+        self._call('download')
+        with open(localFilename, 'w') as fh:
+            fh.write(self.remote[agaveAbsolutePath])
+        return localFilename
+
+    def upload(self, agaveClient, agaveDestPath, systemId, localFile):
+        self._call('upload')
+        with open(localFile) as fh:
+            self.store(os.path.join(agaveDestPath,
+                                    os.path.basename(localFile)), fh.read())
+
+    def mkdir(self, agaveClient, dirName, systemId, basePath):
+        self._call('mkdir')
+
+    def install(self, agaveutils):
+        '''Point agaveutils (a module or a class) at this stand-in'''
+        # Bound methods are not rebound when read back through a class
+        agaveutils.agave_download_file = self.download
+        agaveutils.agave_upload_file = self.upload
+        agaveutils.agave_mkdir = self.mkdir
+
+
+class NotFound(Exception):
+    '''Raised like the HTTP 404 Agave returns for a missing path'''
+
+    class response(object):
+        status_code = 404
+
+
+class _Response(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+class _Files(object):
+
+    def __init__(self, agave):
+        self.agave = agave
+        self.children = {}
+
+    def _children(self, filePath):
+        '''Sorted [(path, kind)] below filePath, rebuilt after changes'''
+        remote = self.agave.remote
+        # len(remote) also catches entries deleted from remote directly
+        version = (self.agave.version, len(remote))
+        cached = self.children.get(filePath, None)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        prefix = filePath.rstrip('/') + '/'
+        children = {}
+        for path in remote:
+            if path.startswith(prefix):
+                name = path[len(prefix):].split('/', 1)[0]
+                kind = 'dir' if '/' in path[len(prefix):] else 'file'
+                children[name] = (prefix + name, kind)
+        listing = [children[child] for child in sorted(children)]
+        self.children[filePath] = (version, listing)
+        return listing
+
+    def list(self, systemId, filePath, limit=100, offset=0):
+        self.agave._call('list')
+        self.agave.listed.append(filePath)
+        if filePath in self.agave.remote:
+            return [self._entry(filePath, 'file')]
+        listing = self._children(filePath)
+        if len(listing) == 0:
+            raise NotFound(filePath)
+        return [self._entry(*child)
+                for child in listing[offset:offset + limit]]
+
+    def _entry(self, path, kind):
+        remote = self.agave.remote
+        if kind == 'file':
+            return {'name': os.path.basename(path), 'type': 'file',
+                    'length': len(remote[path]),
+                    'lastModified': self.agave.modified[path]}
+        below = [p for p in remote if p.startswith(path + '/')]
+        return {'name': os.path.basename(path), 'type': 'dir', 'length': 0,
+                'lastModified': max(self.agave.modified[p] for p in below)}
+
+    def download(self, systemId, filePath):
+        self.agave._call('download')
+        return _Response(self.agave.remote[filePath])
+
+    def importData(self, systemId, filePath, fileName, fileToUpload):
+        self.agave._call('upload')
+        self.agave.store(os.path.join(filePath, fileName),
+                         fileToUpload.read())
+
+    def delete(self, systemId, filePath):
+        self.agave._call('delete')
+        for path in [p for p in self.agave.remote
+                     if p == filePath or p.startswith(filePath + '/')]:
+            del self.agave.remote[path]
+        self.agave.version += 1
+
+    def manage(self, systemId, body, filePath):
+        self.agave._call('manage')
+        if filePath not in self.agave.remote:
+            raise IOError('{} does not exist'.format(filePath))
+        self.agave.store(os.path.join(os.path.dirname(filePath),
+                                      body['path']),
+                         self.agave.remote.pop(filePath))
+
+
+class _Jobs(object):
+
+    def __init__(self, agave):
+        self.agave = agave
+
+    def submit(self, body):
+        self.agave._call('submit')
+        self.agave.submitted.append(body)
+        return {'id': 'bench-job-{}'.format(len(self.agave.submitted))}
+
+    def get(self, jobId):
+        self.agave._call('get')
+        return {'id': jobId, 'status': 'QUEUED'}
+
+
+class _Apps(object):
+
+    def __init__(self, agave):
+        self.agave = agave
+
+    def get(self, appId):
+        self.agave._call('apps')
+        return {'id': appId, 'executionSystem': 'bench-execution-system'}
+
+
+class _Actors(object):
+
+    def __init__(self, agave):
+        self.agave = agave
+
+    def sendMessage(self, actorId, body):
+        self.agave._call('message')
+        self.agave.messages.append((actorId, json.loads(body['message'])))
+        return {'executionId': 'bench-exec-{}'.format(
+            len(self.agave.messages))}
+
+
+class _Logger(object):
+
+    def __init__(self, echo=False):
+        self.echo = echo
+
+    def _log(self, message, *args):
+        if self.echo:
+            print(message)
+
+    debug = info = warning = error = critical = _log
+
+
+class _Loggers(object):
+    slack = _Logger()
+
+
+class FakeCache(dict):
+    '''The parts of AgaveKeyValStore used by the artifact cache'''
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class FakeReactor(object):
+    '''The parts of reactors.utils.Reactor used by process_manifest'''
+
+    def __init__(self, client, settings=None, echo=False):
+        if settings is None:
+            with open(CONFIG) as fh:
+                settings = yaml.safe_load(fh)
+        self.settings = AttrDict(settings)
+        self.client = client
+        self.logger = _Logger(echo)
+        self.loggers = _Loggers()
+        self.uid = 'bench-actor'
+        self.execid = 'bench-exec'
+
+    def on_failure(self, message, exception):
+        raise RuntimeError('{} : {}'.format(message, exception))
+
+    def on_success(self, message):
+        return message
+
+
+def reset_dir(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
@@ -0,0 +1,111 @@
+"""
+Synthetic manifests, plans and cytometer configurations for benchmarks
+
+Documents follow the shape of tests/data/biofab-manifest.json: one FCS
+file per collected sample under <collection>/instrument_output, a bead
+control and a blank, and a plan whose initialState carries strains and
+IPTG / L-arabinose / aTc conditions for every sample. fcs_files() gives
+the contents of those FCS files: a HEADER and TEXT segment naming the
+cytometer channels and a short DATA segment, matching the manifest
+checksums, so verification and the pre-scan can run over them.
+"""
+import hashlib
+import random
+
+SYSTEM = 'data-sd2e-community'
+COLLECTION = '/biofab/yeast-gates_q0/aq_bench/1'
+PLAN_URI = 'agave://{}/plan/bench-plan.json'.format(SYSTEM)
+CYTOMETER_URI = 'agave://{}/biofab/instruments/accuri/bench/' \
+    'cytometer_configuration.json'.format(SYSTEM)
+MANIFEST_PATH = COLLECTION + '/manifest/manifest.json'
+MANIFEST_URI = 'agave://{}{}'.format(SYSTEM, MANIFEST_PATH)
+HUB = 'https://hub.sd2e.org/user/sd2e/biofab_yeast_gates_q0_aq_bench'
+STRAIN = 'https://hub.sd2e.org/user/sd2e/design/UWBF_{}/1#UWBF_{}'
+
+
+def sample_uri(name):
+    return '{}/{}/1'.format(HUB, name)
+
+
+def file_uri(name):
+    return 'agave://{}{}/instrument_output/{}.fcs'.format(
+        SYSTEM, COLLECTION, name)
+
+
+def channel_names(channels=1):
+    names = ['FL1-A', 'FL2-A', 'FL3-A', 'FL4-A']
+    return [names[c] if c < len(names) else 'CH{}-A'.format(c)
+            for c in range(channels)]
+
+
+def fcs_file(name, channels=1, events=10000):
+    '''Bytes of a minimal FCS 3.0 file for sample `name`'''
+    pairs = [('$PAR', str(channels + 1)), ('$TOT', str(events)),
+             ('$FIL', name + '.fcs'), ('$P1N', 'FSC-A')]
+    pairs.extend(('$P{}N'.format(n), channel)
+                 for (n, channel) in enumerate(channel_names(channels), 2))
+    text = '/' + ''.join('{}/{}/'.format(k, v) for (k, v) in pairs)
+    begin = 58
+    end = begin + len(text) - 1
+    data = b'\0' * 4 * (channels + 1) * 16
+    header = 'FCS3.0    {:>8}{:>8}{:>8}{:>8}{:>8}{:>8}'.format(
+        begin, end, end + 1, end + len(data), 0, 0)
+    return (header + text).encode('ascii') + data
+
+
+def fcs_files(manifest, channels=1):
+    '''(absolute path, contents) for each FCS file in manifest'''
+    for sample in manifest['samples']:
+        for entry in sample['files']:
+            path = entry['file'].split(SYSTEM, 1)[1]
+            name = path.rsplit('/', 1)[1][:-len('.fcs')]
+            yield (path, fcs_file(name, channels))
+
+
+def build(files, seed=0, uncollected=0.0, channels=1):
+    '''Return (manifest, plan) dicts describing `files` FCS files
+
+    Sample 0 is the bead control and sample 1 the blank. A fraction of the
+    remaining samples can be marked collected: false. Checksums are those
+    of the fcs_files() contents for the same number of channels.
+    '''
+    rng = random.Random(seed)
+    samples = []
+    states = []
+    for i in range(max(files, 2)):
+        name = 's{}_R{}'.format(1000 + i, rng.randint(1000, 99999))
+        if i == 0:
+            name = 'beadcontrol'
+        uri = sample_uri(name)
+        checksum = hashlib.sha1(fcs_file(name, channels)).hexdigest()
+        samples.append({
+            'sample': uri,
+            'files': [{'file': file_uri(name), 'checksum': checksum}],
+            'collected': i < 2 or rng.random() >= uncollected})
+        if i == 0:
+            conditions = [{'bead_model': 'SpheroTech RCP-30-5A',
+                           'bead_batch': 'Lot AA01, AA02, AA03, AA04, AB01'}]
+        else:
+            conditions = [{'IPTG_measure': rng.choice([0, 1])},
+                          {'Larabinose_measure': rng.choice([0, 5, 25])},
+                          {'aTc_measure': rng.choice([0.0, 0.25, 2.5])}]
+            if i == 1:
+                conditions.append({'Is_Blank': True})
+        strain_id = rng.randint(5000, 6000)
+        states.append({'Sample Id': uri,
+                       'Strains': [{'Strain Id': STRAIN.format(
+                           strain_id, strain_id)}],
+                       'Conditions': conditions})
+    manifest = {'rdf:about': MANIFEST_URI,
+                'plan': PLAN_URI,
+                'manifest_version':
+                    'https://github.com/SD2E/reactors-etl/releases/tag/2',
+                'instrument_configuration': CYTOMETER_URI,
+                'samples': samples}
+    plan = {'initialState': states}
+    return (manifest, plan)
+
+
+def cytometer_configuration(channels=1):
+    return {'tasbe_cytometer_configuration': {'channels': [
+        {'name': name} for name in channel_names(channels)]}}
@@ -0,0 +1,129 @@
+"""
+Local LRU cache for Agave file downloads
+
+Plans and cytometer configurations are shared by many manifests. Cached
+copies are keyed by Agave URI and only reused while the remote file's
+length and lastModified still match, so a changed file is always fetched
+again. The total size of the cache is capped and the least recently used
+entries are evicted first.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from atomic_file import write_atomic
+
+INDEX_FILE = 'index.json'
+
+
+def remote_stat(agaveClient, systemId, agaveAbsolutePath):
+    '''Return (length, lastModified) for a remote file'''
+    listing = agaveClient.files.list(systemId=systemId,
+                                     filePath=agaveAbsolutePath)
+    entry = listing[0]
+    return (int(entry['length']), str(entry['lastModified']))
+
+
+class DownloadCache(object):
+    '''Size-capped, LRU-evicted store of downloaded files
+
+    fetch_bytes() is safe to call from several threads. The index is rewritten
+    atomically, so concurrent executions sharing the directory can at
+    worst lose each other's entries, never corrupt them.
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path()) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        write_atomic(self._index_path(), lambda fh: json.dump(index, fh))
+
+    @staticmethod
+    def key(uri):
+        return hashlib.sha1(uri.encode('utf-8')).hexdigest()
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def lookup(self, uri, length, last_modified):
+        '''Path of a valid cached copy of uri, or None'''
+        key = self.key(uri)
+        with self.lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is None or entry['length'] != length or \
+                    entry['lastModified'] != last_modified or \
+                    not os.path.isfile(self._data_path(key)):
+                return None
+            entry['atime'] = time.time()
+            self._save_index(index)
+        return self._data_path(key)
+
+    def store_bytes(self, uri, length, last_modified, data):
+        '''Cache freshly downloaded contents and evict'''
+        key = self.key(uri)
+        if len(data) > self.max_bytes:
+            return
+        write_atomic(self._data_path(key), lambda fh: fh.write(data), 'wb')
+        self._record(key, uri, length, last_modified, len(data))
+
+    def _record(self, key, uri, length, last_modified, size):
+        with self.lock:
+            index = self._load_index()
+            index[key] = {'uri': uri, 'length': length,
+                          'lastModified': last_modified, 'size': size,
+                          'atime': time.time()}
+            self._evict(index)
+            self._save_index(index)
+
+    def _evict(self, index):
+        total = sum(e['size'] for e in index.values())
+        for key, entry in sorted(index.items(), key=lambda i: i[1]['atime']):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._data_path(key))
+            except OSError:
+                pass
+            total -= entry['size']
+            del index[key]
+
+    def fetch_bytes(self, agaveClient, download, uri, systemId,
+                    agaveAbsolutePath):
+        '''Contents of uri, from the cache when it is current
+
+        download(agaveClient, systemId, agaveAbsolutePath) returns the
+        remote contents on a miss.
+        '''
+        try:
+            (length, last_modified) = remote_stat(
+                agaveClient, systemId, agaveAbsolutePath)
+        except Exception:
+            return download(agaveClient, systemId, agaveAbsolutePath)
+        cached = self.lookup(uri, length, last_modified)
+        if cached is not None:
+            self.hits += 1
+            with open(cached, 'rb') as fh:
+                return fh.read()
+        self.misses += 1
+        data = download(agaveClient, systemId, agaveAbsolutePath)
+        self.store_bytes(uri, length, last_modified, data)
+        return data
@@ -0,0 +1,76 @@
+"""
+Read the HEADER and TEXT segments of an FCS file without its data
+
+Only the first bytes of the file and the primary TEXT segment are touched
+through a read-only mmap, so the cost is independent of the number of
+events recorded. read_header() returns the parameter count ($PAR), the
+channel names ($PnN) and the event count ($TOT).
+"""
+import mmap
+import os
+
+HEADER_BYTES = 58
+
+
+class FCSParseError(ValueError):
+    pass
+
+
+def _offset(header, start, end):
+    field = header[start:end].strip()
+    try:
+        return int(field)
+    except ValueError:
+        raise FCSParseError('bad TEXT offset {!r}'.format(field))
+
+
+def parse_text(text):
+    '''Keyword dict from a raw TEXT segment, keywords upper-cased'''
+    if len(text) < 2:
+        raise FCSParseError('TEXT segment is empty')
+    delimiter = text[0:1]
+    # A doubled delimiter stands for a literal one inside a keyword/value
+    placeholder = b'\x00'
+    body = text[1:].replace(delimiter + delimiter, placeholder)
+    fields = body.split(delimiter)
+    if fields and fields[-1].strip(b'\x00 \r\n') == b'':
+        fields = fields[:-1]
+    if len(fields) % 2 != 0:
+        raise FCSParseError('TEXT segment has an odd number of fields')
+    keywords = {}
+    for i in range(0, len(fields), 2):
+        key = fields[i].replace(placeholder, delimiter)
+        value = fields[i + 1].replace(placeholder, delimiter)
+        keywords[key.decode('utf-8', 'replace').strip().upper()] = \
+            value.decode('utf-8', 'replace').strip()
+    return keywords
+
+
+def read_header(path):
+    '''Return {'version', 'par', 'channels', 'tot'} for one FCS file'''
+    size = os.path.getsize(path)
+    if size < HEADER_BYTES:
+        raise FCSParseError('{} bytes is too short for an FCS HEADER'.format(
+            size))
+    with open(path, 'rb') as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = mapped[0:HEADER_BYTES]
+            if header[0:3] != b'FCS':
+                raise FCSParseError('not an FCS file')
+            begin = _offset(header, 10, 18)
+            end = _offset(header, 18, 26)
+            if begin <= 0 or end < begin or end >= size:
+                raise FCSParseError('TEXT segment {}-{} is outside the '
+                                    'file ({} bytes)'.format(begin, end, size))
+            keywords = parse_text(mapped[begin:end + 1])
+        finally:
+            mapped.close()
+    try:
+        par = int(keywords['$PAR'])
+        tot = int(keywords['$TOT'])
+        channels = [keywords['$P{}N'.format(n)] for n in range(1, par + 1)]
+    except (KeyError, ValueError) as e:
+        raise FCSParseError('missing or invalid keyword {}'.format(e))
+    return {'version': header[0:6].decode('ascii', 'replace'),
+            'par': par, 'channels': channels, 'tot': tot}
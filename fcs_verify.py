@@ -0,0 +1,181 @@
+"""
+Pre-flight checks of the FCS files a manifest references
+
+Files are hashed through read-only memory maps in fixed-size chunks, or
+have just their HEADER and TEXT segments read, on a bounded thread pool
+(hashlib releases the GIL on large buffers). Results are kept in a small
+persistent record keyed by (key, size, mtime), so files that have not
+changed since an earlier run are not read again. inspect_all() runs
+several such checks with one fetch per file, so a remote file that is
+both hashed and pre-scanned is downloaded once.
+"""
+import hashlib
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from atomic_file import write_atomic
+from fcs_header import read_header
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def sha1_file(path, chunk_size=CHUNK_SIZE):
+    '''sha1 hex digest of a local file, read through mmap'''
+    digest = hashlib.sha1()
+    size = os.path.getsize(path)
+    if size == 0:
+        return digest.hexdigest()
+    with open(path, 'rb') as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, size, chunk_size):
+                digest.update(mapped[offset:offset + chunk_size])
+        finally:
+            mapped.close()
+    return digest.hexdigest()
+
+
+class FileRecord(object):
+    '''Persistent results for files, valid while size and mtime match
+
+    A record that cannot be written is only a lost cache, so save()
+    warns through logger (when given) and carries on.
+    '''
+
+    def __init__(self, path=None, logger=None):
+        self.path = path
+        self.logger = logger
+        self.entries = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as fh:
+                    self.entries = json.load(fh)
+            except ValueError:
+                self.entries = {}
+
+    def lookup(self, key, size, mtime):
+        entry = self.entries.get(key, None)
+        if entry is not None and entry[0:2] == [size, mtime]:
+            return entry[2]
+        return None
+
+    def add(self, key, size, mtime, value):
+        with self.lock:
+            self.entries[key] = [size, mtime, value]
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with self.lock:
+                write_atomic(self.path,
+                             lambda fh: json.dump(self.entries, fh))
+        except (IOError, OSError) as e:
+            if self.logger is not None:
+                self.logger.warning("could not save {}: {}".format(
+                    self.path, e))
+
+
+def inspect_all(stat, fetch, inspections, workers=8):
+    '''Run several inspect(local_path) checks over files, fetching each once
+
+    inspections is a list of (keys, inspect, record). stat(key) returns
+    (size, mtime) without reading the file. fetch(key) returns
+    (local_path, temporary), where temporary files are removed once
+    inspected. A file is fetched only when a check covering it has no
+    result in its record for the same size and mtime, and every such
+    check then reads the same local copy. Returns one dict per inspection
+    of key to result, or to the exception that prevented computing it.
+    '''
+    records = [record if record is not None else FileRecord()
+               for (keys, inspect, record) in inspections]
+    wanted = OrderedDict()
+    for (i, (keys, inspect, record)) in enumerate(inspections):
+        for key in keys:
+            wanted.setdefault(key, []).append(i)
+
+    def _inspect(key):
+        found = {}
+        try:
+            (size, mtime) = stat(key)
+        except Exception as e:
+            return (key, dict((i, e) for i in wanted[key]))
+        todo = []
+        for i in wanted[key]:
+            result = records[i].lookup(key, size, mtime)
+            if result is None:
+                todo.append(i)
+            else:
+                found[i] = result
+        if len(todo) == 0:
+            return (key, found)
+        try:
+            (local_path, temporary) = fetch(key)
+        except Exception as e:
+            found.update((i, e) for i in todo)
+            return (key, found)
+        try:
+            for i in todo:
+                try:
+                    found[i] = inspections[i][1](local_path)
+                except Exception as e:
+                    found[i] = e
+                    continue
+                records[i].add(key, size, mtime, found[i])
+        finally:
+            if temporary and os.path.exists(local_path):
+                os.remove(local_path)
+        return (key, found)
+
+    results = [{} for _ in inspections]
+    if len(wanted) == 0:
+        return results
+    pool = ThreadPool(processes=max(1, min(workers, len(wanted))))
+    try:
+        for (key, found) in pool.map(_inspect, list(wanted)):
+            for (i, result) in found.items():
+                results[i][key] = result
+    finally:
+        pool.terminate()
+    for record in records:
+        record.save()
+    return results
+
+
+def inspect_files(keys, stat, fetch, inspect, workers=8, record=None):
+    '''inspect_all() for a single check; returns key -> result or error'''
+    return inspect_all(stat, fetch, [(keys, inspect, record)], workers)[0]
+
+
+def checksum_mismatches(files, found):
+    '''(key, expected, found) for each file whose sha1 does not match
+
+    files is a list of (key, expected_sha1); entries without a checksum
+    are skipped. found maps keys to sha1_file() results or errors.
+    '''
+    return [(key, sha1, found[key]) for (key, sha1) in files
+            if sha1 and found[key] != sha1]
+
+
+def verify_checksums(files, stat, fetch, workers=8, record=None):
+    '''Hash files in parallel and compare with the expected sha1 values
+
+    files is a list of (key, expected_sha1); entries without a checksum
+    are skipped. Returns a list of (key, expected, found) for every
+    mismatch, with found being the actual digest or the error that
+    prevented computing it.
+    '''
+    found = inspect_files([key for (key, sha1) in files if sha1], stat,
+                          fetch, sha1_file, workers=workers, record=record)
+    return checksum_mismatches(files, found)
+
+
+def scan_headers(keys, stat, fetch, workers=8, record=None):
+    '''read_header() for many FCS files; returns key -> header or error'''
+    return inspect_files(keys, stat, fetch, read_header, workers=workers,
+                         record=record)
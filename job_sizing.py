@@ -0,0 +1,201 @@
+"""
+Runtime estimates for FCS-ETL jobs
+
+A job is described by its sample count and by the work TASBE does per
+channel, measured either in events (from the FCS pre-scan) or, when event
+counts are unknown, in bytes of FCS data. SizingModel predicts wall time
+as
+
+    seconds = overhead + per_sample * samples + per_unit * units * channels
+
+starting from configured coefficients, which are refit by least squares
+once JobHistory holds enough finished jobs measured in the same unit.
+size() pads the estimate by a safety factor and picks the shortest queue
+it fits in, a node count and maxRunTime.
+"""
+import calendar
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from atomic_file import write_atomic
+
+# Jobs still waiting for a duration are given up on after this long
+PENDING_SECONDS = 7 * 24 * 3600
+TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)'
+                       r'(\.\d+)?(Z|[+-]\d\d:?\d\d)?$')
+
+
+def parse_timestamp(text):
+    '''Seconds since the epoch for an ISO 8601 timestamp from Agave'''
+    match = TIMESTAMP.match(text.strip())
+    if match is None:
+        raise ValueError('unrecognized timestamp {!r}'.format(text))
+    fields = [int(f) for f in match.groups()[0:6]]
+    seconds = calendar.timegm(tuple(fields) + (0, 0, 0))
+    if match.group(7):
+        seconds += float(match.group(7))
+    zone = match.group(8)
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        seconds -= offset if zone[0] == '+' else -offset
+    return seconds
+
+
+def hms(seconds):
+    '''Agave maxRunTime string, rounded up to the minute'''
+    minutes = int(math.ceil(seconds / 60.0))
+    return '{:02d}:{:02d}:00'.format(minutes // 60, minutes % 60)
+
+
+def hms_seconds(text):
+    (h, m, s) = [int(part) for part in str(text).split(':')]
+    return h * 3600 + m * 60 + s
+
+
+class JobHistory(object):
+    '''Submitted jobs and, once known, how long they ran
+
+    Records are dicts kept one per line, in a local file at path and/or
+    wherever the caller stores dumps(). A record without a 'status' is
+    still pending; finished ones carry 'seconds'. uri is left for the
+    caller to note the remote copy the records were read from.
+    '''
+
+    def __init__(self, path=None, max_records=2000):
+        self.path = path
+        self.uri = None
+        self.max_records = max_records
+        self.records = []
+        self.lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path) as fh:
+                self.loads(fh.read())
+
+    def loads(self, text):
+        '''Add the records in text, one JSON document per line'''
+        for line in text.splitlines():
+            try:
+                self.records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    def dumps(self):
+        '''The newest max_records records, one JSON document per line'''
+        with self.lock:
+            self.records = self.records[-self.max_records:]
+            return ''.join(json.dumps(record, sort_keys=True) + '\n'
+                           for record in self.records)
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def pending(self, now=None):
+        now = time.time() if now is None else now
+        for record in self.records:
+            if record.get('status', None) is None:
+                if now - record.get('submitted', now) > PENDING_SECONDS:
+                    record['status'] = 'EXPIRED'
+                else:
+                    yield record
+
+    def finished(self, unit):
+        return [rec for rec in self.records
+                if rec.get('status', None) == 'FINISHED'
+                if rec.get('unit', None) == unit
+                if rec.get('seconds', None) is not None]
+
+    def save(self):
+        if self.path is None:
+            return
+        text = self.dumps()
+        write_atomic(self.path, lambda fh: fh.write(text))
+
+
+def _solve(matrix, vector):
+    '''Gaussian elimination for a small dense system; None if singular'''
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda i: abs(rows[i][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for i in range(n):
+            if i != col:
+                factor = rows[i][col] / rows[col][col]
+                rows[i] = [a - factor * b for a, b in zip(rows[i], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+
+class SizingModel(object):
+
+    def __init__(self, coefficients, history=None, min_history=8):
+        self.defaults = dict(coefficients)
+        self.fits = {}
+        for unit in ('events', 'bytes'):
+            samples = history.finished(unit) if history is not None else []
+            if len(samples) >= min_history:
+                fit = self.fit(samples)
+                if fit is not None:
+                    self.fits[unit] = fit
+
+    @staticmethod
+    def fit(records):
+        '''(overhead, per_sample, per_unit) by least squares, or None'''
+        xs = [(1.0, float(rec['samples']),
+               float(rec['units']) * max(1, rec['channels']))
+              for rec in records]
+        ys = [float(rec['seconds']) for rec in records]
+        xtx = [[sum(x[i] * x[j] for x in xs) for j in range(3)]
+               for i in range(3)]
+        xty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(3)]
+        solution = _solve(xtx, xty)
+        if solution is None or min(solution) < 0:
+            return None
+        return tuple(solution)
+
+    def coefficients(self, unit):
+        if unit in self.fits:
+            return self.fits[unit]
+        return (self.defaults.get('overhead', 0.0),
+                self.defaults.get('per_sample', 0.0),
+                self.defaults.get('per_event' if unit == 'events'
+                                  else 'per_byte', 0.0))
+
+    def estimate(self, unit, units, samples, channels):
+        (overhead, per_sample, per_unit) = self.coefficients(unit)
+        return overhead + per_sample * samples + \
+            per_unit * units * max(1, channels)
+
+    def size(self, unit, units, samples, channels, queues,
+             safety_factor=1.5, min_runtime=0, max_nodes=1,
+             uncalibrated_min_runtime=0):
+        '''Queue, node count and maxRunTime for one job
+
+        Until history has calibrated the model for unit, maxRunTime is at
+        least uncalibrated_min_runtime as well as min_runtime.
+        '''
+        estimate = self.estimate(unit, units, samples, channels)
+        if unit not in self.fits:
+            min_runtime = max(min_runtime, uncalibrated_min_runtime)
+        wanted = float(max(min_runtime, estimate * safety_factor))
+        limits = [(hms_seconds(q['max_runtime']), q['name']) for q in queues]
+        limits.sort()
+        for (limit, name) in limits:
+            if wanted <= limit:
+                return {'queue': name, 'nodes': 1,
+                        'maxRunTime': hms(wanted),
+                        'estimate': int(round(estimate)),
+                        'calibrated': unit in self.fits}
+        # Longer than any queue allows: spread over nodes where permitted
+        (limit, name) = limits[-1]
+        nodes = min(max(1, max_nodes), int(math.ceil(wanted / limit)))
+        return {'queue': name, 'nodes': nodes,
+                'maxRunTime': hms(min(limit, wanted / nodes)),
+                'estimate': int(round(estimate)),
+                'calibrated': unit in self.fits}
@@ -0,0 +1,145 @@
+"""
+Streaming reader for manifest JSON documents
+
+A manifest is one object whose 'samples' array can hold tens of thousands
+of entries. ManifestReader walks the document in fixed-size chunks and
+decodes one sample at a time, so neither the whole document nor an
+AttrDict over it is ever held in memory.
+"""
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class ManifestParseError(ValueError):
+    pass
+
+
+class _Tokens(object):
+    '''Buffered cursor over a JSON text read from a file handle'''
+
+    def __init__(self, fh, chunk_size=CHUNK_SIZE):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.fh.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed so the buffer stays small
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ManifestParseError('unexpected end of manifest')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ManifestParseError(
+                'expected one of {!r} at offset {}, got {!r}'.format(
+                    chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A scalar that runs to the end of the buffer may have been
+                # cut short by the chunk boundary (e.g. a number)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise ManifestParseError(
+                        'invalid JSON at offset {}'.format(self.pos))
+            self._fill()
+
+
+class ManifestReader(object):
+    '''Stream the top-level fields and samples of a manifest file
+
+    header() returns the top-level fields other than 'samples'. samples()
+    yields plain sample dicts one at a time, optionally only those with
+    collected: true. Each call makes its own pass over the file.
+    '''
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, data=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.data = data
+
+    @classmethod
+    def from_bytes(cls, data, chunk_size=CHUNK_SIZE):
+        '''Read a manifest already held in memory'''
+        return cls(None, chunk_size, data=data)
+
+    def _open(self):
+        if self.data is not None:
+            return io.TextIOWrapper(io.BytesIO(self.data), encoding='utf-8')
+        return io.open(self.path, 'r', encoding='utf-8')
+
+    def _walk(self, want_samples, keys=None):
+        with self._open() as fh:
+            tokens = _Tokens(fh, self.chunk_size)
+            tokens.expect('{')
+            if tokens.peek() == '}':
+                return
+            while True:
+                key = tokens.value()
+                tokens.expect(':')
+                if key == 'samples':
+                    tokens.expect('[')
+                    if tokens.peek() == ']':
+                        tokens.pos += 1
+                    else:
+                        while True:
+                            sample = tokens.value()
+                            if want_samples:
+                                yield ('sample', sample)
+                            if tokens.expect(',]') == ']':
+                                break
+                else:
+                    value = tokens.value()
+                    if not want_samples:
+                        yield (key, value)
+                        if keys is not None and key in keys:
+                            keys = keys - set([key])
+                            if len(keys) == 0:
+                                return
+                if tokens.expect(',}') == '}':
+                    return
+
+    def header(self, keys=None):
+        '''Top-level fields except samples
+
+        If keys is given, reading stops as soon as all of them are seen,
+        which skips the samples array when it comes last.
+        '''
+        wanted = None if keys is None else set(keys)
+        return dict(self._walk(False, wanted))
+
+    def samples(self, collected=True):
+        '''Yield sample dicts, by default only the collected ones'''
+        for _, sample in self._walk(True):
+            if not collected or sample.get('collected', False):
+                yield sample
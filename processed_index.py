@@ -0,0 +1,81 @@
+"""
+Index of what has been processed in a collection, per plan
+
+The index is a JSON document kept beside FCS-ETL outputs in the
+collection's processed directory. For each plan id it records every FCS
+file analysed (by checksum, with the job and archivePath holding its
+results), the color model inputs last built and the manifest versions
+processed. A newer manifest can then be reduced to the files that are
+new or have changed since.
+"""
+import hashlib
+import json
+
+
+def color_model_key(bead_sha1, blank_sha1, bead_model, bead_batch,
+                    cytometer_configuration, channels):
+    '''Digest of everything the color model is built from'''
+    document = json.dumps([bead_sha1, blank_sha1, bead_model, bead_batch,
+                           cytometer_configuration,
+                           [c['name'] for c in channels]], sort_keys=True)
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+class ProcessedIndex(object):
+
+    def __init__(self, document=None):
+        self.document = document if document is not None else {}
+        self.document.setdefault('plans', {})
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fh:
+            return cls(json.load(fh))
+
+    def plan(self, plan_id):
+        return self.document['plans'].get(plan_id, None)
+
+    def changed_files(self, plan_id, checksums):
+        '''URIs among (uri, sha1) pairs that are new or changed for plan_id
+
+        Files without a checksum cannot be compared and always count as
+        changed. Returns None when the plan has not been processed yet.
+        '''
+        entry = self.plan(plan_id)
+        if entry is None:
+            return None
+        files = entry.get('files', {})
+        return [uri for (uri, sha1) in checksums
+                if sha1 is None or sha1 != files.get(uri, {}).get(
+                    'checksum', None)]
+
+    def color_model(self, plan_id, key):
+        '''Previously uploaded color model inputs built from key, or None'''
+        entry = self.plan(plan_id)
+        if entry is None:
+            return None
+        model = entry.get('color_model', None)
+        if model is None or model.get('key', None) != key:
+            return None
+        return model
+
+    def last_version(self, plan_id):
+        entry = self.plan(plan_id)
+        if entry is None or len(entry.get('versions', [])) == 0:
+            return None
+        return entry['versions'][-1]
+
+    def merge(self, plan_id, version, files, color_model=None):
+        '''Record a run over files, a dict of URI to its file record'''
+        entry = self.document['plans'].setdefault(
+            plan_id, {'files': {}, 'color_model': None, 'versions': []})
+        entry['files'].update(files)
+        if color_model is not None:
+            entry['color_model'] = color_model
+        entry['versions'].append(version)
+        return entry
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.document, fh, sort_keys=True, indent=4,
+                      separators=(',', ': '))
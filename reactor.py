@@ -2,12 +2,32 @@
 Uses the plan referenced by a manifest to bootstrap an instance of FCS-ETL app
 """
 import datetime
+import fnmatch
+import hashlib
+import heapq
+import io
 import json
 import os
+import re
 import sys
-from time import sleep
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 from attrdict import AttrDict
 from reactors.utils import Reactor, agaveutils, process
+from agave_transport import AgaveTransport
+from artifact_bundle import dump_json, write_bundle
+from artifact_store import ArtifactStore
+from download_cache import DownloadCache
+from manifest_reader import ManifestReader
+from run_profile import Profiler, RunProfile
+from stage_graph import StageFailed, StageGraph
+import tasbe_templates
+# Helpers only some executions need (the pre-flight checks, job sizing,
+# replicate groups, incremental runs and the submission queue) are
+# imported where they are used, so a cache hit or a drain message does
+# not pay for them
 
 # import datetime
 # import json
@@ -20,6 +40,30 @@ from reactors.utils import Reactor, agaveutils, process
 
 PWD = os.getcwd()
 AGAVE_APP_ALIAS = 'fcs_etl_app'
+# example:
+# 'bob' 'was unable to call' 'karen' (id: ABCDEX, exec: BCDEG)
+TEMPLATE = "{} {} {} (actor/exec {} {})"
+# Settings that change what gets generated or submitted for a manifest
+CACHE_SETTINGS = ('destination', 'linked_reactors', 'job_params',
+                  'job_definition', 'sharding', 'prescan', 'incremental',
+                  'artifacts', 'replicate_groups')
+# Modules whose code shapes the generated artifacts; their source is part
+# of the artifact cache key, so editing any of them invalidates old runs
+ARTIFACT_MODULES = ('reactor', 'tasbe_templates', 'replicate_groups',
+                    'manifest_reader', 'artifact_bundle')
+# Page size when listing instrument_output to weight shards
+LIST_PAGE = 1000
+# Each run uploads into destination.base_path/<plan id>/<run id>, where the
+# run id is a prefix of the sha256 of its artifacts
+RUN_ID_LENGTH = 16
+RUN_ID = re.compile(r'^[0-9a-f]{%d}$' % RUN_ID_LENGTH)
+RENAMED_COPY = re.compile(r'^.+\.json\.\d{13}$')
+LATEST = 'latest.json'
+SAMPLE_URI_BASE = 'http://hub.sd2e.org/user/nicholasroehner/rule_30'
+# Manifests live in <collection>/manifest/, beside the data directories
+MANIFEST_PATTERN = '*/manifest/*.json'
+# FCS file checks that only run through a mounted source.local_root
+MOUNTED_CHECKS = ('verification', 'prescan')
 
 
 def on_success(self, successMessage):
@@ -36,445 +80,1852 @@ def on_failure(self, failMessage, exceptionObject):
     sys.exit(1)
 
 
-def sample_to_URI(plan,sample,base='http://hub.sd2e.org/user/nicholasroehner/rule_30',version='1'):
+class ManifestFailure(Exception):
+    '''Raised in batch mode to abandon a single manifest'''
+    pass
 
-    for i in plan['initialState']:
-        if i['Sample Id'] == sample:
-            try:
-                for c in i['Conditions']:
-                    for k in c:
-                        if k == 'IPTG_measure':
-                            iptg = c[k]
-                        if k == 'Larabinose_measure':
-                            ara = c[k]
-                        if k == 'aTc_measure':
-                            atc = str(c[k]).replace('.','p')
-                strains = []
-                for s in i['Strains']:
-                    strains.append(s['Strain Id'].split('#')[-1])
-
-                if len(strains)==1:
-                    strain_string = strains[0]
-                else:
-                    strain_string = 'pAN3928_pAN4036'
-
-                return '{}/{}_system_{}_{}_{}/{}'.format(base,strain_string,ara,atc,iptg,version)
-
-            except KeyError as e:
-                print 'Could not find all metadata for ',sample,e
-                return 'undefined'
 
+def on_batch_failure(self, failMessage, exceptionObject):
+    '''Failure handler for batch mode: report, then skip this manifest'''
+    self.loggers.slack.critical("{} : {}".format(failMessage, exceptionObject))
+    self.logger.critical("{} : {}".format(failMessage, exceptionObject))
+    raise ManifestFailure("{} : {}".format(failMessage, exceptionObject))
+
+
+class PlanIndex(object):
+    '''One-pass index over plan['initialState'], keyed by Sample Id
+
+    Holds the parsed strains, inducer measures and bead/blank flags for
+    each state so per-file lookups do not rescan the whole plan. Build it
+    once per plan and pass it wherever a plan is accepted. Sample URIs
+    are memoized, and equal URIs share one string.
+    '''
+
+    def __init__(self, plan):
+        self.samples = {}
+        self.uris = {}
+        self.shared_uris = {}
+        self.bead_sample = None
+        self.bead_model = None
+        self.bead_batch = None
+        self.blank_sample = None
+        for state in plan['initialState']:
+            sample_id = state.get('Sample Id', 'UNKNOWN')
+            entry = self._parse_state(state)
+            # First state with a given Sample Id wins, as in the old scan
+            self.samples.setdefault(sample_id, entry)
+            # Should only be one bead file and one blank/negative control
+            # file, until we're handling multiple channels, at which point
+            # we'll need more data to know which is which
+            if entry['bead_model'] is not None:
+                self.bead_sample = sample_id
+                self.bead_model = entry['bead_model']
+                self.bead_batch = entry['bead_batch']
+            if entry['is_blank']:
+                self.blank_sample = state['Sample Id']
+
+    @staticmethod
+    def _parse_state(state):
+        entry = {'iptg': None, 'ara': None, 'atc': None, 'strains': None,
+                 'bead_model': None, 'bead_batch': None,
+                 'is_bead': False, 'is_blank': False, 'error': None}
+        try:
+            for c in state['Conditions']:
+                for k in c:
+                    if k == 'IPTG_measure':
+                        entry['iptg'] = c[k]
+                    if k == 'Larabinose_measure':
+                        entry['ara'] = c[k]
+                    if k == 'aTc_measure':
+                        entry['atc'] = str(c[k]).replace('.', 'p')
+                if 'bead_model' in c and not entry['is_bead']:
+                    entry['is_bead'] = True
+                    entry['bead_model'] = c['bead_model']
+                    entry['bead_batch'] = c.get('bead_batch', 'Lot AJ02')  # This is a baby bumper for Q0
+                if c.get('Is_Blank', False) == True:  # noqa: E712
+                    entry['is_blank'] = True
+            entry['strains'] = [s['Strain Id'].split('#')[-1]
+                                for s in state['Strains']]
+        except KeyError as e:
+            entry['error'] = e
+        for key, name in (('iptg', 'IPTG_measure'),
+                          ('ara', 'Larabinose_measure'),
+                          ('atc', 'aTc_measure')):
+            if entry['error'] is None and entry[key] is None:
+                entry['error'] = KeyError(name)
+        return entry
+
+    def get(self, sample, default=None):
+        return self.samples.get(sample, default)
+
+    def uri(self, sample, base=SAMPLE_URI_BASE, version='1'):
+        '''sample_to_URI for one Sample Id, computed once per index'''
+        key = (sample, base, version)
+        if key in self.uris:
+            return self.uris[key]
+        entry = self.samples.get(sample)
+        if entry is None:
+            uri = None
+        elif entry['error'] is not None:
+            print 'Could not find all metadata for ', sample, entry['error']
+            uri = 'undefined'
+        else:
+            strains = entry['strains']
+            if len(strains) == 1:
+                strain_string = strains[0]
+            else:
+                strain_string = 'pAN3928_pAN4036'
+            uri = '{}/{}_system_{}_{}_{}/{}'.format(
+                base, strain_string, entry['ara'], entry['atc'],
+                entry['iptg'], version)
+            # Replicates under one condition share a single URI string
+            uri = self.shared_uris.setdefault(uri, uri)
+        self.uris[key] = uri
+        return uri
+
+    def __contains__(self, sample):
+        return sample in self.samples
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class ParsedInputs(object):
+    '''Parsed plans and cytometer configurations, by content digest
+
+    Manifests handled by one process (a batch message, or a backfill
+    worker) mostly share a plan and an instrument configuration, so each
+    document is parsed and indexed once. get() returns the dict of values
+    derived from a document, which callers fill in as needed. The most
+    recently used size documents are kept.
+    '''
+
+    def __init__(self, size=8):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, data):
+        key = hashlib.sha1(data).hexdigest()
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = {}
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+
+PARSED_INPUTS = ParsedInputs()
+
+
+def plan_index(plan):
+    '''Return a PlanIndex for plan, reusing it if one was passed in'''
+    if isinstance(plan, PlanIndex):
+        return plan
+    return PlanIndex(plan)
+
+
+def sample_to_URI(plan, sample, base=SAMPLE_URI_BASE, version='1'):
+
+    return plan_index(plan).uri(sample, base, version)
+
+
+class SampleRecord(object):
+    '''One experimental data entry: a file and the sample URI it measures
+
+    A slotted stand-in for {'file': ..., 'sample': ...} that keeps large
+    manifests small in memory. Item access works as on the dict, and
+    dump_json() writes it through as_dict().
+    '''
+    __slots__ = ('file', 'sample')
+    __hash__ = None
+
+    def __init__(self, file, sample):
+        self.file = file
+        self.sample = sample
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def as_dict(self):
+        return {'file': self.file, 'sample': self.sample}
 
-def file_and_parent(filepath):
-    '''Return a file and its parent directory'''
-    return os.path.join(os.path.basename(os.path.dirname(filepath)), os.path.basename(filepath))
+    def __eq__(self, other):
+        if isinstance(other, SampleRecord):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'SampleRecord({!r}, {!r})'.format(self.file, self.sample)
 
 
-def extract_experimental_data(manifest, plan):
+def file_and_parent(filepath):
+    '''Return a file and its parent directory'''
+    # Same result as joining basename(dirname()) and basename(), with
+    # fewer string copies; this runs once per file in the manifest
+    (head, _, name) = filepath.rpartition('/')
+    parent = head.rstrip('/').rpartition('/')[2]
+    return parent + '/' + name if parent else name
+
+
+def scan_samples(samples, plan):
+    '''Single pass over collected manifest samples
+
+    Accepts any iterable of sample dicts, such as ManifestReader.samples(),
+    and returns the experimental data entries (SampleRecords) together
+    with the bead and blank control files, so the manifest never has to be
+    walked twice.
+    scan['sample_ids'] maps each entry's file to its plan Sample Id.
+    '''
+    index = plan_index(plan)
+    scan = {'samples': [], 'bead_file': None, 'blank_file': None,
+            'collected': 0, 'checksums': [], 'sample_ids': {}}
+    for sample in samples:
+        if not sample['collected']:
+            continue
+        scan['collected'] += 1
+        scan['checksums'].extend([(f['file'], f.get('checksum', None))
+                                  for f in sample['files']])
+        if sample['sample'] == index.bead_sample:
+            # bead_file = sample['files'][0]['file']
+            scan['bead_file'] = file_and_parent(sample['files'][0]['file'])
+        if scan['blank_file'] is None and index.blank_sample is not None and \
+                sample['sample'] == index.blank_sample:
+            scan['blank_file'] = file_and_parent(sample['files'][0]['file'])
+        if 'beadcontrol' in sample['sample']:
+            continue
+        sample_uri = sample_to_URI(index, sample['sample'])
+        for f in sample['files']:
+            fname = file_and_parent(f['file'])
+            scan['samples'].append(SampleRecord(fname, sample_uri))
+            scan['sample_ids'][fname] = sample['sample']
+    if index.blank_sample is not None and scan['blank_file'] is None:
+        scan['blank_file'] = ''
+    return scan
+
+
+def extract_experimental_data(manifest, plan, scan=None):
+    if scan is None:
+        scan = scan_samples(manifest['samples'], plan)
     experimental_data = {}
-    samples = []
-    for sample in [s for s in manifest['samples'] if s['collected']]:
-        samples.extend([{'file': file_and_parent(f['file']),
-                         'sample': sample_to_URI(plan, sample['sample'])} for f in sample['files'] if 'beadcontrol' not in sample['sample']])
-    experimental_data['tasbe_experimental_data'] = {'samples': samples, 'rdf:about': manifest['rdf:about']}
+    experimental_data['tasbe_experimental_data'] = {'samples': scan['samples'], 'rdf:about': manifest['rdf:about']}
     return experimental_data
 
 
-def build_analysis_parameters():
-    analysis_parameters = json.loads('''{
-      "_comment1": "Information linking experiment FCS files to the appropriate cytometer channels, to be supplied by TA1/TA2",
-      "tasbe_analysis_parameters": {
-        "_comment1": "the rdf:about field is a URI that persistently identifies this analysis configuration",
-        "rdf:about": "placeholder",
-
-        "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
-        "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
-
-        "_comment3": "identifier linking to the color model for interpreting units.  Should typically be derived from the same process_control_data as is referenced in the experimental_data",
-        "color_model": "placeholder",
-
-        "_comment4": "identifier linking to the data collection to analyze",
-        "experimental_data": "placeholder",
-
-        "_comment5": "each replicate group collects a set of samples from the experimental collection under a label",
-        "replicate_groups": [{
-            "label": "",
-            "samples": []
-          }
-        ],
-
-        "TASBEConfig": {
-            "flow": {
-                "outputPointCloud": true,
-                "pointCloudPath": "output"
-            },
-            "OutputSettings": {
-                "StemName": "plots",
-                "FixedInputAxis": false
-            },
-            "outputDirectory": "output"
-        },
-        "_comment6": "additional configuration parameters",
-        "output": {
-          "title": "placeholder",
-          "plots": true,
-          "plots_folder": "plots",
-          "file": "./output/output.csv",
-          "quicklook": true,
-          "quicklook_folder": "./output/quicklook"
-        },
-        "channels": ["GFP"],
-        "_comment7": "additional parameters controlling data processing and output",
-        "additional_outputs": ["histogram", "point_clouds", "bayesdb_files"],
-        "min_valid_count": 100,
-        "pem_drop_threshold": 5,
-        "bin_min": 6,
-        "bin_max": 10,
-        "bin_width": 0.1
-      }
-    }''')
+def experimental_data_json(experimental_data, samples=None):
+    '''experimental_data (or one shard of it) with plain-dict samples
+
+    SampleRecords stay in memory until an artifact is written; this is
+    the point where they become JSON-ready dicts.
+    '''
+    data = experimental_data['tasbe_experimental_data']
+    if samples is None:
+        samples = data['samples']
+    return {'tasbe_experimental_data': dict(data, samples=[
+        s.as_dict() if isinstance(s, SampleRecord) else s for s in samples])}
+
+
+def build_analysis_parameters(groups=None):
+    analysis_parameters = tasbe_templates.load('analysis_parameters')
+    if groups:
+        params = analysis_parameters['tasbe_analysis_parameters']
+        params['replicate_groups'] = groups
     return analysis_parameters
 
 def build_color_model(channels):
-    color_model = json.loads('''{
-      "_comment1": "Parameters controlling conversion of process controls into an ERF color model, plus debugging/graphical outputs, to be supplied by TA1/TA2",
-      "tasbe_color_model_parameters": {
-        "_comment1": "the rdf:about field is a URI that persistently identifies this run configuration",
-        "rdf:about": "placeholder",
-
-        "TASBEConfig": {
-            "heatmapPlottype": "contour",
-            "plots": {
-                "plotPath": "plots"
-            }
-        },
-        "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
-        "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
-
-        "_comment3": "identifier linking to the process control data set to be run",
-        "process_control_data": "placeholder",
-
-        "_comment4": "For each channel, the species and how to process and display it",
-        "channel_parameters": [''' + ',\n'.join(['''{
-            "_comment1": "name must match a channel from the cytometer configuration",
-            "name": "''' + channels[c]['name'] + '''",
-            "_comment2": "a persistent URI linking to the actual species being quantified",
-            "species": "https://www.ncbi.nlm.nih.gov/protein/AMZ00011.1",
-            "_comment3": "Nickname for the species for charts",
-            "label": "GFP",
-            "_comment4": "cutoff for analysis",
-            "min": 2,
-            "_comment5": "primary color for lines on certain plots",
-            "chart_color": "y"
-          }''' for c in range(len(channels))]) + '''    ],
-        "_comment5": "Other processing parameters, to be exposed",
-        "tasbe_config": {
-          "gating": {
-            "type": "auto",
-            "k_components": 2
-          },
-          "autofluorescence": {
-            "type": "placeholder"
-          },
-          "compensation": {
-            "type": "placeholder"
-          },
-          "beads": {
-            "type": "placeholder"
-          }
-        },
-
-        "_comment6": "Cutoff for bead peak detection",
-        "bead_min": 2,
-
-        "_comment7": "Which channel is being used for unit calibration",
-        "ERF_channel_name": "''' + channels[0]['name'] + '''",
-
-        "_comment8": "additional parameters controlling data processing and output",
-        "translation_plot": false,
-        "noise_plot": false
-      }
-    }''') # Defaulting to first channel for ERF_channel_name; all channels' names will be "GFP"
+    color_model = tasbe_templates.load('color_model')
+    params = color_model['tasbe_color_model_parameters']
+    for channel in channels:
+        entry = tasbe_templates.load('color_model_channel')
+        entry['name'] = channel['name']
+        params['channel_parameters'].append(entry)
+    # Defaulting to first channel for ERF_channel_name; all channels' names will be "GFP"
+    params['ERF_channel_name'] = channels[0]['name']
     return color_model
 
-def build_process_control_data(plan, channels, experimental_data, cytometer_configuration_file_URI, manifest):
-    for state in plan['initialState']:
-        for condition in state.get('Conditions', []):
-            if 'bead_model' in condition:
-                bead_model = condition['bead_model']
-                bead_file_URI = state.get('Sample Id', 'UNKNOWN')
-                bead_batch = condition.get('bead_batch', 'Lot AJ02') # This is a baby bumper for Q0
-                break # Should only be one bead file, until we're handling multiple channels, at which point we'll need more data to know which is which
-
-    for sample in [s for s in manifest['samples'] if s['collected']]:
-        if sample['sample'] == bead_file_URI:
-            #bead_file = sample['files'][0]['file']
-            bead_file = file_and_parent(sample['files'][0]['file'])
-
-    for state in plan['initialState']:
-        for condition in state.get('Conditions', []):
-            if 'Is_Blank' in condition and condition['Is_Blank']==True:
-                blank_sample = state['Sample Id']
-                blank_file = ''
-                for sample in [s for s in manifest['samples'] if s['collected']]:
-                    if sample['sample'] == blank_sample:
-                        blank_file = file_and_parent(sample['files'][0]['file'])
-                        break
-                break # Should only be one blank/negative control file, until we're handling multiple channels, at which point we'll need more data to know which is which.
+def build_process_control_data(plan, channels, experimental_data,
+                               cytometer_configuration_file_URI, manifest,
+                               scan=None):
+    index = plan_index(plan)
+    if scan is None:
+        scan = scan_samples(manifest['samples'], index)
+    bead_model = index.bead_model
+    bead_batch = index.bead_batch
+    bead_file = scan['bead_file']
+    blank_file = scan['blank_file']
 
     positive_control_files = [''] * len(channels)
 
-    #beads and blanks/negative control
-    #channel names can come from cytometer config
-    process_control_data = json.loads('''{
-      "_comment1": "Information linking process control FCS files to the appropriate cytometer channels, to be supplied by TA3",
-      "tasbe_process_control_data": {
-        "_comment1": "the rdf:about field is a URI that persistently identifies this process control information set",
-        "rdf:about": "placeholder",
-
-        "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
-        "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
-
-        "_comment3": "identifier linking to the instrument and optical configuration used for collecting data",
-        "cyometer_configuration": "''' + cytometer_configuration_file_URI + '''",
-
-        "_comment4": "all files are URIs to the location of a file on the TA4 infrastructure",
-        "bead_file": "''' + bead_file + '''",
-        "_comment5": "name of the type of beads being used; must match an entry in the TASBE bead catalog https://github.com/TASBE/TASBEFlowAnalytics/blob/master/code/BeadCatalog.xlsx",
-        "_comment6": "name of the batch of beads being used; must match an entry in the TASBE bead catalog https://github.com/TASBE/TASBEFlowAnalytics/blob/master/code/BeadCatalog.xlsx",
-        "TASBEConfig": {
-            "beads": {
-                "beadModel": "''' + bead_model + '''",
-                "beadBatch": "''' + bead_batch + '''"
-            }
-        },
-
-        "_comment7": "the blank file should be wild-type or null transfection",
-        "blank_file": "''' + blank_file + '''",
-
-        "_comment8": "each channel should have a strong single positive control of the species it quantifies",
-        "channels": [''' +
-            ',\n'.join(['''      {
-            "_comment1": "name must match a channel from the cytometer configuration",
-            "name": "''' + channels[c]['name'] + '''",
-            "_comment2": "FCS file for single positive control",
-            "calibration_file": "''' + positive_control_files[c] + '''"
-          }''' for c in range(len(channels))]) + '''
-        ],
-
-        "_comment9": "cross-file pairs are for converting to FITC units; only needed if a fluorescent protein is measured outside the FITC channel",
-        "cross_file_pairs": []
-      }
-    }''') #Again, no support for multiple channels, so no cross-file pairs
+    # beads and blanks/negative control
+    # channel names can come from cytometer config
+    process_control_data = tasbe_templates.load('process_control_data')
+    params = process_control_data['tasbe_process_control_data']
+    params['cyometer_configuration'] = cytometer_configuration_file_URI
+    params['bead_file'] = bead_file
+    params['TASBEConfig']['beads']['beadModel'] = bead_model
+    params['TASBEConfig']['beads']['beadBatch'] = bead_batch
+    params['blank_file'] = blank_file
+    for c in range(len(channels)):
+        entry = tasbe_templates.load('process_control_channel')
+        entry['name'] = channels[c]['name']
+        entry['calibration_file'] = positive_control_files[c]
+        params['channels'].append(entry)
+    # Again, no support for multiple channels, so no cross-file pairs
     return process_control_data
 
 
-def main():
+def download_bytes(agaveClient, systemId, agaveAbsolutePath):
+    '''Contents of a remote file, read into memory'''
+    rsp = agaveClient.files.download(systemId=systemId,
+                                     filePath=agaveAbsolutePath)
+    if isinstance(rsp, dict):
+        raise Exception(rsp.get('message', 'could not download {}'.format(
+            agaveAbsolutePath)))
+    return rsp.content
+
+
+def upload_bytes(agaveClient, systemId, agaveDestPath, name, data):
+    '''Upload data as agaveDestPath/name without a local copy'''
+    fh = io.BytesIO(data)
+    fh.name = name
+    agaveClient.files.importData(systemId=systemId, filePath=agaveDestPath,
+                                 fileName=name, fileToUpload=fh)
+
+
+def download_files(r, downloads, store, workers=4, timeout=None, cache=None):
+    '''Fetch several Agave files concurrently on a bounded thread pool
+
+    downloads is a list of (agave_uri, name) pairs; each file is read into
+    store under its name. Returns one dict per download, in the same
+    order, with the remote absolute path, the name and any error raised
+    (or timeout hit) fetching it. If a DownloadCache is given, current
+    cached copies are reused.
+    '''
+    results = []
+    for uri, local_filename in downloads:
+        result = {'uri': uri, 'system': None, 'path': None,
+                  'local': local_filename, 'file': None, 'error': None}
+        try:
+            (system, dirpath, filename) = agaveutils.from_agave_uri(uri)
+            result['system'] = system
+            result['path'] = os.path.join(dirpath, filename)
+        except Exception as e:
+            result['error'] = e
+        results.append(result)
+
+    def _fetch(result):
+        if cache is not None:
+            data = cache.fetch_bytes(r.client, download_bytes, result['uri'],
+                                     result['system'], result['path'])
+        else:
+            data = download_bytes(r.client, result['system'], result['path'])
+        return store.put(result['local'], data)
+
+    todo = [res for res in results if res['error'] is None]
+    if len(todo) > 0:
+        pool = ThreadPool(processes=max(1, min(workers, len(todo))))
+        try:
+            pending = [pool.apply_async(_fetch, (res,)) for res in todo]
+            deadline = None if timeout is None else time.time() + timeout
+            for result, job in zip(todo, pending):
+                wait = None if deadline is None else \
+                    max(0, deadline - time.time())
+                try:
+                    result['file'] = job.get(wait)
+                except TimeoutError:
+                    result['error'] = Exception(
+                        'timed out after {}s'.format(timeout))
+                except Exception as e:
+                    result['error'] = e
+        finally:
+            pool.terminate()
+
+    for result in results:
+        if result['error'] is not None:
+            r.logger.error("could not fetch {}: {}".format(
+                result['uri'], result['error']))
+    return results
+
+
+def shard_file(fname, i):
+    '''Name of shard i's copy of the artifact fname'''
+    (root, ext) = os.path.splitext(fname)
+    return '{}_shard{}{}'.format(root, i, ext)
+
+
+def unshard_file(fname, i):
+    '''fname without shard i's suffix, the inverse of shard_file'''
+    (root, ext) = os.path.splitext(fname)
+    suffix = '_shard{}'.format(i)
+    if root.endswith(suffix):
+        return root[:-len(suffix)] + ext
+    return fname
+
+
+def shard_inputs(inputs, i):
+    '''inputs as seen by shard i
+
+    An input named name.N belongs to shard N only; for shard i, name.i
+    replaces name and the other shards' copies are left out.
+    '''
+    selected = {}
+    for (k, v) in inputs.items():
+        (base, _, index) = k.rpartition('.')
+        if base == '' or not index.isdigit():
+            selected.setdefault(k, v)
+        elif int(index) == i:
+            selected[base] = v
+    return selected
+
+
+def bundle_artifacts(store, datafiles, n_shards, input_name):
+    '''Pack datafiles into gzipped tar bundles, returning the new datafiles
+
+    Unsharded runs get one bundle for input_name. Sharded runs get one
+    bundle per shard, input_name.N, holding the shared artifacts and that
+    shard's own copies (see shard_inputs) under their unsharded names.
+    '''
+    if n_shards == 0:
+        members = dict((k, (v, store.get(v))) for (k, v) in datafiles.items())
+        return {input_name: store.put('artifacts.tar.gz',
+                                      write_bundle(members))}
+    bundles = {}
+    for i in range(n_shards):
+        members = {}
+        for (k, fname) in shard_inputs(datafiles, i).items():
+            members[k] = (unshard_file(fname, i), store.get(fname))
+        bundles['{}.{}'.format(input_name, i)] = store.put(
+            'artifacts_shard{}.tar.gz'.format(i), write_bundle(members))
+    return bundles
+
+
+def upload_files(r, store, datafiles, dest_sys, dest_dir, workers=5,
+                 timeout=None):
+    '''Upload each artifact concurrently
+
+    datafiles maps app input names to artifacts in store. dest_dir is a fresh
+    run directory, so nothing needs moving out of the way first. Each
+    file is uploaded on its own worker and the stage takes as long as the
+    slowest file. Returns (job_def_inputs, failed) where failed is None
+    or the (filename, exception) of the first upload to fail; remaining
+    work is abandoned.
+    '''
+    def _upload(item):
+        (agaveparam, fname) = item
+        r.logger.info("uploading {} to {}".format(fname, dest_dir))
+        try:
+            upload_bytes(r.client, dest_sys, dest_dir, fname, store.get(fname))
+        except Exception as e:
+            return (agaveparam, fname, e)
+        return (agaveparam, fname, None)
 
-    r = Reactor()
-    m = AttrDict(r.context.message_dict)
-    # Look up my own name
-    actor_name = r.get_attr('name')
-    # example:
-    # 'bob' 'was unable to call' 'karen' (id: ABCDEX, exec: BCDEG)
-    template = "{} {} {} (actor/exec {} {})"
-    # override on_failure and on_success
-    funcType = type(r.on_failure)
-    r.on_failure = funcType(on_failure, r, Reactor)
-    funcType = type(r.on_success)
-    r.on_success = funcType(on_success, r, Reactor)
+    job_def_inputs = {}
+    items = list(datafiles.items())
+    if len(items) == 0:
+        return (job_def_inputs, None)
+    pool = ThreadPool(processes=max(1, min(workers, len(items))))
+    try:
+        completed = pool.imap_unordered(_upload, items)
+        deadline = None if timeout is None else time.time() + timeout
+        for _ in items:
+            wait = None if deadline is None else max(0, deadline - time.time())
+            try:
+                (agaveparam, fname, error) = completed.next(wait)
+            except TimeoutError:
+                pending = [f for (p, f) in items if p not in job_def_inputs]
+                return (job_def_inputs, (', '.join(pending), Exception(
+                    'timed out after {}s'.format(timeout))))
+            if error is not None:
+                return (job_def_inputs, (fname, error))
+            # Entries in this dict are needed to submit the FCS-ETL job later
+            job_def_inputs[agaveparam] = agaveutils.to_agave_uri(
+                dest_sys, os.path.join(dest_dir, fname))
+    finally:
+        pool.terminate()
+    return (job_def_inputs, None)
+
+
+def download_cache(r):
+    '''DownloadCache for shared inputs, or None if disabled or unusable'''
+    settings = r.settings.get('download_cache', {})
+    if not settings.get('enabled', False):
+        return None
+    try:
+        return DownloadCache(settings.get('directory'),
+                             int(settings.get('max_bytes', 512 * 1024 * 1024)))
+    except Exception as e:
+        r.logger.warning("download cache unavailable: {}".format(e))
+        return None
 
-    r.logger.debug("message: {}".format(m))
-    # Use JSONschema-based message validator
-    # - In theory, this obviates some get() boilerplate
-    if not r.validate_message(m):
+
+def shard_count(r, files):
+    '''How many FCS-ETL jobs to split a manifest with this many files into'''
+    sharding = r.settings.get('sharding', {})
+    shards = int(sharding.get('shards', 1))
+    min_files = max(1, int(sharding.get('min_files', 1)))
+    return max(1, min(shards, files // min_files))
+
+
+def remote_listing(r, system, path):
+    '''Every entry of a remote directory, fetched a page at a time'''
+    entries = []
+    offset = 0
+    while True:
+        page = r.client.files.list(systemId=system, filePath=path,
+                                   limit=LIST_PAGE, offset=offset)
+        entries.extend(entry for entry in page if entry['name'] != '.')
+        if len(page) < LIST_PAGE:
+            return entries
+        offset += LIST_PAGE
+
+
+def instrument_listing(r, system, path, purpose='listing'):
+    '''Map file name to its Agave listing entry, or {} if unlisted'''
+    try:
+        return dict((entry['name'], entry)
+                    for entry in remote_listing(r, system, path)
+                    if entry.get('type', 'file') == 'file')
+    except Exception as e:
+        r.logger.warning("could not list {} for {}: {}".format(
+            path, purpose, e))
+        return {}
+
+
+def instrument_file_sizes(r, system, path):
+    '''Map file name to length for a remote directory, or {} if unlisted'''
+    return dict((name, int(entry['length'])) for name, entry in
+                instrument_listing(r, system, path, 'shard weights').items())
+
+
+class SourceFiles(object):
+    '''stat() and fetch() for FCS files named by Agave URI
+
+    Files are read in place under source.local_root, where the storage
+    system is mounted, so nothing is downloaded or written locally.
+    fcs_checks() only runs the checks that use this when it is set.
+    '''
+
+    def __init__(self, r):
+        self.local_root = r.settings.get('source', {}).get('local_root')
+
+    def _local(self, uri):
+        (system, dirpath, filename) = agaveutils.from_agave_uri(uri)
+        return os.path.join(self.local_root, dirpath.lstrip('/'), filename)
+
+    def stat(self, uri):
+        st = os.stat(self._local(uri))
+        return (st.st_size, st.st_mtime)
+
+    def fetch(self, uri):
+        return (self._local(uri), False)
+
+
+def fcs_checks(r, log=False):
+    '''{'verification': bool, 'prescan': bool}: the checks that will run
+
+    Checks in MOUNTED_CHECKS read files through the storage system
+    mounted at source.local_root. Without one they would download every
+    FCS file in full before anything is submitted, so they are skipped,
+    with a warning when log is set.
+    '''
+    mounted = r.settings.get('source', {}).get('local_root', None) is not None
+    checks = {}
+    for name in ('verification', 'prescan'):
+        checks[name] = r.settings.get(name, {}).get('enabled', False)
+        if checks[name] and not mounted and name in MOUNTED_CHECKS:
+            checks[name] = False
+            if log:
+                r.logger.warning("skipping FCS {}: source.local_root is not "
+                                 "set".format(name))
+    return checks
+
+
+def inspect_sources(r, source, checksums, uris, checks):
+    '''sha1 and FCS header of each file, as configured, one fetch per file
+
+    Verification covers the entries of checksums ((agave_uri, sha1)) that
+    have a sha1, and the pre-scan covers uris; a check that is not in
+    checks (from fcs_checks()) covers nothing. Returns (sha1s, headers),
+    each mapping URI to the result or to the error that prevented
+    computing it.
+    '''
+    from fcs_header import read_header
+    from fcs_verify import FileRecord, inspect_all, sha1_file
+    inspections = []
+    workers = 1
+    for (name, keys, inspect) in (
+            ('verification', [uri for (uri, sha1) in checksums if sha1],
+             sha1_file),
+            ('prescan', uris, read_header)):
+        settings = r.settings.get(name, {})
+        if not checks[name]:
+            keys = []
+        else:
+            workers = max(workers, int(settings.get('workers', 8)))
+        inspections.append((keys, inspect, FileRecord(
+            settings.get('cache_file', None), r.logger)))
+    return tuple(inspect_all(source.stat, source.fetch, inspections,
+                             workers=workers))
+
+
+def check_headers(headers, uris, channels):
+    '''Check FCS headers against the configured channels
+
+    Returns (events, empty, problems): the $TOT event count per URI, the
+    URIs of files with no events, and (agave_uri, error) for files that
+    could not be read or lack a configured channel.
+    '''
+    wanted = [c['name'] for c in channels]
+    events = OrderedDict()
+    empty = []
+    problems = []
+    for uri in OrderedDict.fromkeys(uris):
+        header = headers[uri]
+        if isinstance(header, Exception):
+            problems.append((uri, header))
+            continue
+        missing = [c for c in wanted if c not in header['channels']]
+        if len(missing) > 0:
+            problems.append((uri, Exception(
+                'channel(s) {} not among {}'.format(
+                    ', '.join(missing), ', '.join(header['channels'])))))
+            continue
+        events[uri] = header['tot']
+        if header['tot'] == 0:
+            empty.append(uri)
+    return (events, empty, problems)
+
+
+def shard_samples(samples, shards, sizes=None):
+    '''Split experimental data entries into balanced shards
+
+    Entries for the same sample URI (replicates of one condition) stay in
+    one shard. Groups are placed largest first onto the lightest shard,
+    each file weighted by its size in sizes (file name -> bytes) or by the
+    mean known size when it is missing. Empty shards are dropped.
+    '''
+    sizes = sizes or {}
+    default = float(sum(sizes.values())) / len(sizes) if sizes else 1.0
+    groups = OrderedDict()
+    for position, entry in enumerate(samples):
+        key = entry['sample']
+        if key in (None, 'undefined'):
+            # Unresolved samples are not replicates of each other
+            key = ('unresolved', position)
+        groups.setdefault(key, []).append(entry)
+
+    def weight(group):
+        return sum(sizes.get(os.path.basename(e['file']), default)
+                   for e in group)
+
+    heap = [(0, i, []) for i in range(max(1, shards))]
+    for group in sorted(groups.values(), key=weight, reverse=True):
+        (load, i, members) = heapq.heappop(heap)
+        members.extend(group)
+        heapq.heappush(heap, (load + weight(group), i, members))
+    return [shard for (_, _, shard) in sorted(heap, key=lambda s: s[1])
+            if len(shard) > 0]
+
+
+def submit_jobs(r, job_defs, workers=4):
+    '''Submit job definitions concurrently
+
+    Returns one (job_id, error) pair per definition, in the same order.
+    '''
+    def _submit(job_def):
+        try:
+            return (r.client.jobs.submit(body=job_def)['id'], None)
+        except Exception as e:
+            return (None, e)
+
+    if len(job_defs) == 1:
+        return [_submit(job_defs[0])]
+    pool = ThreadPool(processes=max(1, min(workers, len(job_defs))))
+    try:
+        return pool.map(_submit, job_defs)
+    finally:
+        pool.terminate()
+
+
+def job_history(r):
+    '''JobHistory from sizing.history_file and sizing.history_uri
+
+    The copy at history_uri (agave://) is what lets the model calibrate
+    across executions. One that exists but cannot be read is not written
+    back, so a passing error does not wipe it.
+    '''
+    from job_sizing import JobHistory
+    settings = r.settings.get('sizing', {})
+    try:
+        history = JobHistory(settings.get('history_file', None))
+    except Exception as e:
+        r.logger.warning("job history unavailable: {}".format(e))
+        history = JobHistory()
+    uri = settings.get('history_uri', None)
+    if uri is None:
+        return history
+    try:
+        (system, dirpath, filename) = agaveutils.from_agave_uri(uri)
+        path = os.path.join('/', dirpath, filename)
+        r.client.files.list(systemId=system, filePath=path)
+    except Exception as e:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+        if status == 404:
+            history.uri = uri
+        else:
+            r.logger.warning("could not check for {}: {}".format(uri, e))
+        return history
+    try:
+        history.loads(download_bytes(r.client, system, path).decode('utf-8'))
+        history.uri = uri
+    except Exception as e:
+        r.logger.warning("could not read {}: {}".format(uri, e))
+    return history
+
+
+def save_job_history(r, history):
+    '''Write history to its file and URI; failures are logged and ignored'''
+    try:
+        history.save()
+    except Exception as e:
+        r.logger.warning("could not save job history: {}".format(e))
+    if history.uri is None:
+        return
+    try:
+        (system, dirpath, filename) = agaveutils.from_agave_uri(history.uri)
+        upload_bytes(r.client, system, os.path.join('/', dirpath), filename,
+                     history.dumps().encode('utf-8'))
+    except Exception as e:
+        r.logger.warning("could not save job history to {}: {}".format(
+            history.uri, e))
+
+
+def refresh_job_history(r, history, limit=20):
+    '''Record how long earlier jobs ran, for those that have since ended'''
+    from job_sizing import parse_timestamp
+    for record in list(history.pending())[:limit]:
+        try:
+            job = r.client.jobs.get(jobId=record['job_id'])
+            status = job.get('status', None)
+            if status == 'FINISHED':
+                record['seconds'] = parse_timestamp(job['endTime']) - \
+                    parse_timestamp(job['startTime'])
+                record['status'] = status
+            elif status in ('FAILED', 'STOPPED', 'KILLED'):
+                # Runs cut short say nothing about how long they needed
+                record['status'] = status
+        except Exception as e:
+            r.logger.warning("could not fetch job {}: {}".format(
+                record.get('job_id', None), e))
+
+
+def job_work(samples, scan, sizes):
+    '''(unit, units) of TASBE work for a job reading these samples'''
+    if 'events' in scan:
+        return ('events', sum(scan['events'].get(entry['file'], 0)
+                              for entry in samples))
+    sizes = sizes or {}
+    return ('bytes', sum(sizes.get(os.path.basename(entry['file']), 0)
+                         for entry in samples))
+
+
+def size_jobs(r, job_defs, job_samples, scan, channels, sizes, history):
+    '''Set batchQueue, nodeCount and maxRunTime on each job definition
+
+    history should already have been brought up to date with
+    refresh_job_history().
+
+    Returns the sizing dict for each job, including the unit of work and
+    its amount so the job can be added to history once submitted.
+    '''
+    from job_sizing import SizingModel
+    settings = r.settings.get('sizing', {})
+    model = SizingModel(settings.get('coefficients', {}), history,
+                        int(settings.get('min_history', 8)))
+    sizings = []
+    for (job_def, samples) in zip(job_defs, job_samples):
+        (unit, units) = job_work(samples, scan, sizes)
+        sizing = model.size(
+            unit, units, len(samples), len(channels),
+            settings.get('queues', [{'name': job_def.batchQueue,
+                                     'max_runtime': job_def.maxRunTime}]),
+            safety_factor=float(settings.get('safety_factor', 1.5)),
+            min_runtime=int(settings.get('min_runtime', 0)),
+            max_nodes=int(settings.get('max_nodes', 1)),
+            uncalibrated_min_runtime=int(
+                settings.get('uncalibrated_min_runtime', 0)))
+        job_def.batchQueue = sizing['queue']
+        job_def.nodeCount = sizing['nodes']
+        job_def.maxRunTime = sizing['maxRunTime']
+        sizing.update({'unit': unit, 'units': units,
+                       'samples': len(samples), 'channels': len(channels)})
+        sizings.append(sizing)
+    return sizings
+
+
+def submission_queue(r):
+    '''SubmissionQueue from settings, or None to submit directly'''
+    settings = r.settings.get('submission_queue', {})
+    if not settings.get('enabled', False):
+        return None
+    if not settings.get('directory', None):
+        r.logger.warning("submission queue unavailable: "
+                         "submission_queue.directory is not set")
+        return None
+    from submit_queue import SubmissionQueue
+    try:
+        return SubmissionQueue(
+            settings.get('directory'),
+            caps={'system': settings.get('system_caps', {}),
+                  'app': settings.get('app_caps', {})},
+            max_attempts=int(settings.get('max_attempts', 8)),
+            backoff_seconds=float(settings.get('backoff_seconds', 30)),
+            max_backoff_seconds=float(settings.get('max_backoff_seconds',
+                                                   1800)),
+            status_limit=int(settings.get('status_limit', 50)),
+            status_workers=int(settings.get('status_workers', 8)))
+    except Exception as e:
+        r.logger.warning("submission queue unavailable: {}".format(e))
+        return None
+
+
+def execution_system(r, app_id):
+    '''Execution system an app runs on, for per-system caps'''
+    systems = r.settings.get('submission_queue', {}).get(
+        'execution_systems', {}) or {}
+    if app_id in systems:
+        return systems[app_id]
+    try:
+        return r.client.apps.get(appId=app_id)['executionSystem']
+    except Exception as e:
+        r.logger.warning("could not look up system for {}: {}".format(
+            app_id, e))
+        return None
+
+
+def drain_submissions(r, queue, refresh=True):
+    '''Submit queued jobs as far as the caps allow; returns the summary
+
+    refresh=False skips the job status checks (see SubmissionQueue.drain)
+    '''
+    summary = queue.drain(
+        lambda job_def: r.client.jobs.submit(body=job_def)['id'],
+        lambda job_id: r.client.jobs.get(jobId=job_id)['status'],
+        refresh=refresh)
+    history = None
+    for group in summary['completed']:
+        finish_run(r, group['record'], group['job_ids'])
+    for group in summary['abandoned']:
+        r.logger.error("not recording run {}: a job could not be "
+                       "submitted".format(group['record']['record']['run']))
+    for entry in summary['submitted']:
+        r.logger.info("submitted queued job {} for {}".format(
+            entry['job_id'], entry.get('label', None)))
+        if entry.get('sizing', None) is not None:
+            history = history or job_history(r)
+            history.add(dict(entry['sizing'], job_id=entry['job_id'],
+                             submitted=entry['submitted']))
+    for entry in summary['failed']:
+        r.logger.critical("gave up submitting {} for {} after {} attempts: "
+                          "{}".format(entry['id'], entry.get('label', None),
+                                      entry['attempts'], entry['error']))
+    if history is not None:
+        save_job_history(r, history)
+    return summary
+
+
+def request_drain(r, queue):
+    '''Send this actor a {"drain": true} message unless a drainer is live
+
+    Returns whether a message was sent.
+    '''
+    settings = r.settings.get('submission_queue', {})
+    if not settings.get('drain_messages', True):
+        return False
+    owner = 'requested by {}'.format(r.execid)
+    stale = 2 * float(settings.get('drain_seconds', 600))
+    if not queue.claim_drainer(owner, stale, running=False):
+        return False
+    try:
+        r.client.actors.sendMessage(
+            actorId=r.uid, body={'message': json.dumps({'drain': True})})
+    except Exception as e:
+        queue.release_drainer(owner)
+        r.logger.warning("could not request a drain: {}".format(e))
+        return False
+    return True
+
+
+def run_drainer(r, queue):
+    '''Drain every poll_seconds until the queue empties or drain_seconds pass
+
+    Only one execution drains at a time; another just drains once. One
+    that stops with jobs still waiting requests the next drain. Returns
+    the last summary.
+    '''
+    settings = r.settings.get('submission_queue', {})
+    budget = float(settings.get('drain_seconds', 600))
+    poll = float(settings.get('poll_seconds', 60))
+    deadline = time.time() + budget
+    if not queue.claim_drainer(r.execid, 2 * budget):
+        return drain_submissions(r, queue)
+    try:
+        summary = drain_submissions(r, queue)
+        while summary['waiting'] > 0 and time.time() + poll < deadline:
+            time.sleep(poll)
+            queue.claim_drainer(r.execid, 2 * budget)
+            summary = drain_submissions(r, queue)
+    finally:
+        queue.release_drainer(r.execid)
+    if summary['waiting'] > 0:
+        request_drain(r, queue)
+    return summary
+
+
+def queue_jobs(r, queue, job_defs, label, sizings=None, systems=None,
+               run=None):
+    '''Enqueue job definitions, then drain the queue
+
+    This drain makes no job status calls; if jobs are left waiting, a
+    drain message (see run_drainer) frees their slots later. Returns one
+    (job_id, error) pair per definition like submit_jobs(); jobs still
+    waiting for capacity have neither. systems maps app ids to execution
+    systems already looked up. run, if given, is finished (see
+    finish_run) by whichever drain submits the last of the jobs.
+    '''
+    entry_ids = []
+    systems = dict(systems or {})
+    group = None
+    if run is not None:
+        group = queue.add_group(len(job_defs), run)
+    for (i, job_def) in enumerate(job_defs):
+        if job_def.appId not in systems:
+            systems[job_def.appId] = execution_system(r, job_def.appId)
+        extra = {'sizing': sizings[i]} if sizings else {}
+        if group is not None:
+            extra.update(group=group, position=i)
+        entry_ids.append(queue.enqueue(
+            job_def, systems[job_def.appId], label, extra))
+    summary = drain_submissions(r, queue, refresh=False)
+    if summary['waiting'] > 0:
+        request_drain(r, queue)
+    job_ids = dict((entry['id'], entry['job_id'])
+                   for entry in summary['submitted'])
+    errors = dict((entry['id'], Exception(entry['error']))
+                  for entry in summary['failed'])
+    return [(job_ids.get(entry_id, None), errors.get(entry_id, None))
+            for entry_id in entry_ids]
+
+
+def finish_run(r, run, job_ids, graph=None, processed=None):
+    '''Record a run whose jobs have all been submitted
+
+    run is the description process_manifest builds; job_ids are its jobs'
+    ids in order. Points latest.json at the run, stores it in the artifact
+    cache and merges its files into the processed index (processed, if
+    already fetched, or a fresh copy). Failures are logged and ignored.
+    Stages are added to graph when given so they overlap with its work.
+    '''
+    own_graph = graph is None
+    if own_graph:
+        graph = StageGraph(workers=3)
+    job_id = ','.join(job_ids)
+    record = dict(run['record'], job_id=job_id, shards=None)
+    if run['shards'] is not None:
+        record['shards'] = dict(zip(run['shards'], job_ids))
+    try:
+        (dest_sys, plan_dir) = run['latest']
+        graph.add('save_latest', lambda: save_latest(
+            r, dest_sys, plan_dir, record))
+        if run['cache_key'] is not None:
+            graph.add('cache_store', lambda: cache_store(
+                r, artifact_cache(r), run['cache_key'], record))
+        index = run['index']
+        if index is not None:
+            (system, directory, name) = index['location']
+
+            def _save_index():
+                merged = processed
+                if merged is None:
+                    merged = fetch_processed_index(r, system, directory, name)
+                    if merged is None:
+                        return
+                files = {}
+                for (sub_id, job_files) in zip(job_ids, index['files']):
+                    for (uri, entry) in job_files.items():
+                        files[uri] = dict(entry, job_id=sub_id)
+                color_model = None
+                if index['color_model'] is not None:
+                    color_model = dict(index['color_model'], job_id=job_id)
+                merged.merge(index['plan_id'], dict(
+                    index['version'], job_id=job_id, files=len(files)),
+                    files, color_model)
+                save_processed_index(r, merged, system, directory, name)
+            graph.add('save_index', _save_index)
+        for stage in ('save_latest', 'cache_store', 'save_index'):
+            if stage in graph:
+                try:
+                    graph.result(stage)
+                except StageFailed as e:
+                    r.logger.warning("{}: {}".format(e.stage, e.error))
+    finally:
+        if own_graph:
+            graph.close()
+
+
+def queued_run(r, cache_key):
+    '''The run description of a queued run for cache_key, or None'''
+    queue = submission_queue(r)
+    if queue is None:
+        return None
+    try:
+        for group in queue.groups().values():
+            if group['record'].get('cache_key', None) == cache_key:
+                return group['record']
+    except Exception as e:
+        r.logger.warning("could not read the submission queue: {}".format(e))
+    return None
+
+
+def inputs_digest(r, manifest_uri, documents):
+    '''Content hash over the downloaded inputs and artifact-shaping settings
+
+    Covers the manifest URI (it decides archivePath), the bytes of each
+    downloaded document, the settings named in CACHE_SETTINGS and the
+    source of ARTIFACT_MODULES, so template changes also invalidate
+    earlier runs.
+    '''
+    digest = hashlib.sha256()
+    digest.update(manifest_uri.encode('utf-8'))
+    for document in documents:
+        digest.update(document)
+    digest.update(source_digest().encode('utf-8'))
+    settings = dict((k, r.settings.get(k, None)) for k in CACHE_SETTINGS)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def source_digest(directory=None, modules=ARTIFACT_MODULES):
+    '''sha256 over the source files of modules, found beside this one'''
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in modules:
+        digest.update(name.encode('utf-8'))
+        with open(os.path.join(directory, name + '.py'), 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_cache(r):
+    '''Persistent content-hash index, or None if it cannot be reached'''
+    if not r.settings.get('cache', {}).get('enabled', True):
+        return None
+    try:
+        from agavedb import AgaveKeyValStore
+        return AgaveKeyValStore(r.client)
+    except Exception as e:
+        r.logger.warning("artifact cache unavailable: {}".format(e))
+        return None
+
+
+def cache_lookup(r, db, key):
+    '''Return the record stored for key, or None'''
+    if db is None:
+        return None
+    try:
+        record = db.get(key)
+        if record is None:
+            return None
+        return json.loads(record)
+    except Exception as e:
+        r.logger.debug("no cache record for {} ({})".format(key, e))
+        return None
+
+
+def cache_store(r, db, key, record):
+    '''Save record under key; failure to do so is logged and ignored'''
+    if db is None:
+        return
+    try:
+        db.set(key, json.dumps(record, sort_keys=True))
+    except Exception as e:
+        r.logger.warning("could not save cache record {}: {}".format(key, e))
+
+
+def preflight_checks(r, scan, channels, actor_name, profile):
+    '''Verify checksums and pre-scan FCS headers, as configured
+
+    Failures go through on_failure. Files without events are dropped from
+    scan['samples'], and scan['events'] maps each remaining file (in the
+    same form as the experimental data entries) to its event count.
+    '''
+    template = TEMPLATE
+    checks = fcs_checks(r, log=True)
+    if not any(checks.values()):
+        return
+    from fcs_verify import checksum_mismatches
+    uris = [uri for (uri, sha1) in scan['checksums']]
+    source = SourceFiles(r)
+    # Both checks read each file once, in place
+    r.logger.debug("inspecting {} FCS files".format(len(uris)))
+    try:
+        (sha1s, headers) = inspect_sources(r, source, scan['checksums'],
+                                           uris, checks)
+    except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'got an invalid message', m, r.uid, r.execid), None)
+            actor_name, 'was unable to inspect',
+            'FCS files', r.uid, r.execid), e)
+    profile.lap('inspect', files=len(uris))
+
+    if checks['verification']:
+        mismatches = checksum_mismatches(scan['checksums'], sha1s)
+        profile.lap('verify', files=len(sha1s),
+                    mismatches=len(mismatches))
+        for (uri, expected, found) in mismatches:
+            r.logger.error("{} expected sha1 {} but found {}".format(
+                uri, expected, found))
+        if len(mismatches) > 0:
+            (uri, expected, found) = mismatches[0]
+            r.on_failure(template.format(
+                actor_name, 'found {} FCS file(s) failing verification,'
+                ' including'.format(len(mismatches)),
+                uri, r.uid, r.execid),
+                Exception('expected sha1 {} but found {}'.format(
+                    expected, found)))
+
+    if checks['prescan']:
+        (events, empty, problems) = check_headers(headers, uris, channels)
+        profile.lap('prescan', files=len(uris), empty=len(empty),
+                    events=sum(events.values()))
+        for (uri, error) in problems:
+            r.logger.error("{}: {}".format(uri, error))
+        if len(problems) > 0:
+            (uri, error) = problems[0]
+            r.on_failure(template.format(
+                actor_name, 'found {} unusable FCS file(s),'
+                ' including'.format(len(problems)),
+                uri, r.uid, r.execid), error)
+        dropped = set(file_and_parent(uri) for uri in empty)
+        for control in (scan['bead_file'], scan['blank_file']):
+            if control in dropped:
+                r.on_failure(template.format(
+                    actor_name, 'found no events in control',
+                    control, r.uid, r.execid),
+                    Exception('$TOT is 0'))
+        if len(dropped) > 0:
+            r.logger.warning("dropping {} empty well(s): {}".format(
+                len(dropped), ', '.join(sorted(dropped))))
+            scan['samples'] = [entry for entry in scan['samples']
+                               if entry['file'] not in dropped]
+        scan['events'] = OrderedDict(
+            (file_and_parent(uri), tot) for uri, tot in events.items()
+            if tot > 0)
+
+
+def fcs_etl_app_id(r):
+    '''App id jobs are submitted to: linked_reactors, else job_definition'''
+    app_record = r.settings.linked_reactors.get(AGAVE_APP_ALIAS, {})
+    return app_record.get('id', r.settings.job_definition.get('appId', None))
 
-    ag = r.client  # Agave client
-    # db = AgaveKeyValStore(ag)  # AgaveDB client
-    context = r.context  # Actor context
-    m = context.message_dict
 
-    r.logger.debug("Message: {}".format(m))
+def processed_index_location(r, manifest_path):
+    '''(directory, name) of a collection's processed output index'''
+    app_id = fcs_etl_app_id(r)
+    directory = os.path.join(
+        os.path.dirname(os.path.dirname(manifest_path)),
+        r.settings.job_params.output_subdir, app_id)
+    name = r.settings.get('incremental', {}).get('index_name', 'index.json')
+    return (directory, name)
 
-    agave_uri = m.get('uri')
-    (agave_storage_sys, agave_abs_dir, agave_filename) =\
-        agaveutils.from_agave_uri(agave_uri)
-    manifest_path = os.path.join('/', agave_abs_dir, agave_filename)
 
-    r.logger.debug("fetching manifest {}".format(agave_uri))
+def fetch_processed_index(r, system, directory, name):
+    '''The collection's ProcessedIndex, an empty one if it does not exist
+    yet, or None if it could not be read (so it must not be overwritten)
+    '''
+    from processed_index import ProcessedIndex
+    path = os.path.join(directory, name)
+    try:
+        r.client.files.list(systemId=system, filePath=path)
+    except Exception as e:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+        if status == 404:
+            return ProcessedIndex()
+        r.logger.warning("could not check for {}: {}".format(path, e))
+        return None
+    try:
+        return ProcessedIndex(json.loads(
+            download_bytes(r.client, system, path).decode('utf-8')))
+    except Exception as e:
+        r.logger.warning("could not read {}: {}".format(path, e))
+        return None
 
+
+def save_processed_index(r, index, system, directory, name):
+    '''Upload the merged index; failure to do so is logged and ignored'''
     try:
-        mani_file = agaveutils.agave_download_file(
-            agaveClient=r.client,
-            agaveAbsolutePath=manifest_path,
-            systemId=agave_storage_sys,
-            localFilename='manifest.json')
+        upload_bytes(r.client, system, directory, name,
+                     dump_json(index.document))
+    except Exception as e:
+        r.logger.warning("could not save processed index {}: {}".format(
+            os.path.join(directory, name), e))
+
 
-        if mani_file is None:
+def artifacts_digest(store, datafiles):
+    '''Content hash of a run's artifacts, used to name its directory'''
+    digest = hashlib.sha256()
+    for (param, fname) in sorted(datafiles.items()):
+        digest.update(param.encode('utf-8') + b'\0')
+        digest.update(store.get(fname))
+        digest.update(b'\0')
+    return digest.hexdigest()[:RUN_ID_LENGTH]
+
+
+def save_latest(r, system, plan_dir, record):
+    '''Point plan_dir/latest.json at a run; failure is logged and ignored'''
+    try:
+        upload_bytes(r.client, system, plan_dir, LATEST, dump_json(record))
+    except Exception as e:
+        r.logger.warning("could not update {}: {}".format(
+            os.path.join(plan_dir, LATEST), e))
+
+
+def compact_runs(r, dry_run=False):
+    '''Prune old run directories under destination.base_path
+
+    For every plan, the newest retention.keep_runs runs, runs younger
+    than retention.min_age_days and runs whose artifacts latest.json
+    references are kept. Copies renamed aside by the old flat layout
+    (name.json.<milliseconds>) are removed too. Returns the pruned paths.
+    '''
+    from job_sizing import parse_timestamp
+    settings = r.settings.get('retention', {})
+    keep = int(settings.get('keep_runs', 5))
+    min_age = float(settings.get('min_age_days', 14)) * 86400
+    system = r.settings.destination.system_id
+    base_path = r.settings.destination.base_path
+    now = time.time()
+    doomed = []
+    for plan in remote_listing(r, system, base_path):
+        if plan.get('type', None) != 'dir':
+            continue
+        plan_dir = os.path.join(base_path, plan['name'])
+        entries = remote_listing(r, system, plan_dir)
+        referenced = set()
+        if LATEST in [e['name'] for e in entries]:
+            try:
+                latest = json.loads(download_bytes(
+                    r.client, system,
+                    os.path.join(plan_dir, LATEST)).decode('utf-8'))
+                referenced.add(latest.get('run', None))
+                for uri in latest.get('inputs', {}).values():
+                    (_, dirpath, _) = agaveutils.from_agave_uri(uri)
+                    referenced.add(os.path.basename(dirpath.rstrip('/')))
+            except Exception as e:
+                # Without knowing what is in use, prune nothing here
+                r.logger.warning("could not read {}: {}".format(
+                    os.path.join(plan_dir, LATEST), e))
+                continue
+        runs = []
+        for entry in entries:
+            if entry.get('type', None) == 'dir' and RUN_ID.match(entry['name']):
+                runs.append((parse_timestamp(str(entry['lastModified'])),
+                             entry['name']))
+            elif entry.get('type', None) == 'file' and \
+                    RENAMED_COPY.match(entry['name']):
+                doomed.append(os.path.join(plan_dir, entry['name']))
+        runs.sort(reverse=True)
+        for (modified, name) in runs[keep:]:
+            if name not in referenced and now - modified > min_age:
+                doomed.append(os.path.join(plan_dir, name))
+    if dry_run or len(doomed) == 0:
+        return doomed
+
+    def _delete(path):
+        try:
+            r.client.files.delete(systemId=system, filePath=path)
+        except Exception as e:
+            return (path, e)
+        return (path, None)
+
+    pool = ThreadPool(processes=max(1, min(
+        int(settings.get('delete_workers', 4)), len(doomed))))
+    try:
+        results = pool.map(_delete, doomed)
+    finally:
+        pool.terminate()
+    for (path, e) in results:
+        if e is not None:
+            r.logger.warning("could not delete {}: {}".format(path, e))
+    return [path for (path, e) in results if e is None]
+
+
+def start_lookups(r, graph, system, manifest_path):
+    '''Add the stages that need only the manifest's location to graph
+
+    They run while the manifest, plan and instrument configuration are
+    fetched and scanned: the processed index, the instrument_output
+    listing used to weight shards and size jobs (only needed without
+    the pre-scan's event counts), the job history refresh and the app's
+    execution system.
+    '''
+    settings = r.settings
+    if settings.get('incremental', {}).get('enabled', False):
+        (index_dir, index_name) = processed_index_location(r, manifest_path)
+        graph.add('processed_index', lambda: fetch_processed_index(
+            r, system, index_dir, index_name))
+    sizing = settings.get('sizing', {})
+    weighted = sizing.get('enabled', False) or \
+        int(settings.get('sharding', {}).get('shards', 1)) > 1
+    if weighted and not fcs_checks(r)['prescan']:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(
+            manifest_path)), settings.job_params.data_subdir)
+        graph.add('file_sizes', lambda: instrument_file_sizes(
+            r, system, data_dir))
+    if sizing.get('enabled', False):
+        def _history():
+            history = job_history(r)
+            refresh_job_history(r, history,
+                                int(sizing.get('refresh_limit', 20)))
+            return history
+        graph.add('job_history', _history)
+    if settings.get('submission_queue', {}).get('enabled', False):
+        app_id = fcs_etl_app_id(r)
+        graph.add('execution_system', lambda: {
+            app_id: execution_system(r, app_id)})
+
+
+def use_transport(r):
+    '''Route r.client through an AgaveTransport per config.yml transport
+
+    Returns the transport, or None when it is disabled. Calling this again
+    reuses the transport already installed.
+    '''
+    if isinstance(r.client, AgaveTransport):
+        return r.client
+    settings = r.settings.get('transport', {})
+    if not settings.get('enabled', False):
+        return None
+    r.client = AgaveTransport(
+        r.client, timeouts=settings.get('timeouts', {}),
+        retries=settings.get('retries', 4),
+        backoff_seconds=settings.get('backoff_seconds', 1),
+        max_backoff_seconds=settings.get('max_backoff_seconds', 30),
+        pool_size=settings.get('pool_size', 16),
+        logger=r.logger)
+    if not r.client.pooled:
+        r.logger.debug("agave client exposes no HTTP session; "
+                       "timeouts and pool size are not applied")
+    return r.client
+
+
+def process_manifest(r, agave_uri, actor_name, force=False, jobs=None):
+    '''Generate TASBE inputs for one manifest and submit an FCS-ETL job
+
+    Problems are reported through r.on_failure. Returns the human-readable
+    success message instead of exiting, so one Reactor can be reused for
+    a whole batch of manifests. Every run, successful or not, logs its
+    RunProfile as one JSON line. If jobs is a list, the artifacts are
+    uploaded but the job definitions are appended to it instead of being
+    submitted (see backfill).
+    '''
+    profile = RunProfile(agave_uri, r.execid)
+    transport = use_transport(r)
+    before = transport.totals() if transport is not None else None
+    graph = StageGraph(workers=int(r.settings.get('transfers', {}).get(
+        'stage_workers', 4)))
+    status = 'failed'
+    try:
+        message = _process_manifest(r, agave_uri, actor_name, force, profile,
+                                    graph, jobs)
+        status = 'ok'
+        return message
+    finally:
+        graph.close()
+        if status != 'ok':
+            # Time spent in the stage that was running when we failed
+            profile.lap('incomplete')
+        for (stage, seconds) in graph.timings():
+            profile.concurrent(stage, seconds)
+        if transport is not None:
+            after = transport.totals()
+            counts = dict(('agave_' + k, after[k] - before[k]) for k in after)
+            counts['agave_seconds'] = round(counts['agave_seconds'], 6)
+            profile.count(**counts)
+        profile.finish(status)
+        r.logger.info(profile.to_json())
+        save_profile(r, profile)
+
+
+def save_profile(r, profile):
+    '''Upload run_profile.json beside the artifacts if profile.upload is set'''
+    destination = getattr(profile, 'destination', None)
+    if not r.settings.get('profile', {}).get('upload', False) or \
+            destination is None:
+        return
+    (dest_sys, dest_dir) = destination
+    try:
+        upload_bytes(r.client, dest_sys, dest_dir, 'run_profile.json',
+                     dump_json(profile.record()))
+    except Exception as e:
+        r.logger.warning("could not upload run profile: {}".format(e))
+
+
+class ManifestState(object):
+    '''What one manifest's stages hand on to the stages after them
+
+    Each stage of _process_manifest reads the attributes earlier stages
+    set and adds its own.
+    '''
+
+    def __init__(self, r, agave_uri, actor_name, force, profile, graph):
+        self.r = r
+        self.agave_uri = agave_uri
+        self.actor_name = actor_name
+        self.force = force
+        self.profile = profile
+        self.graph = graph
+        (self.storage_sys, abs_dir, filename) = \
+            agaveutils.from_agave_uri(agave_uri)
+        self.manifest_path = os.path.join('/', abs_dir, filename)
+        self.artifacts = r.settings.get('artifacts', {})
+        # Inputs and artifacts are held in memory; artifacts.debug_dir also
+        # keeps a copy of each on disk
+        self.store = ArtifactStore(self.artifacts.get('debug_dir', None))
+        self.compact = self.artifacts.get('compact_json', False)
+        self.bundle = self.artifacts.get('bundle', False)
+        self.sizing_enabled = r.settings.get('sizing', {}).get('enabled',
+                                                               False)
+        self.cache_key = None
+        self.processed = None
+        self.reused_color_model = None
+        self.history = None
+
+
+def fetch_inputs(state):
+    '''Download the manifest, then its plan and instrument configuration'''
+    r = state.r
+    template = TEMPLATE
+    store = state.store
+    r.logger.debug("fetching manifest {}".format(state.agave_uri))
+
+    try:
+        state.mani_file = store.put('manifest.json', download_bytes(
+            r.client, state.storage_sys, state.manifest_path))
+
+        if store.size(state.mani_file) == 0:
             raise Exception("no error was detected but file appears empty")
 
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'failed to download',
-            manifest_path, r.uid, r.execid), e)
-
-    # Load manifest so we can read the plan and config
-    # - Use AttrDict so we can use dot.notation
-    r.logger.debug("loading manifest into a dict and getting values")
-    manifest_dict = {}
-    try:
-        with open('manifest.json') as json_data:
-            manifest_dict = AttrDict(json.load(json_data))
-            plan_uri = manifest_dict.plan
-            instrument_config_uri = manifest_dict.instrument_configuration
+            state.actor_name, 'failed to download',
+            state.manifest_path, r.uid, r.execid), e)
+    state.profile.lap('download_manifest', bytes=store.size(state.mani_file))
+    state.profile.count(bytes_downloaded=store.size(state.mani_file))
+
+    # Read only the top-level manifest fields here; samples are streamed
+    # one at a time once the plan has been indexed
+    r.logger.debug("reading manifest header")
+    state.manifest_reader = ManifestReader.from_bytes(
+        store.get(state.mani_file))
+    state.manifest_header = {}
+    try:
+        state.manifest_header = state.manifest_reader.header(
+            keys=('plan', 'instrument_configuration', 'rdf:about',
+                  'manifest_version'))
+        state.plan_uri = state.manifest_header['plan']
+        state.instrument_config_uri = \
+            state.manifest_header['instrument_configuration']
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'was unable to properly parse the',
+            state.actor_name, 'was unable to properly parse the',
             'manifest file', r.uid, r.execid), e)
-
-    r.logger.debug("fetching plan {}".format(plan_uri))
-    plan_abs_path = None
-    try:
-        (plan_system, plan_dirpath, plan_filename) =\
-            agaveutils.from_agave_uri(plan_uri)
-        plan_abs_path = os.path.join(plan_dirpath, plan_filename)
-        plan_file = agaveutils.agave_download_file(
-            agaveClient=r.client,
-            agaveAbsolutePath=plan_abs_path,
-            systemId=plan_system,
-            localFilename='plan.json')
+    state.profile.lap('read_manifest_header')
+
+    # Plan and instrument config are independent, so fetch them together
+    r.logger.debug("fetching plan {} and instrument config {}".format(
+        state.plan_uri, state.instrument_config_uri))
+    transfers = r.settings.get('transfers', {})
+    (plan_download, ic_download) = download_files(
+        r, [(state.plan_uri, 'plan.json'),
+            (state.instrument_config_uri, 'cytometer_configuration.json')],
+        store, workers=transfers.get('download_workers', 4),
+        timeout=transfers.get('download_timeout', None),
+        cache=download_cache(r))
+    for download in (plan_download, ic_download):
+        if download['error'] is not None:
+            r.on_failure(template.format(
+                state.actor_name, 'failed to download',
+                download['path'], r.uid, r.execid), download['error'])
+    state.plan_file = plan_download['file']
+    state.ic_file = ic_download['file']
+    state.profile.lap('download_inputs',
+                      bytes=store.size(state.plan_file, state.ic_file))
+    state.profile.count(
+        bytes_downloaded=store.size(state.plan_file, state.ic_file))
+
+
+def check_cache(state):
+    '''The success message if these inputs already have a job, else None'''
+    r = state.r
+    template = TEMPLATE
+    # Identical inputs and settings have already been turned into a job
+    # unless the message asks for a rerun with force: true
+    cache_db = artifact_cache(r)
+    try:
+        state.cache_key = inputs_digest(r, state.agave_uri, [
+            state.store.get(name) for name in (
+                state.mani_file, state.plan_file, state.ic_file)])
+        r.logger.debug("inputs digest is {}".format(state.cache_key))
+    except Exception as e:
+        r.logger.warning("could not hash inputs: {}".format(e))
+    if state.cache_key is not None and not state.force:
+        previous = cache_lookup(r, cache_db, state.cache_key)
+        if previous is not None and previous.get('job_id', None) is not None:
+            suffix = '{} for identical inputs (outputs in {})'.format(
+                previous['job_id'], previous.get('archivePath'))
+            state.profile.lap('cache_lookup', hit=True)
+            return template.format(state.actor_name, 'found existing job',
+                                   suffix, r.uid, r.execid)
+        # Runs still in the submission queue reach the cache once submitted
+        queued = queued_run(r, state.cache_key)
+        if queued is not None:
+            state.profile.lap('cache_lookup', hit=True)
+            return template.format(
+                state.actor_name, 'found queued job(s)',
+                'for identical inputs (outputs in {})'.format(
+                    queued['record']['archivePath']), r.uid, r.execid)
+    state.profile.lap('cache_lookup', hit=False)
+    return None
+
+
+def load_inputs(state):
+    '''Parse the instrument configuration and plan, and index the plan'''
+    r = state.r
+    template = TEMPLATE
+    store = state.store
+    r.logger.debug("loading dict from instrument config file {}".format(
+        state.ic_file))
+    ic_parsed = PARSED_INPUTS.get(store.get(state.ic_file))
+    try:
+        if 'document' not in ic_parsed:
+            ic_parsed['document'] = store.load_json(state.ic_file)
+        cytometer_configuration = ic_parsed['document']
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'failed to download',
-            plan_abs_path, r.uid, r.execid), e)
-
-    r.logger.debug("fetching instrument config {}".format(instrument_config_uri))
-    try:
-        (ic_system, ic_dirpath, ic_filename) = \
-            agaveutils.from_agave_uri(instrument_config_uri)
-        ic_abs_path = os.path.join(ic_dirpath, ic_filename)
-        ic_file = agaveutils.agave_download_file(
-            agaveClient=r.client,
-            agaveAbsolutePath=ic_abs_path,
-            systemId=ic_system,
-            localFilename='cytometer_configuration.json')
+            state.actor_name, 'could not load dict from JSON document',
+            state.ic_file, r.uid, r.execid), e)
+
+    r.logger.debug("loading tasbe_cytometer_configuration.channels")
+    try:
+        state.channels = cytometer_configuration[
+            'tasbe_cytometer_configuration']['channels']
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'failed to download',
-            ic_abs_path, r.uid, r.execid), e)
+            state.actor_name, 'was unable to load',
+            'tasbe_cytometer_configuration.channels from settings',
+            r.uid, r.execid), e)
 
-    r.logger.debug("loading dict from instrument config file {}".format(ic_file))
+    r.logger.debug("loading dict from plan JSON file {}".format(
+        state.plan_file))
+    plan_parsed = PARSED_INPUTS.get(store.get(state.plan_file))
     try:
-        cytometer_configuration = json.load(open(ic_file, 'rb'))
+        if 'document' not in plan_parsed:
+            plan_parsed['document'] = store.load_json(state.plan_file)
+        plan = plan_parsed['document']
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'could not load dict from JSON document',
-            ic_file, r.uid, r.execid), e)
+            state.actor_name, 'could not load dict from JSON document',
+            state.plan_file, r.uid, r.execid), e)
+    state.profile.lap('load_inputs', channels=len(state.channels))
 
-    r.logger.debug("loading tasbe_cytometer_configuration.channels")
+    r.logger.debug("indexing plan initialState")
     try:
-        channels = cytometer_configuration['tasbe_cytometer_configuration']['channels']
+        if 'index' not in plan_parsed:
+            plan_parsed['index'] = PlanIndex(plan)
+        state.indexed_plan = plan_parsed['index']
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'was unable to load',
-            'tasbe_cytometer_configuration.channels from settings',
-            r.uid, r.execid), e)
+            state.actor_name, 'could not index initialState from plan',
+            state.plan_file, r.uid, r.execid), e)
+    state.profile.lap('index_plan', plan_states=len(plan['initialState']))
+
+    # Figure out the plan_id from plan_uri
+    # - Get the JSON file
+    plan_uri_file = os.path.basename(state.plan_uri)
+    # - Get JSON filename root
+    state.plan_id = os.path.splitext(plan_uri_file)[0]
+
 
-    r.logger.debug("loading dict from plan JSON file {}".format(plan_file))
+def scan_manifest(state):
+    '''Scan the manifest's samples against the plan and check the files'''
+    r = state.r
+    template = TEMPLATE
+    r.logger.debug("scanning manifest samples")
     try:
-        plan = json.load(open(plan_file, 'rb'))
+        state.scan = scan_samples(state.manifest_reader.samples(),
+                                  state.indexed_plan)
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'could not load dict from JSON document',
-            plan_file, r.uid, r.execid), e)
-
-    r.logger.debug("writing experimental data to local storage")
-    experimental_data = extract_experimental_data(manifest_dict, plan)
-    with open('experimental_data.json', 'wb') as outfile:
-        json.dump(experimental_data, outfile, sort_keys=True,indent=4,separators=(',', ': '))
-
-    r.logger.debug("writing intermediary JSON files to local storage")
-    try:
-        with open('process_control_data.json', 'wb') as outfile:
-            json.dump(build_process_control_data(plan, channels, experimental_data, instrument_config_uri,manifest_dict), outfile, sort_keys=True,indent=4,separators=(',', ': '))
-        with open('color_model_parameters.json', 'wb') as outfile:
-            json.dump(build_color_model(channels), outfile, sort_keys=True,indent=4,separators=(',', ': '))
-        with open('analysis_parameters.json', 'wb') as outfile:
-            json.dump(build_analysis_parameters(), outfile, sort_keys=True,indent=4,separators=(',', ': '))
+            state.actor_name, 'was unable to properly parse the',
+            'manifest samples', r.uid, r.execid), e)
+    state.profile.lap('scan_samples', samples=state.scan['collected'],
+                      files=len(state.scan['samples']))
+
+    # Truncated, still-copying or empty FCS files would only surface when
+    # TASBE fails, so check them before spending compute
+    preflight_checks(r, state.scan, state.channels, state.actor_name,
+                     state.profile)
+
+
+def select_files(state):
+    '''Keep only new or changed files in incremental mode
+
+    Returns the success message if there are none, else None.
+    '''
+    r = state.r
+    template = TEMPLATE
+    scan = state.scan
+    # In incremental mode only files that are new or changed since the
+    # last manifest processed for this plan are analysed, and the color
+    # model inputs are reused while nothing they are built from changes
+    if not r.settings.get('incremental', {}).get('enabled', False):
+        return None
+    from processed_index import color_model_key
+    (state.index_dir, state.index_name) = processed_index_location(
+        r, state.manifest_path)
+    processed = state.processed = state.graph.result('processed_index')
+    state.uri_of = dict((file_and_parent(uri), uri)
+                        for (uri, sha1) in scan['checksums'])
+    state.checksum_of = dict(scan['checksums'])
+    ic_sha1 = hashlib.sha1(state.store.get(state.ic_file)).hexdigest()
+    state.cm_key = color_model_key(
+        state.checksum_of.get(state.uri_of.get(scan['bead_file'], None),
+                              None),
+        state.checksum_of.get(state.uri_of.get(scan['blank_file'], None),
+                              None),
+        state.indexed_plan.bead_model, state.indexed_plan.bead_batch,
+        [state.instrument_config_uri, ic_sha1], state.channels)
+    changed = None
+    if processed is not None and not state.force:
+        changed = processed.changed_files(state.plan_id, scan['checksums'])
+    if changed is not None:
+        keep = set(file_and_parent(uri) for uri in changed)
+        previous = len(scan['samples'])
+        scan['samples'] = [entry for entry in scan['samples']
+                           if entry['file'] in keep]
+        r.logger.info("{} of {} files are new or changed since {}".format(
+            len(scan['samples']), previous,
+            processed.last_version(state.plan_id).get('manifest', None)))
+        if len(scan['samples']) == 0:
+            state.profile.lap('incremental', files=0)
+            return template.format(
+                state.actor_name, 'found no new or changed files in',
+                state.agave_uri, r.uid, r.execid)
+        # A bundle carries its own color model inputs, so none are reused
+        if not state.bundle:
+            state.reused_color_model = processed.color_model(
+                state.plan_id, state.cm_key)
+    state.profile.lap('incremental', files=len(scan['samples']),
+                      color_model_reused=state.reused_color_model is not None)
+    return None
+
+
+def build_artifacts(state):
+    '''Write the TASBE input documents to the store, sharded as configured'''
+    r = state.r
+    template = TEMPLATE
+    store = state.store
+    scan = state.scan
+    indexed_plan = state.indexed_plan
+    compact = state.compact
+    r.logger.debug("building experimental data")
+    experimental_data = extract_experimental_data(
+        state.manifest_header, indexed_plan, scan=scan)
+
+    # Large manifests can be split across several FCS-ETL jobs. Each shard
+    # gets its own experimental_data file (and analysis_parameters file when
+    # replicate groups are on) in place of the whole manifest's; the other
+    # artifacts are shared.
+    state.shard_files = []
+    state.job_samples = [scan['samples']]
+    n_shards = shard_count(r, len(scan['samples']))
+    state.file_sizes = None
+    if 'events' not in scan and (n_shards > 1 or state.sizing_enabled):
+        if 'file_sizes' in state.graph:
+            state.file_sizes = state.graph.result('file_sizes')
+        else:
+            state.file_sizes = instrument_file_sizes(
+                r, state.storage_sys, os.path.join(
+                    os.path.dirname(os.path.dirname(state.manifest_path)),
+                    r.settings.job_params.data_subdir))
+    if n_shards > 1:
+        r.logger.debug("splitting {} files into {} shards".format(
+            len(scan['samples']), n_shards))
+        if 'events' in scan:
+            # Event counts track TASBE's work more closely than bytes
+            sizes = dict((os.path.basename(f), n)
+                         for f, n in scan['events'].items())
+        else:
+            sizes = state.file_sizes
+        shards = shard_samples(scan['samples'], n_shards, sizes)
+        state.job_samples = shards
+        for i, shard in enumerate(shards):
+            state.shard_files.append(shard_file('experimental_data.json', i))
+            store.put_json(state.shard_files[-1],
+                           experimental_data_json(experimental_data, shard),
+                           compact)
+        state.profile.lap('shard', shards=len(state.shard_files))
+    else:
+        store.put_json('experimental_data.json',
+                       experimental_data_json(experimental_data), compact)
+
+    # Files collected under identical conditions form a replicate group.
+    # Each job only sees its own shard's files, so each gets its own groups.
+    job_groups = [None] * len(state.job_samples)
+    if r.settings.get('replicate_groups', {}).get('enabled', False):
+        from replicate_groups import ConditionTable, replicate_groups
+        table = ConditionTable(indexed_plan)
+        job_groups = [replicate_groups(samples, scan['sample_ids'],
+                                       indexed_plan, table=table)
+                      for samples in state.job_samples]
+        state.profile.lap('replicate_groups',
+                          groups=sum(len(groups) for groups in job_groups))
+
+    if len(state.shard_files) > 0 and job_groups[0] is not None:
+        analysis_files = [shard_file('analysis_parameters.json', i)
+                          for i in range(len(state.shard_files))]
+    else:
+        analysis_files = ['analysis_parameters.json']
+
+    r.logger.debug("building intermediary JSON documents")
+    try:
+        if state.reused_color_model is None:
+            store.put_json('process_control_data.json',
+                           build_process_control_data(
+                               indexed_plan, state.channels,
+                               experimental_data,
+                               state.instrument_config_uri,
+                               state.manifest_header, scan=scan),
+                           compact)
+            store.put_json('color_model_parameters.json',
+                           build_color_model(state.channels), compact)
+        for (fname, groups) in zip(analysis_files, job_groups):
+            store.put_json(fname, build_analysis_parameters(groups), compact)
     except Exception as e:
         r.on_failure(template.format(
-            actor_name, 'could not load write JSON file(s)',
-            plan_file, r.uid, r.execid), e)
+            state.actor_name, 'could not build JSON document(s)',
+            state.plan_file, r.uid, r.execid), e)
 
     # We will now upload the completed files to:
     # agave://data-sd2e-community/temp/flow_etl/REACTOR_NAME/PLAN_ID
     # - /temp/flow_etl/REACTOR_NAME is set by config.yml/destination.base_path
     #
-    # Expectation: these files have been written to pwd() somwhere above
-    datafiles = {'analysisParameters': 'analysis_parameters.json',
-                 'colorModelParameters': 'color_model_parameters.json',
+    # Expectation: these documents have been put in the store above
+    datafiles = {'colorModelParameters': 'color_model_parameters.json',
                  'cytometerConfiguration': 'cytometer_configuration.json',
-                 'experimentalData': 'experimental_data.json',
                  'processControl': 'process_control_data.json'}
-
-    # Figure out the plan_id from plan_uri
-    # - Get the JSON file
-    plan_uri_file = os.path.basename(plan_uri)
-    # - Get JSON filename root
-    plan_id = os.path.splitext(plan_uri_file)[0]
-    # Default upload destination set in config.yml
-    # - may want to add override but not essential now
-    dest_dir = os.path.join(r.settings.destination.base_path, plan_id)
-    dest_sys = r.settings.destination.system_id
-
+    for i, fname in enumerate(state.shard_files):
+        datafiles['experimentalData.{}'.format(i)] = fname
+    if len(state.shard_files) == 0:
+        datafiles['experimentalData'] = 'experimental_data.json'
+    if len(analysis_files) == len(state.shard_files):
+        for i, fname in enumerate(analysis_files):
+            datafiles['analysisParameters.{}'.format(i)] = fname
+    else:
+        datafiles['analysisParameters'] = analysis_files[0]
+    if state.reused_color_model is not None:
+        del datafiles['colorModelParameters']
+        del datafiles['processControl']
+
+    # Each run gets its own immutable directory named by the hash of its
+    # artifacts, so nothing is renamed and identical artifacts are reused
+    state.run_id = artifacts_digest(store, datafiles)
+    state.plan_dir = os.path.join(r.settings.destination.base_path,
+                                  state.plan_id)
+    state.dest_dir = os.path.join(state.plan_dir, state.run_id)
+    state.dest_sys = r.settings.destination.system_id
+    if state.bundle:
+        datafiles = bundle_artifacts(
+            store, datafiles, len(state.shard_files),
+            state.artifacts.get('bundle_input', 'artifactBundle'))
+    state.datafiles = datafiles
+    state.profile.lap('write_artifacts',
+                      bytes=store.size(*datafiles.values()),
+                      run=state.run_id)
+    state.profile.destination = (state.dest_sys, state.dest_dir)
+
+
+def upload_artifacts(state):
+    '''Upload the artifacts a previous run has not, collecting job inputs'''
+    r = state.r
+    template = TEMPLATE
+    store = state.store
+    graph = state.graph
+    datafiles = state.datafiles
+    (dest_sys, dest_dir) = (state.dest_sys, state.dest_dir)
+    # A rerun of identical artifacts finds them already uploaded. The run
+    # directory is listed while it is being created: a new one lists as
+    # empty either way.
     r.logger.debug("ensuring destination {} exists".format(
         agaveutils.to_agave_uri(dest_sys, dest_dir)))
+    graph.add('mkdir', lambda: agaveutils.agave_mkdir(
+        r.client, os.path.join(state.plan_id, state.run_id), dest_sys,
+        r.settings.destination.base_path))
+    graph.add('list_run', lambda: instrument_listing(
+        r, dest_sys, dest_dir, 'reuse'))
     try:
-        agaveutils.agave_mkdir(r.client, plan_id, dest_sys,
-                               r.settings.destination.base_path)
-    except Exception as e:
+        graph.result('mkdir')
+    except StageFailed as e:
         r.on_failure(template.format(
-            actor_name, 'could not access or create destination',
-            dest_dir, r.uid, r.execid), e)
-
-    job_def_inputs = {}
-    for agaveparam, fname in datafiles.items():
-        r.logger.info("uploading {} to {}".format(fname, dest_dir))
-        fpath = os.path.join(PWD, fname)
-
-        # rename the remote if it exists
-        try:
-            r.logger.debug("renaming remote {}".format(fname))
-            remote_abs_path = os.path.join(dest_dir, fname)
-            new_name = os.path.basename(remote_abs_path) + \
-                '.' + str(int(datetime.datetime.now().strftime("%s")) * 1000)
-            r.client.files.manage(systemId=dest_sys,
-                                  body={'action': 'rename',
-                                        'path': new_name},
-                                  filePath=remote_abs_path)
-        except Exception:
-            r.logger.debug("{} does not exist or is inaccessible. ({})".format(
-                remote_abs_path, 'ignoring error'))
-            pass
-
-        # upload the newly-generated file
-        try:
-            r.logger.debug("now uploading {}".format(fname))
-            agaveutils.agave_upload_file(r.client, dest_dir, dest_sys, fpath)
-        except Exception as e:
-            prefix = '{} failed to upload {}'.format(actor_name, fname)
-            r.on_failure(template.format(prefix, 'to', dest_dir,
-                                         r.uid, r.execid), e)
-
-        # Entries in this dict are needed to submit the FCS-ETL job later
-        job_def_inputs[agaveparam] = agaveutils.to_agave_uri(
-            dest_sys, os.path.join(dest_dir, fname))
-
+            state.actor_name, 'could not access or create destination',
+            dest_dir, r.uid, r.execid), e.error)
+    present = graph.result('list_run')
+    state.profile.lap('mkdir')
+    uploads = dict((param, fname) for (param, fname) in datafiles.items()
+                   if store.size(fname) != int(
+                       present.get(fname, {}).get('length', -1)))
+    transfers = r.settings.get('transfers', {})
+    (job_def_inputs, failed) = upload_files(
+        r, store, uploads, dest_sys, dest_dir,
+        workers=transfers.get('upload_workers', 5),
+        timeout=transfers.get('upload_timeout', None))
+    if failed is not None:
+        (fname, e) = failed
+        prefix = '{} failed to upload {}'.format(state.actor_name, fname)
+        r.on_failure(template.format(prefix, 'to', dest_dir,
+                                     r.uid, r.execid), e)
+    for (param, fname) in datafiles.items():
+        if param not in uploads:
+            job_def_inputs[param] = agaveutils.to_agave_uri(
+                dest_sys, os.path.join(dest_dir, fname))
+    if state.reused_color_model is not None:
+        for key in ('colorModelParameters', 'processControl'):
+            job_def_inputs[key] = state.reused_color_model[key]
+    state.profile.lap('upload', files=len(uploads),
+                      reused=len(datafiles) - len(uploads),
+                      bytes=store.size(*uploads.values()))
+    state.profile.count(bytes_uploaded=store.size(*uploads.values()))
+    state.job_def_inputs = job_def_inputs
+
+
+def define_jobs(state):
+    '''Template the FCS-ETL job definitions, one per shard, and size them'''
+    r = state.r
+    job_def_inputs = state.job_def_inputs
     # Base inputPath off path of manifest
     # Cowboy coding - Take grandparent directory sans sanity checking!
-    manifest_pathGrandparent = os.path.dirname(os.path.dirname(manifest_path))
+    manifest_pathGrandparent = os.path.dirname(
+        os.path.dirname(state.manifest_path))
 
     # Build the inputData path from settings (instead of hard-coding vals)
     #
@@ -487,7 +1938,7 @@ def main():
     inputDataPath = os.path.join(
         manifest_pathGrandparent, r.settings.job_params.data_subdir)
     job_def_inputs['inputData'] = agaveutils.to_agave_uri(
-        agave_storage_sys, inputDataPath)
+        state.storage_sys, inputDataPath)
 
     # Submit a job request to the FCS-ETL app based on template + vars
     #
@@ -540,41 +1991,579 @@ def main():
         r.uid,
         r.execid)
     # set archivePath and archiveSystem based on manifest
-    job_def.archiveSystem = agave_storage_sys
+    job_def.archiveSystem = state.storage_sys
     job_def.archivePath = os.path.join(
         manifest_pathGrandparent, r.settings.job_params.output_subdir,
         job_def.appId, "{}-{}".format(
             r.uid, r.execid))
-
+    state.job_def = job_def
+
+    # One job per shard, each reading its own experimental data and
+    # archiving to its own subdirectory
+    job_defs = [job_def]
+    if len(state.shard_files) > 0:
+        job_defs = []
+        for i in range(len(state.shard_files)):
+            shard_def = AttrDict(job_def)
+            shard_def.inputs = shard_inputs(job_def_inputs, i)
+            shard_def.name = "{}-shard{}".format(job_def.name, i)
+            shard_def.archivePath = os.path.join(
+                job_def.archivePath, 'shard{}'.format(i))
+            job_defs.append(shard_def)
+    state.job_defs = job_defs
+
+    # Size queue, nodes and maxRunTime to each job's inputs rather than
+    # using the same request for every manifest
+    state.sizings = []
+    if state.sizing_enabled:
+        try:
+            state.history = state.graph.result('job_history')
+            state.sizings = size_jobs(
+                r, job_defs, state.job_samples, state.scan, state.channels,
+                state.file_sizes, state.history)
+            for (sub_def, sizing) in zip(job_defs, state.sizings):
+                r.logger.info("{} sized for {}".format(
+                    sub_def.name, json.dumps(sizing, sort_keys=True)))
+        except Exception as e:
+            r.logger.warning("could not size jobs, using {} {}: {}".format(
+                job_def.batchQueue, job_def.maxRunTime, e))
+    state.profile.lap('size', jobs=len(state.sizings))
+
+
+def plan_jobs(state, jobs):
+    '''Append the job definitions to jobs instead of submitting them'''
+    r = state.r
+    template = TEMPLATE
+    # A backfill plan records the jobs for review; nothing is submitted,
+    # so latest.json, the artifact cache and the processed index are left
+    # as they were
+    for (i, sub_def) in enumerate(state.job_defs):
+        jobs.append({'manifest': state.agave_uri,
+                     'job': json.loads(json.dumps(sub_def)),
+                     'sizing': state.sizings[i] if state.sizings else None})
+    state.profile.lap('plan', jobs=len(state.job_defs))
+    return template.format(
+        state.actor_name, 'planned',
+        '{} job(s) to deposit outputs in {}'.format(
+            len(state.job_defs), state.job_def.archivePath),
+        r.uid, r.execid)
+
+
+def run_record(state):
+    '''What latest.json, the artifact cache and the processed index record
+
+    They record it once every job has an id (see finish_run).
+    '''
+    r = state.r
+    job_def = state.job_def
+    job_def_inputs = state.job_def_inputs
+    run = {'record': {'run': state.run_id,
+                      'inputs': job_def_inputs,
+                      'archivePath': job_def.archivePath,
+                      'manifest': state.agave_uri,
+                      'execid': r.execid,
+                      'created': datetime.datetime.utcnow().isoformat()},
+           'shards': [os.path.basename(d.archivePath)
+                      for d in state.job_defs]
+           if len(state.shard_files) > 0 else None,
+           'latest': [state.dest_sys, state.plan_dir],
+           'cache_key': state.cache_key,
+           'index': None}
+    if state.processed is not None:
+        job_files = []
+        for (samples, sub_def) in zip(state.job_samples, state.job_defs):
+            files = {}
+            for entry in samples:
+                uri = state.uri_of.get(entry['file'], None)
+                if uri is not None:
+                    files[uri] = {
+                        'checksum': state.checksum_of.get(uri, None),
+                        'archivePath': sub_def.archivePath}
+            job_files.append(files)
+        color_model = None
+        if state.reused_color_model is None and not state.bundle:
+            color_model = {'key': state.cm_key,
+                           'colorModelParameters':
+                               job_def_inputs['colorModelParameters'],
+                           'processControl': job_def_inputs['processControl'],
+                           'archivePath': job_def.archivePath}
+        run['index'] = {
+            'location': [state.storage_sys, state.index_dir,
+                         state.index_name],
+            'plan_id': state.plan_id,
+            'version': {
+                'manifest': state.agave_uri,
+                'manifest_version': state.manifest_header.get(
+                    'manifest_version', None),
+                'execid': r.execid,
+                'archivePath': job_def.archivePath,
+                'color_model_reused': state.reused_color_model is not None,
+                'created': run['record']['created']},
+            'files': job_files,
+            'color_model': color_model}
+    return run
+
+
+def submit_run(state):
+    '''Submit or queue the jobs and return the success message'''
+    r = state.r
+    template = TEMPLATE
+    actor_name = state.actor_name
+    job_def = state.job_def
+    job_defs = state.job_defs
+    sizings = state.sizings
     # Expected outcome:
     #
     # An experimental data collection 'ABCDEF'
     # has (at present) directories of measurements and one or more
     # manifests (allowing for versioning). ETL apps can deposit results
     # under ABCDEF/processed/appid/<unique-directory-name>.
-    r.logger.info('submitting FSC-ETL agave compute job')
-    job_id = 'mockup'
+    r.logger.info('submitting {} FSC-ETL agave compute job(s)'.format(
+        len(job_defs)))
+    run = run_record(state)
+
+    # Through the submission queue, bursts of executions are held to the
+    # in-flight caps and failed submissions are retried instead of lost.
+    # The queue finishes the run once its last job is submitted.
+    queue = submission_queue(r)
+    if queue is not None:
+        systems = None
+        if 'execution_system' in state.graph:
+            systems = state.graph.result('execution_system')
+        submitted = queue_jobs(r, queue, job_defs, state.agave_uri, sizings,
+                               systems, run)
+    else:
+        submitted = submit_jobs(
+            r, job_defs, workers=r.settings.get('sharding', {}).get(
+                'submit_workers', 4))
+    for (sub_def, (sub_id, e)) in zip(job_defs, submitted):
+        if sub_id is not None:
+            r.logger.info("compute job id is {}".format(sub_id))
+    for (sub_def, (sub_id, e)) in zip(job_defs, submitted):
+        if e is not None:
+            # Use a print here so we can more easily snag the job def
+            # TODO - come back and take this out if we ever add a nonce to
+            #        the callback notifications because that should not
+            #        show up in the logs. One alternative would be to
+            #        register a plaintext log formatter with redaction
+            #        support, but that requires extending our logger module
+            print(json.dumps(sub_def, indent=4))
+            r.on_failure(template.format(
+                actor_name, 'failed when submitting an agave compute job for',
+                sub_def.appId, r.uid, r.execid), e)
+    job_ids = [sub_id for (sub_id, e) in submitted if sub_id is not None]
+    queued = len(job_defs) - len(job_ids)
+    if len(state.shard_files) > 0:
+        r.logger.info("shard jobs: {}".format(json.dumps(
+            dict(zip(run['shards'], [sub_id for (sub_id, e) in submitted])),
+            sort_keys=True)))
+    state.profile.lap('submit', jobs=len(job_ids), queued=queued)
+
+    if len(sizings) > 0 and queue is None:
+        for (sizing, (sub_id, e)) in zip(sizings, submitted):
+            if sub_id is not None:
+                state.history.add(dict(sizing, job_id=sub_id,
+                                       submitted=time.time()))
+        save_job_history(r, state.history)
+
+    if queue is None:
+        finish_run(r, run, job_ids, state.graph, state.processed)
+
+    # Make a nice human-readable success message for the Slack log
+    if queued > 0:
+        r.logger.info("{} job(s) wait in the submission queue for a "
+                      "drain message".format(queued))
+        suffix = '{} of {} job(s) for submission{} and will deposit ' \
+            'outputs in {}'.format(
+                queued, len(job_defs),
+                ' (submitted {})'.format(','.join(job_ids))
+                if len(job_ids) > 0 else '', job_def.archivePath)
+        return template.format(actor_name, 'queued',
+                               suffix, r.uid, r.execid)
+    suffix = '{} and will deposit outputs in {}'.format(
+        ','.join(job_ids), job_def.archivePath)
+    if len(sizings) > 0:
+        from job_sizing import hms
+        largest = max(sizings, key=lambda s: s['estimate'])
+        suffix += ' ({}estimated {} on {}, maxRunTime {})'.format(
+            'longest ' if len(sizings) > 1 else '',
+            hms(largest['estimate']), largest['queue'],
+            largest['maxRunTime'])
+    return template.format(actor_name, 'submitted job',
+                           suffix, r.uid, r.execid)
+
+
+# The critical path of _process_manifest, in order. A stage that returns a
+# message has finished the manifest early (e.g. a cache hit).
+MANIFEST_STAGES = (fetch_inputs, check_cache, load_inputs, scan_manifest,
+                   select_files, build_artifacts, upload_artifacts,
+                   define_jobs)
+
+
+def _process_manifest(r, agave_uri, actor_name, force, profile, graph,
+                      jobs=None):
+    state = ManifestState(r, agave_uri, actor_name, force, profile, graph)
+    # Lookups off the critical path (manifest -> plan and instrument
+    # config -> scan -> artifacts -> upload -> submit) start right away on
+    # the graph; the stages run here, since on_failure ends the execution
+    start_lookups(r, graph, state.storage_sys, state.manifest_path)
+    for stage in MANIFEST_STAGES:
+        message = stage(state)
+        if message is not None:
+            return message
+    if jobs is not None:
+        return plan_jobs(state, jobs)
+    return submit_run(state)
+
+
+def message_uris(message):
+    '''Yield (uri, force) for a message carrying uri or a list of uris'''
+    force = message.get('force', False)
+    if message.get('uris', None) is not None:
+        uris = message['uris']
+    elif message.get('uri', None) is not None:
+        uris = [message['uri']]
+    else:
+        uris = []
+    for uri in uris:
+        yield (uri, force)
+
+
+def process_messages(r, messages, actor_name):
+    '''Process an iterable (or stream) of messages with one Reactor
+
+    r.on_failure must raise rather than exit (see on_batch_failure). Yields
+    (uri, ok, message) for each manifest as it is finished.
+    '''
+    for message in messages:
+        for (uri, force) in message_uris(message):
+            try:
+                yield (uri, True,
+                       process_manifest(r, uri, actor_name, force=force))
+            except ManifestFailure as e:
+                yield (uri, False, str(e))
+            except Exception as e:
+                # Anything not already routed through on_failure
+                r.logger.critical("{} failed: {}".format(uri, e))
+                yield (uri, False, str(e))
+
+
+def find_manifests(r, root, pattern=MANIFEST_PATTERN, workers=4):
+    '''Sorted Agave URIs of the manifests in a directory tree
+
+    root is an agave:// URI, or a local directory under source.local_root
+    standing for the same path on source.system_id. A tree mounted there
+    is walked in place; otherwise it is listed through Agave a level at a
+    time on workers threads. Files whose path below root (starting with
+    '/') matches pattern are manifests. The job_params data and output
+    subdirectories are not descended into.
+    '''
+    source = r.settings.get('source', {})
+    local_root = source.get('local_root', None)
+    job_params = r.settings.get('job_params', {})
+    skip = set(job_params.get(key, None)
+               for key in ('data_subdir', 'output_subdir'))
+    if root.startswith('agave://'):
+        (system, dirpath, filename) = agaveutils.from_agave_uri(
+            root.rstrip('/'))
+        path = os.path.join('/', dirpath, filename)
+    else:
+        relative = None
+        if local_root is not None:
+            relative = os.path.relpath(os.path.abspath(root),
+                                       os.path.abspath(local_root))
+        if relative is None or relative.startswith(os.pardir):
+            raise ValueError('{} is not under source.local_root'.format(root))
+        system = source.get('system_id', None)
+        path = os.path.normpath(os.path.join('/', relative))
+    if local_root is not None and system == source.get('system_id', None):
+        files = local_tree(os.path.join(local_root, path.lstrip('/')), skip)
+    else:
+        files = remote_tree(r, system, path, skip, workers)
+    return sorted(agaveutils.to_agave_uri(system, os.path.join(path, f))
+                  for f in files
+                  if fnmatch.fnmatchcase(os.path.join('/', f), pattern))
+
+
+def local_tree(top, skip=()):
+    '''Paths relative to top of every file below it'''
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(top):
+        dirnames[:] = [d for d in dirnames if d not in skip]
+        relative = os.path.relpath(dirpath, top)
+        files.extend(os.path.normpath(os.path.join(relative, f))
+                     for f in filenames)
+    return files
+
+
+def remote_tree(r, system, path, skip=(), workers=4):
+    '''Paths relative to path of every file below it on an Agave system'''
+    files = []
+    level = ['']
+
+    def _list(relative):
+        return (relative, remote_listing(r, system,
+                                         os.path.join(path, relative)))
+    pool = ThreadPool(processes=max(1, workers))
     try:
-        job_id = r.client.jobs.submit(body=job_def)['id']
-        r.logger.info("compute job id is {}".format(job_id))
+        while len(level) > 0:
+            below = []
+            for (relative, entries) in pool.map(_list, level):
+                for entry in entries:
+                    name = os.path.join(relative, entry['name'])
+                    if entry.get('type', 'file') != 'dir':
+                        files.append(name)
+                    elif entry['name'] not in skip:
+                        below.append(name)
+            level = below
+    finally:
+        pool.terminate()
+    return files
+
+
+# Set up by _backfill_worker in each backfill worker process
+BACKFILL = {}
+
+
+def _backfill_worker(overrides):
+    '''Pool initializer: one Reactor per worker, reused for its manifests'''
+    r = Reactor()
+    for (key, value) in overrides.items():
+        r.settings[key] = value
+    funcType = type(r.on_failure)
+    r.on_failure = funcType(on_batch_failure, r, Reactor)
+    BACKFILL['reactor'] = r
+
+
+def _backfill_manifest(task):
+    '''(uri, ok, message, planned jobs or None) for one manifest'''
+    (uri, force, planning) = task
+    r = BACKFILL['reactor']
+    jobs = [] if planning else None
+    try:
+        message = process_manifest(r, uri, 'backfill', force=force, jobs=jobs)
+        return (uri, True, message, jobs)
+    except ManifestFailure as e:
+        return (uri, False, str(e), None)
     except Exception as e:
-        # Use a print here so we can more easily snag the job def
-        # TODO - come back and take this out if we ever add a nonce to
-        #        the callback notifications because that should not
-        #        show up in the logs. One alternative would be to
-        #        register a plaintext log formatter with redaction
-        #        support, but that requires extending our logger module
-        print(json.dumps(job_def, indent=4))
+        # Anything not already routed through on_failure
+        r.logger.critical("{} failed: {}".format(uri, e))
+        return (uri, False, str(e), None)
+
+
+def backfill(argv=None):
+    '''Command line: process every manifest under a directory tree
+
+    Manifests are handled in a pool of worker processes, each with its own
+    Reactor. Runs of neighbouring manifests go to the same worker, which
+    parses a plan or cytometer configuration they share only once. Jobs
+    are submitted as usual, through the submission queue when it is
+    enabled, or written to one plan file with --plan. Returns the exit
+    status.
+    '''
+    import argparse
+    from multiprocessing import Pool
+    parser = argparse.ArgumentParser(
+        prog='reactor.py backfill',
+        description='Process every manifest under an Agave or local tree')
+    parser.add_argument('root', help='agave:// URI, or a directory under '
+                        'source.local_root')
+    parser.add_argument('--pattern', default=MANIFEST_PATTERN,
+                        help='glob for manifest paths below root '
+                        '(default %(default)s)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='manifests processed at once')
+    parser.add_argument('--force', action='store_true',
+                        help='rerun manifests already submitted with '
+                        'identical inputs')
+    parser.add_argument('--list', action='store_true',
+                        help='print the manifests found and stop')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', metavar='FILE',
+                      help='write the job definitions to FILE instead of '
+                      'submitting them')
+    mode.add_argument('--max-inflight', type=int, default=None,
+                      help='FCS-ETL jobs allowed in flight at once; the '
+                      'rest wait in the submission queue')
+    parser.add_argument('--wait', action='store_true',
+                        help='drain the submission queue until it is empty')
+    parser.add_argument('--poll', type=float, default=60,
+                        help='seconds between drains with --wait')
+    args = parser.parse_args(argv)
+
+    r = Reactor()
+    use_transport(r)
+    uris = find_manifests(r, args.root, args.pattern, int(
+        r.settings.get('transfers', {}).get('download_workers', 4)))
+    r.logger.info("found {} manifests under {}".format(len(uris), args.root))
+    if args.list:
+        for uri in uris:
+            print(uri)
+        return 0
+
+    overrides = {}
+    if args.max_inflight is not None:
+        queue_settings = json.loads(json.dumps(
+            r.settings.get('submission_queue', {})))
+        app_caps = queue_settings.get('app_caps', None) or {}
+        app_caps[fcs_etl_app_id(r)] = args.max_inflight
+        queue_settings.update(enabled=True, app_caps=app_caps)
+        if not queue_settings.get('directory', None):
+            # Only this host drains it, by --wait or a later backfill
+            queue_settings.update(
+                directory=os.path.join(PWD, 'submissions'),
+                drain_messages=False)
+        overrides['submission_queue'] = queue_settings
+        r.settings['submission_queue'] = queue_settings
+
+    planning = args.plan is not None
+    tasks = [(uri, args.force, planning) for uri in uris]
+    succeeded = []
+    failed = []
+    planned = []
+    pool = Pool(processes=max(1, args.workers),
+                initializer=_backfill_worker, initargs=(overrides,))
+    try:
+        for (uri, ok, message, jobs) in pool.imap(
+                _backfill_manifest, tasks,
+                max(1, len(tasks) // (max(1, args.workers) * 4))):
+            if ok:
+                r.logger.info(message)
+                succeeded.append(uri)
+                planned.extend(jobs or [])
+            else:
+                failed.append(uri)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if planning:
+        with open(args.plan, 'wb') as fh:
+            fh.write(dump_json({
+                'root': args.root,
+                'created': datetime.datetime.utcnow().isoformat(),
+                'manifests': succeeded,
+                'failed': failed,
+                'jobs': planned}))
+        r.logger.info("wrote {} job definitions to {}".format(
+            len(planned), args.plan))
+    else:
+        queue = submission_queue(r)
+        if queue is not None:
+            summary = drain_submissions(r, queue)
+            while args.wait and summary['waiting'] > 0:
+                time.sleep(args.poll)
+                summary = drain_submissions(r, queue)
+            r.logger.info("{} jobs waiting in the submission queue".format(
+                summary['waiting']))
+    r.logger.info("backfill finished {} of {} manifests{}".format(
+        len(succeeded), len(uris),
+        '; failed: {}'.format(', '.join(failed)) if failed else ''))
+    return 1 if failed else 0
+
+
+def main():
+
+    r = Reactor()
+    m = AttrDict(r.context.message_dict)
+    # Look up my own name
+    actor_name = r.get_attr('name')
+    template = TEMPLATE
+    # override on_failure and on_success
+    funcType = type(r.on_failure)
+    r.on_failure = funcType(on_failure, r, Reactor)
+    funcType = type(r.on_success)
+    r.on_success = funcType(on_success, r, Reactor)
+    # Pooled sessions, timeouts and retries for every Agave call below
+    use_transport(r)
+
+    r.logger.debug("message: {}".format(m))
+    # Use JSONschema-based message validator
+    # - In theory, this obviates some get() boilerplate
+    if not r.validate_message(m):
         r.on_failure(template.format(
-            actor_name, 'failed when submitting an agave compute job for',
-            job_def.appId, r.uid, r.execid), e)
+            actor_name, 'got an invalid message', m, r.uid, r.execid), None)
 
-    # Make a nice human-readable success message for the Slack log
-    suffix = '{} and will deposit outputs in {}'.format(
-        job_id, job_def.archivePath)
-    r.on_success(template.format(actor_name, 'submitted job',
-                                 suffix, r.uid, r.execid))
+    ag = r.client  # Agave client
+    # db = AgaveKeyValStore(ag)  # AgaveDB client
+    context = r.context  # Actor context
+    m = context.message_dict
+
+    r.logger.debug("Message: {}".format(m))
+
+    # Set REACTOR_CPROFILE=/path/to/stats to profile this execution
+    with Profiler():
+        process_message(r, m, actor_name)
+
+
+def process_message(r, m, actor_name):
+    '''Handle one validated Abaco message, exiting through on_success/on_failure'''
+    template = TEMPLATE
+    # {"compact": true} prunes old run directories per config.yml retention
+    if m.get('compact', False):
+        try:
+            pruned = compact_runs(r)
+        except Exception as e:
+            r.on_failure(template.format(
+                actor_name, 'could not compact', 'run directories',
+                r.uid, r.execid), e)
+        r.on_success(template.format(
+            actor_name, 'pruned', '{} old run directories and copies'.format(
+                len(pruned)), r.uid, r.execid))
+
+    # Queued submissions are drained after every enqueue, and by
+    # {"drain": true}, which the actor sends itself while jobs wait
+    if m.get('drain', False):
+        queue = submission_queue(r)
+        if queue is None:
+            r.on_failure(template.format(
+                actor_name, 'could not drain', 'the submission queue',
+                r.uid, r.execid), 'submission_queue is not enabled')
+        try:
+            summary = run_drainer(r, queue)
+        except Exception as e:
+            r.on_failure(template.format(
+                actor_name, 'could not drain', 'the submission queue',
+                r.uid, r.execid), e)
+        r.on_success(template.format(
+            actor_name, 'drained the submission queue:',
+            '{} submitted, {} failed, {} waiting'.format(
+                len(summary['submitted']), len(summary['failed']),
+                summary['waiting']), r.uid, r.execid))
+
+    if m.get('uri', None) is None and m.get('uris', None) is None:
+        r.on_success(template.format(
+            actor_name, 'had nothing to do for', json.dumps(m, sort_keys=True),
+            r.uid, r.execid))
+
+    # A single manifest keeps the exit-on-failure behavior. A list of
+    # manifests is drained with this one Reactor and Agave client, and
+    # each failure is reported without stopping the rest.
+    if m.get('uris', None) is None:
+        r.on_success(process_manifest(r, m.get('uri'), actor_name,
+                                      force=m.get('force', False)))
+
+    funcType = type(r.on_failure)
+    r.on_failure = funcType(on_batch_failure, r, Reactor)
+    succeeded = []
+    failed = []
+    for (uri, ok, message) in process_messages(r, [m], actor_name):
+        if ok:
+            r.logger.info(message)
+        (succeeded if ok else failed).append(uri)
+    r.on_failure = funcType(on_failure, r, Reactor)
+    summary = '{} of {} manifests'.format(
+        len(succeeded), len(succeeded) + len(failed))
+    if len(failed) > 0:
+        r.on_failure(template.format(
+            actor_name, 'submitted jobs for', summary, r.uid, r.execid),
+            'failed: {}'.format(', '.join(failed)))
+    r.on_success(template.format(
+        actor_name, 'submitted jobs for', summary, r.uid, r.execid))
 
 
 if __name__ == '__main__':
+    # Abaco runs this file without arguments
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        sys.exit(backfill(sys.argv[2:]))
     main()
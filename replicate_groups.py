@@ -0,0 +1,133 @@
+"""
+TASBE replicate groups from the conditions in a plan
+
+ConditionTable holds one row per plan Sample Id, one column per
+condition (strain, L-arabinose, aTc, IPTG and the bead and blank flags).
+Each column is stored as integer codes. replicate_groups() maps every
+experimental data file to its row, then groups the files whose condition
+vectors are identical. Groups are ordered by their first file, and the
+files keep their experimental data order within each group.
+
+With NumPy the codes are arrays and both the row keys and the grouping
+of files are computed in vectorized passes. That keeps plans with
+hundreds of thousands of files fast. Without NumPy the same grouping is
+done with dicts. NumPy is imported on first use, so executions that
+never group files do not pay for the import at startup.
+"""
+from collections import OrderedDict
+
+_NUMPY = []
+
+COLUMNS = ('strain', 'ara', 'atc', 'iptg', 'is_bead', 'is_blank')
+
+
+def _numpy():
+    '''The numpy module, or None if it is not installed'''
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+
+def condition(entry):
+    '''Condition vector for a PlanIndex entry, in COLUMNS order'''
+    return ('_'.join(entry['strains']), str(entry['ara']), str(entry['atc']),
+            str(entry['iptg']), bool(entry['is_bead']),
+            bool(entry['is_blank']))
+
+
+def label(vector):
+    '''Group label, named like the sample URIs built from the same fields'''
+    (strain, ara, atc, iptg, is_bead, is_blank) = vector
+    text = '{}_system_{}_{}_{}'.format(strain, ara, atc, iptg)
+    if is_bead:
+        text += '_bead'
+    if is_blank:
+        text += '_blank'
+    return text
+
+
+class ConditionTable(object):
+    '''Integer-coded condition columns, one row per plan Sample Id
+
+    States whose conditions could not be parsed are left out, so their
+    files belong to no group.
+    '''
+
+    def __init__(self, index):
+        self.row_of = {}
+        self.vectors = []
+        for sample_id in sorted(index.samples):
+            entry = index.samples[sample_id]
+            if entry['error'] is not None:
+                continue
+            self.row_of[sample_id] = len(self.vectors)
+            self.vectors.append(condition(entry))
+        self.codes = []
+        for column in range(len(COLUMNS)):
+            values = {}
+            self.codes.append([values.setdefault(v[column], len(values))
+                               for v in self.vectors])
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def row_keys(self):
+        '''One key per row, equal exactly when the condition vectors are'''
+        numpy = _numpy()
+        if numpy is None:
+            keys = {}
+            return [keys.setdefault(v, len(keys)) for v in self.vectors]
+        keys = numpy.zeros(len(self.vectors), dtype=numpy.int64)
+        for codes in self.codes:
+            codes = numpy.asarray(codes, dtype=numpy.int64)
+            # Re-densify after each column so keys stay below the row count
+            combined = keys * (int(codes.max()) + 1 if len(codes) else 1) + \
+                codes
+            keys = numpy.unique(combined, return_inverse=True)[1]
+        return keys
+
+
+def replicate_groups(samples, sample_ids, index, table=None):
+    '''[{'label', 'samples'}] over experimental data entries
+
+    samples are experimental data entries ({'file', 'sample'}) and
+    sample_ids maps each file to the plan Sample Id it was collected for.
+    table is index's ConditionTable, when one is already built (e.g. to
+    group each shard of the same plan).
+    '''
+    if table is None:
+        table = ConditionTable(index)
+    files = [s['file'] for s in samples]
+    rows = [table.row_of.get(sample_ids.get(f, None), -1) for f in files]
+    numpy = _numpy()
+    if numpy is None:
+        keys = table.row_keys()
+        groups = OrderedDict()
+        for f, row in zip(files, rows):
+            if row >= 0:
+                groups.setdefault(keys[row], (row, []))[1].append(f)
+        return [{'label': label(table.vectors[row]), 'samples': members}
+                for (row, members) in groups.values()]
+
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    known = numpy.nonzero(rows >= 0)[0]
+    if len(known) == 0:
+        return []
+    file_keys = table.row_keys()[rows[known]]
+    (unique, first, inverse) = numpy.unique(
+        file_keys, return_index=True, return_inverse=True)
+    # Stable sort keeps experimental data order inside each group
+    order = numpy.argsort(inverse, kind='mergesort')
+    bounds = numpy.cumsum(numpy.bincount(inverse))[:-1]
+    members = numpy.split(known[order], bounds)
+    result = []
+    for group in numpy.argsort(first, kind='mergesort'):
+        positions = members[group]
+        row = rows[positions[0]]
+        result.append({'label': label(table.vectors[row]),
+                       'samples': [files[i] for i in positions]})
+    return result
@@ -0,0 +1,9 @@
+"""
+Retry delays shared by the Agave transport and the submission queue
+"""
+import random
+
+
+def backoff(attempts, base, ceiling, rng=random):
+    '''Seconds to wait before retry number `attempts`, jittered'''
+    return min(ceiling, base * (2 ** (attempts - 1))) * rng.uniform(0.5, 1.0)
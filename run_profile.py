@@ -0,0 +1,93 @@
+"""
+Per-stage timing for one reactor run
+
+RunProfile records how long each stage of processing a manifest took,
+along with the counts that explain it (samples, files, plan states,
+bytes moved). lap() closes the stage that has been running since the
+previous lap, so stages can be marked without re-indenting the code they
+time, and concurrent() records stages that ran on other threads alongside
+them. record() returns a JSON-ready dict for logs and upload.
+"""
+import cProfile
+import json
+import os
+import time
+
+CPROFILE_ENV = 'REACTOR_CPROFILE'
+
+
+class RunProfile(object):
+
+    def __init__(self, manifest_uri, execid=None, clock=time.time):
+        self.clock = clock
+        self.manifest = manifest_uri
+        self.execid = execid
+        self.started = clock()
+        self.last = self.started
+        self.stages = []
+        self.overlapped = []
+        self.counts = {}
+        self.status = None
+        self.finished = None
+
+    def lap(self, stage, **counts):
+        '''Close the stage that began at the previous lap'''
+        now = self.clock()
+        entry = {'stage': stage, 'seconds': round(now - self.last, 6)}
+        entry.update(counts)
+        self.stages.append(entry)
+        self.last = now
+        return entry
+
+    def concurrent(self, stage, seconds, **counts):
+        '''Record a stage that ran alongside the laps, off the main thread'''
+        entry = {'stage': stage, 'seconds': round(seconds, 6)}
+        entry.update(counts)
+        self.overlapped.append(entry)
+        return entry
+
+    def count(self, **counts):
+        '''Add to run-wide totals such as bytes_downloaded'''
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def finish(self, status):
+        if self.finished is None:
+            self.finished = self.clock()
+            self.status = status
+
+    def record(self):
+        end = self.finished if self.finished is not None else self.clock()
+        return {'manifest': self.manifest,
+                'execid': self.execid,
+                'status': self.status,
+                'started': self.started,
+                'seconds': round(end - self.started, 6),
+                'stages': self.stages,
+                'concurrent': self.overlapped,
+                'counts': self.counts}
+
+    def to_json(self):
+        return json.dumps(self.record(), sort_keys=True)
+
+
+class Profiler(object):
+    '''Opt-in cProfile wrapper, enabled by setting REACTOR_CPROFILE
+
+    The variable names the file that pstats output is dumped to.
+    '''
+
+    def __init__(self, environ=os.environ):
+        self.path = environ.get(CPROFILE_ENV, None)
+        self.profiler = cProfile.Profile() if self.path else None
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
+        return False
@@ -0,0 +1,131 @@
+"""
+Run the I/O stages of a reactor execution concurrently by dependency
+
+A StageGraph is filled with named stages, each a function of the values
+of the stages it runs after. A stage starts on the graph's thread pool as
+soon as its dependencies are done, so independent network calls overlap
+while the caller carries on with the critical path and collects values
+with result() when it needs them. A failed stage cancels the stages that
+depend on it; result() raises StageFailed naming the stage that failed,
+for the caller to report through on_failure. close() cancels whatever
+has not started.
+"""
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+WAITING, RUNNING, DONE, FAILED, CANCELLED = (
+    'waiting', 'running', 'done', 'failed', 'cancelled')
+
+
+class StageFailed(Exception):
+
+    def __init__(self, stage, error):
+        super(StageFailed, self).__init__('{} failed: {}'.format(stage, error))
+        self.stage = stage
+        self.error = error
+
+
+class StageGraph(object):
+
+    def __init__(self, workers=4, clock=time.time):
+        self.workers = workers
+        self.clock = clock
+        self.stages = OrderedDict()
+        self.cond = threading.Condition()
+        self.pool = None
+        self.closed = False
+
+    def add(self, name, func, after=()):
+        '''Run func(*values of after) once every stage in after is done'''
+        with self.cond:
+            if name in self.stages:
+                raise ValueError('stage {} already added'.format(name))
+            for dep in after:
+                if dep not in self.stages:
+                    raise ValueError('{} runs after unknown stage {}'.format(
+                        name, dep))
+            self.stages[name] = {'func': func, 'after': tuple(after),
+                                 'state': WAITING, 'value': None,
+                                 'error': None, 'seconds': None}
+            self._schedule()
+        return self
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def _schedule(self):
+        '''Start or cancel waiting stages; called with cond held'''
+        changed = True
+        while changed:
+            changed = False
+            for name, stage in self.stages.items():
+                if stage['state'] != WAITING:
+                    continue
+                states = [self.stages[d]['state'] for d in stage['after']]
+                if self.closed or FAILED in states or CANCELLED in states:
+                    stage['state'] = CANCELLED
+                    changed = True
+                elif all(s == DONE for s in states):
+                    stage['state'] = RUNNING
+                    if self.pool is None:
+                        self.pool = ThreadPool(processes=self.workers)
+                    self.pool.apply_async(self._run, (name,))
+        self.cond.notify_all()
+
+    def _run(self, name):
+        stage = self.stages[name]
+        started = self.clock()
+        try:
+            value = stage['func'](*[self.stages[d]['value']
+                                    for d in stage['after']])
+            (state, error) = (DONE, None)
+        except Exception as e:
+            (value, state, error) = (None, FAILED, e)
+        with self.cond:
+            stage.update(state=state, value=value, error=error,
+                         seconds=self.clock() - started)
+            self._schedule()
+
+    def _root_failure(self, name):
+        stage = self.stages[name]
+        if stage['state'] == FAILED:
+            return (name, stage['error'])
+        for dep in stage['after']:
+            found = self._root_failure(dep)
+            if found is not None:
+                return found
+        return None
+
+    def result(self, name):
+        '''Wait for a stage and return its value, or raise StageFailed'''
+        with self.cond:
+            stage = self.stages[name]
+            while stage['state'] in (WAITING, RUNNING):
+                # A timeout keeps the wait interruptible on Python 2
+                self.cond.wait(1.0)
+            if stage['state'] == DONE:
+                return stage['value']
+            failure = self._root_failure(name)
+            if failure is None:
+                failure = (name, Exception('cancelled'))
+            raise StageFailed(*failure)
+
+    def timings(self):
+        '''(name, seconds) for each stage that has finished'''
+        with self.cond:
+            return [(name, stage['seconds'])
+                    for name, stage in self.stages.items()
+                    if stage['seconds'] is not None]
+
+    def close(self):
+        '''Cancel stages that have not started and release the pool'''
+        with self.cond:
+            self.closed = True
+            self._schedule()
+            pool = self.pool
+            self.pool = None
+        if pool is not None:
+            # Running stages finish on their own; nothing waits for them
+            pool.close()
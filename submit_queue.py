@@ -0,0 +1,281 @@
+"""
+Persistent, capped queue of Agave job submissions
+
+Job definitions are enqueued to a JSON store in a directory every
+execution can reach and submitted by drain(), which any later execution
+can call again. A job is only
+submitted while the number of in-flight jobs (submitted, not yet in a
+terminal state) on its execution system and for its app is below the
+configured caps. Failed submissions are retried with jittered
+exponential backoff and kept in the store, not dropped, once they run
+out of attempts. The store is guarded by an flock so executions sharing
+the directory take turns, held only while the store is read or written.
+The store also records which execution, if any, is draining it (see
+claim_drainer) so that only one keeps doing so.
+"""
+import fcntl
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from atomic_file import write_atomic
+from retry_backoff import backoff
+
+TERMINAL = ('FINISHED', 'FAILED', 'STOPPED', 'KILLED', 'ARCHIVING_FAILED')
+# In-flight jobs whose status cannot be read are forgotten after this long
+INFLIGHT_SECONDS = 3 * 24 * 3600
+KEEP_FAILED = 200
+# Claimed entries whose submission was never recorded (the execution
+# died) are returned to the pending list after this long
+CLAIM_SECONDS = 3600
+
+
+class SubmissionQueue(object):
+
+    def __init__(self, directory, caps=None, max_attempts=8,
+                 backoff_seconds=30, max_backoff_seconds=1800,
+                 status_limit=50, status_workers=8, clock=time.time,
+                 rng=random):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, 'queue.json')
+        self.lock_path = os.path.join(directory, 'queue.lock')
+        self.caps = caps or {}
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.status_limit = status_limit
+        self.status_workers = status_workers
+        self.clock = clock
+        self.rng = rng
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = {'pending': [], 'claimed': [], 'inflight': [],
+                         'failed': [], 'groups': {}, 'drainer': None}
+                if os.path.isfile(self.path):
+                    with open(self.path) as fh:
+                        state.update(json.load(fh))
+                yield state
+                write_atomic(self.path, lambda fh: json.dump(
+                    state, fh, sort_keys=True))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def enqueue(self, job_def, system, label=None, extra=None):
+        '''Add a job definition; returns the entry id'''
+        import uuid
+        entry = {'id': uuid.uuid4().hex,
+                 'job_def': job_def,
+                 'system': system,
+                 'app': job_def.get('appId', None),
+                 'label': label,
+                 'attempts': 0,
+                 'not_before': 0,
+                 'enqueued': self.clock()}
+        entry.update(extra or {})
+        with self._locked() as state:
+            state['pending'].append(entry)
+        return entry['id']
+
+    def _cap(self, kind, name):
+        caps = self.caps.get(kind, {})
+        return caps.get(name, caps.get('default', None))
+
+    def add_group(self, size, record):
+        '''Track a run of size entries, returning its group id
+
+        Entries enqueued with extra={'group': id, 'position': i} fill in
+        the group's job ids as they are submitted. drain() reports the
+        group, with record, once all of them have been.
+        '''
+        import uuid
+        group_id = uuid.uuid4().hex
+        with self._locked() as state:
+            state['groups'][group_id] = {'record': record,
+                                         'job_ids': [None] * size}
+        return group_id
+
+    def _statuses(self, status, job_ids):
+        '''Job ids now in a terminal state, and errors by job id'''
+        def _check(job_id):
+            try:
+                return (job_id, status(job_id), None)
+            except Exception as e:
+                return (job_id, None, str(e))
+
+        finished = set()
+        errors = {}
+        if len(job_ids) == 0:
+            return (finished, errors)
+        pool = ThreadPool(processes=max(1, min(self.status_workers,
+                                               len(job_ids))))
+        try:
+            for (job_id, state, error) in pool.imap_unordered(_check,
+                                                              job_ids):
+                if error is not None:
+                    errors[job_id] = error
+                elif state in TERMINAL:
+                    finished.add(job_id)
+        finally:
+            pool.close()
+            pool.join()
+        return (finished, errors)
+
+    def drain(self, submit, status, refresh=True):
+        '''Submit whatever the caps allow
+
+        submit(job_def) returns a job id; status(job_id) returns its
+        Agave status. Up to status_limit in-flight jobs are checked in
+        parallel first to free the slots of finished ones, unless
+        refresh is False, which leaves the slots as the last drain saw
+        them and makes no status calls. The store is locked only while it is read and
+        updated, not during those calls: entries being submitted are
+        claimed so other executions leave them alone. Returns
+        {'submitted': [entry], 'failed': [entry], 'waiting': count,
+        'completed': [group], 'abandoned': [group]} for this call, where
+        groups (see add_group) are {'id', 'record', 'job_ids'}.
+        '''
+        now = self.clock()
+        result = {'submitted': [], 'failed': [], 'waiting': 0,
+                  'completed': [], 'abandoned': []}
+        checks = []
+        if refresh:
+            with self._locked() as state:
+                checks = [entry['job_id']
+                          for entry in state['inflight'][:self.status_limit]]
+
+        # Free the slots of jobs that have since finished
+        (finished, errors) = self._statuses(status, checks)
+
+        with self._locked() as state:
+            inflight = []
+            for entry in state['inflight']:
+                if entry['job_id'] in finished:
+                    continue
+                if entry['job_id'] in errors:
+                    entry['status_error'] = errors[entry['job_id']]
+                    if now - entry.get('submitted', now) > INFLIGHT_SECONDS:
+                        continue
+                inflight.append(entry)
+            state['inflight'] = inflight
+            # Claims whose execution never recorded an outcome
+            claimed = []
+            for entry in state['claimed']:
+                if now - entry['claimed'] > CLAIM_SECONDS:
+                    del entry['claimed']
+                    state['pending'].append(entry)
+                else:
+                    claimed.append(entry)
+            load = {}
+            for entry in inflight + claimed:
+                for key in (('system', entry['system']),
+                            ('app', entry['app'])):
+                    load[key] = load.get(key, 0) + 1
+
+            pending = []
+            claims = []
+            for entry in state['pending']:
+                keys = (('system', entry['system']), ('app', entry['app']))
+                full = [k for k in keys if self._cap(*k) is not None
+                        if load.get(k, 0) >= self._cap(*k)]
+                if entry['not_before'] > now or len(full) > 0:
+                    pending.append(entry)
+                    continue
+                entry['attempts'] += 1
+                entry['claimed'] = now
+                claims.append(entry)
+                for k in keys:
+                    load[k] = load.get(k, 0) + 1
+            state['pending'] = pending
+            state['claimed'] = claimed + claims
+
+        outcomes = {}
+        for entry in claims:
+            try:
+                outcomes[entry['id']] = (submit(entry['job_def']), None)
+            except Exception as e:
+                outcomes[entry['id']] = (None, str(e))
+
+        with self._locked() as state:
+            state['claimed'] = [claim for claim in state['claimed']
+                                if claim['id'] not in outcomes]
+            # A claim that had expired may be back among the pending
+            state['pending'] = [waiting for waiting in state['pending']
+                                if waiting['id'] not in outcomes]
+            for entry in claims:
+                del entry['claimed']
+                (job_id, error) = outcomes[entry['id']]
+                group = state['groups'].get(entry.get('group', None), None)
+                if error is not None:
+                    entry['error'] = error
+                    if entry['attempts'] >= self.max_attempts:
+                        result['failed'].append(entry)
+                        state['failed'].append(entry)
+                        if group is not None:
+                            result['abandoned'].append(dict(
+                                state['groups'].pop(entry['group']),
+                                id=entry['group']))
+                    else:
+                        entry['not_before'] = now + backoff(
+                            entry['attempts'], self.backoff_seconds,
+                            self.max_backoff_seconds, self.rng)
+                        state['pending'].append(entry)
+                    continue
+                entry['job_id'] = job_id
+                entry['submitted'] = now
+                state['inflight'].append(dict(
+                    (k, v) for k, v in entry.items() if k != 'job_def'))
+                result['submitted'].append(entry)
+                if group is not None:
+                    group['job_ids'][entry['position']] = job_id
+                    if None not in group['job_ids']:
+                        result['completed'].append(dict(
+                            state['groups'].pop(entry['group']),
+                            id=entry['group']))
+            state['failed'] = state['failed'][-KEEP_FAILED:]
+            result['waiting'] = len(state['pending'])
+        return result
+
+    def claim_drainer(self, owner, stale_seconds, running=True):
+        '''Record owner as the queue's drainer; returns whether it was
+
+        A mark is live until its owner has not claimed again for
+        stale_seconds. A request (running=False: a drain message is on
+        its way) is turned away by any live mark; a running drainer only
+        by another running one, so it takes over from the request it
+        answers.
+        '''
+        now = self.clock()
+        with self._locked() as state:
+            mark = state['drainer']
+            if mark is not None and now - mark['at'] < stale_seconds:
+                if not running:
+                    return False
+                if mark['running'] and mark['owner'] != owner:
+                    return False
+            state['drainer'] = {'owner': owner, 'at': now,
+                                'running': running}
+        return True
+
+    def release_drainer(self, owner):
+        '''Clear the drainer mark if owner still holds it'''
+        with self._locked() as state:
+            mark = state['drainer']
+            if mark is not None and mark['owner'] == owner:
+                state['drainer'] = None
+
+    def groups(self):
+        '''Groups (see add_group) not yet completed, by id'''
+        with self._locked() as state:
+            return dict(state['groups'])
+
+    def pending(self):
+        with self._locked() as state:
+            return list(state['pending'])
@@ -0,0 +1,184 @@
+"""
+TASBE configuration document templates
+
+Each template is parsed from JSON the first time it is asked for and the
+resulting structure is cached. load() hands out an independent copy that
+callers fill in by assigning into the dicts and lists, so bead models,
+file names and URIs are never spliced into JSON text.
+"""
+import json
+import marshal
+
+TEMPLATES = {}
+
+TEMPLATES['analysis_parameters'] = '''{
+  "_comment1": "Information linking experiment FCS files to the appropriate cytometer channels, to be supplied by TA1/TA2",
+  "tasbe_analysis_parameters": {
+    "_comment1": "the rdf:about field is a URI that persistently identifies this analysis configuration",
+    "rdf:about": "placeholder",
+
+    "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
+    "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
+
+    "_comment3": "identifier linking to the color model for interpreting units.  Should typically be derived from the same process_control_data as is referenced in the experimental_data",
+    "color_model": "placeholder",
+
+    "_comment4": "identifier linking to the data collection to analyze",
+    "experimental_data": "placeholder",
+
+    "_comment5": "each replicate group collects a set of samples from the experimental collection under a label",
+    "replicate_groups": [{
+        "label": "",
+        "samples": []
+      }
+    ],
+
+    "TASBEConfig": {
+        "flow": {
+            "outputPointCloud": true,
+            "pointCloudPath": "output"
+        },
+        "OutputSettings": {
+            "StemName": "plots",
+            "FixedInputAxis": false
+        },
+        "outputDirectory": "output"
+    },
+    "_comment6": "additional configuration parameters",
+    "output": {
+      "title": "placeholder",
+      "plots": true,
+      "plots_folder": "plots",
+      "file": "./output/output.csv",
+      "quicklook": true,
+      "quicklook_folder": "./output/quicklook"
+    },
+    "channels": ["GFP"],
+    "_comment7": "additional parameters controlling data processing and output",
+    "additional_outputs": ["histogram", "point_clouds", "bayesdb_files"],
+    "min_valid_count": 100,
+    "pem_drop_threshold": 5,
+    "bin_min": 6,
+    "bin_max": 10,
+    "bin_width": 0.1
+  }
+}'''
+
+TEMPLATES['color_model'] = '''{
+  "_comment1": "Parameters controlling conversion of process controls into an ERF color model, plus debugging/graphical outputs, to be supplied by TA1/TA2",
+  "tasbe_color_model_parameters": {
+    "_comment1": "the rdf:about field is a URI that persistently identifies this run configuration",
+    "rdf:about": "placeholder",
+
+    "TASBEConfig": {
+        "heatmapPlottype": "contour",
+        "plots": {
+            "plotPath": "plots"
+        }
+    },
+    "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
+    "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
+
+    "_comment3": "identifier linking to the process control data set to be run",
+    "process_control_data": "placeholder",
+
+    "_comment4": "For each channel, the species and how to process and display it",
+    "channel_parameters": [],
+    "_comment5": "Other processing parameters, to be exposed",
+    "tasbe_config": {
+      "gating": {
+        "type": "auto",
+        "k_components": 2
+      },
+      "autofluorescence": {
+        "type": "placeholder"
+      },
+      "compensation": {
+        "type": "placeholder"
+      },
+      "beads": {
+        "type": "placeholder"
+      }
+    },
+
+    "_comment6": "Cutoff for bead peak detection",
+    "bead_min": 2,
+
+    "_comment7": "Which channel is being used for unit calibration",
+    "ERF_channel_name": "placeholder",
+
+    "_comment8": "additional parameters controlling data processing and output",
+    "translation_plot": false,
+    "noise_plot": false
+  }
+}'''
+
+# One entry of tasbe_color_model_parameters.channel_parameters
+TEMPLATES['color_model_channel'] = '''{
+    "_comment1": "name must match a channel from the cytometer configuration",
+    "name": "placeholder",
+    "_comment2": "a persistent URI linking to the actual species being quantified",
+    "species": "https://www.ncbi.nlm.nih.gov/protein/AMZ00011.1",
+    "_comment3": "Nickname for the species for charts",
+    "label": "GFP",
+    "_comment4": "cutoff for analysis",
+    "min": 2,
+    "_comment5": "primary color for lines on certain plots",
+    "chart_color": "y"
+}'''
+
+TEMPLATES['process_control_data'] = '''{
+  "_comment1": "Information linking process control FCS files to the appropriate cytometer channels, to be supplied by TA3",
+  "tasbe_process_control_data": {
+    "_comment1": "the rdf:about field is a URI that persistently identifies this process control information set",
+    "rdf:about": "placeholder",
+
+    "_comment2": "Compatible TASBE interface version, following Semantic Versioning (semver.org).  Note that underspecifying version allows use of backward compatible upgrades.",
+    "tasbe_version": "https://github.com/SD2E/reactors-etl/releases/tag/2",
+
+    "_comment3": "identifier linking to the instrument and optical configuration used for collecting data",
+    "cyometer_configuration": "placeholder",
+
+    "_comment4": "all files are URIs to the location of a file on the TA4 infrastructure",
+    "bead_file": "placeholder",
+    "_comment5": "name of the type of beads being used; must match an entry in the TASBE bead catalog https://github.com/TASBE/TASBEFlowAnalytics/blob/master/code/BeadCatalog.xlsx",
+    "_comment6": "name of the batch of beads being used; must match an entry in the TASBE bead catalog https://github.com/TASBE/TASBEFlowAnalytics/blob/master/code/BeadCatalog.xlsx",
+    "TASBEConfig": {
+        "beads": {
+            "beadModel": "placeholder",
+            "beadBatch": "placeholder"
+        }
+    },
+
+    "_comment7": "the blank file should be wild-type or null transfection",
+    "blank_file": "placeholder",
+
+    "_comment8": "each channel should have a strong single positive control of the species it quantifies",
+    "channels": [],
+
+    "_comment9": "cross-file pairs are for converting to FITC units; only needed if a fluorescent protein is measured outside the FITC channel",
+    "cross_file_pairs": []
+  }
+}'''
+
+# One entry of tasbe_process_control_data.channels
+TEMPLATES['process_control_channel'] = '''{
+    "_comment1": "name must match a channel from the cytometer configuration",
+    "name": "placeholder",
+    "_comment2": "FCS file for single positive control",
+    "calibration_file": "placeholder"
+}'''
+
+_parsed = {}
+
+
+def load(name):
+    '''Return a fresh, fillable copy of the named template
+
+    The parsed structure is kept marshalled; marshal.loads rebuilds the
+    nested dicts and lists at C speed, well ahead of copy.deepcopy or
+    re-running json.loads over the commented template text.
+    '''
+    if name not in _parsed:
+        _parsed[name] = marshal.dumps(json.loads(TEMPLATES[name]))
+    return marshal.loads(_parsed[name])
@@ -0,0 +1,45 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+import synthetic
+import yaml
+from fake_agave import CONFIG, FakeAgave
+
+
+@pytest.fixture
+def agave(monkeypatch):
+    '''FakeAgave holding a 20-file synthetic manifest and its inputs'''
+    agave = FakeAgave()
+    for name in ('agave_download_file', 'agave_upload_file', 'agave_mkdir'):
+        monkeypatch.setattr(reactor.agaveutils, name, None, raising=False)
+    agave.install(reactor.agaveutils)
+    (manifest, plan) = synthetic.build(20)
+    agave.put(synthetic.MANIFEST_PATH, manifest)
+    agave.put(synthetic.PLAN_URI.split(synthetic.SYSTEM, 1)[1], plan)
+    agave.put(synthetic.CYTOMETER_URI.split(synthetic.SYSTEM, 1)[1],
+              synthetic.cytometer_configuration())
+    return agave
+
+
+@pytest.fixture
+def settings(tmpdir):
+    '''The shipped config.yml, kept off the network and out of /mnt'''
+    with open(CONFIG) as fh:
+        settings = yaml.safe_load(fh)
+    settings['cache']['enabled'] = False
+    # The synthetic FCS files are placeholders, not real FCS data
+    settings['verification']['enabled'] = False
+    settings['prescan']['enabled'] = False
+    settings['download_cache']['directory'] = str(tmpdir.join('downloads'))
+    settings['sizing']['history_file'] = str(tmpdir.join('history.jsonl'))
+    settings['submission_queue']['directory'] = str(tmpdir.join('queue'))
+    return settings
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+import io
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+from agave_transport import AgaveTransport
+
+
+class HTTPError(IOError):
+    def __init__(self, status):
+        super(HTTPError, self).__init__('HTTP {}'.format(status))
+        self.response = type(str('Response'), (object,),
+                             {'status_code': status})()
+
+
+class Flaky(object):
+    '''Raises each of failures in turn, then returns 'ok' '''
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return 'ok'
+
+
+class Token(object):
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+class Client(object):
+    def __init__(self, **operations):
+        self.files = type(str('Files'), (object,), {})()
+        self.jobs = type(str('Jobs'), (object,), {})()
+        for name, func in operations.items():
+            (resource, operation) = name.split('_')
+            setattr(getattr(self, resource), operation, func)
+        self.token = Token()
+        self.username = 'sd2etest'
+
+
+def transport(client):
+    waits = []
+    t = AgaveTransport(client, retries=3, backoff_seconds=1,
+                       max_backoff_seconds=4, sleep=waits.append)
+    return (t, waits)
+
+
+def test_transient_errors_are_retried():
+    flaky = Flaky(HTTPError(502), IOError('connection reset'))
+    (t, waits) = transport(Client(files_list=flaky))
+    assert t.files.list(systemId='data', filePath='/') == 'ok'
+    assert flaky.calls == 3 and len(waits) == 2
+    assert waits[1] <= 2 and waits[1] >= 1
+    assert t.counters()['files.list']['retries'] == 2
+    # Other attributes reach the client untouched
+    assert t.username == 'sd2etest'
+
+
+def test_retries_give_up_and_skip_permanent_errors():
+    flaky = Flaky(*[HTTPError(503)] * 5)
+    (t, waits) = transport(Client(files_download=flaky))
+    with pytest.raises(HTTPError):
+        t.files.download(systemId='data', filePath='/x')
+    assert flaky.calls == 4
+    missing = Flaky(HTTPError(404))
+    (t, waits) = transport(Client(files_list=missing))
+    with pytest.raises(HTTPError):
+        t.files.list(systemId='data', filePath='/x')
+    assert missing.calls == 1
+    assert t.totals()['failures'] == 1
+
+
+def test_submit_only_retried_when_throttled():
+    (t, waits) = transport(Client(jobs_submit=Flaky(HTTPError(502))))
+    with pytest.raises(HTTPError):
+        t.jobs.submit(body={})
+    throttled = Flaky(HTTPError(429))
+    (t, waits) = transport(Client(jobs_submit=throttled))
+    assert t.jobs.submit(body={}) == 'ok'
+    assert throttled.calls == 2
+
+
+def test_expired_token_refreshed_once():
+    client = Client(files_list=Flaky(HTTPError(401)))
+    (t, waits) = transport(client)
+    assert t.files.list(systemId='data', filePath='/') == 'ok'
+    assert client.token.refreshes == 1 and waits == []
+    # A call that started before that refresh reuses it
+    assert t._refresh_token(0)
+    assert client.token.refreshes == 1
+
+
+def test_retried_upload_sends_the_whole_stream():
+    received = []
+
+    def importData(**kwargs):
+        received.append(kwargs['fileToUpload'].read())
+        if len(received) == 1:
+            raise HTTPError(503)
+    (t, waits) = transport(Client(files_importData=importData))
+    t.files.importData(systemId='data', filePath='/run', fileName='a.json',
+                       fileToUpload=io.BytesIO(b'{"a": 1}'))
+    assert received == [b'{"a": 1}', b'{"a": 1}']
@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+from artifact_bundle import dump_json, read_bundle, write_bundle
+
+
+@pytest.fixture
+def artifacts():
+    return {'analysisParameters': ('analysisParameters.json',
+                                   dump_json({'a': 1})),
+            'experimentalData': ('experimentalData.json',
+                                 dump_json({'samples': [1, 2, 3]}))}
+
+
+def test_compact_json():
+    assert dump_json({'b': [1, 2], 'a': 'x'}, compact=True) == \
+        b'{"a":"x","b":[1,2]}'
+    text = dump_json({'b': [1, 2], 'a': 'x'})
+    assert b'\n    ' in text
+    assert json.loads(text.decode('utf-8')) == {'a': 'x', 'b': [1, 2]}
+
+
+def test_bundle_round_trip(artifacts):
+    (index, contents) = read_bundle(write_bundle(artifacts))
+    assert index == {'analysisParameters': 'analysisParameters.json',
+                     'experimentalData': 'experimentalData.json'}
+    assert json.loads(contents['experimentalData.json'].decode('utf-8')) == \
+        {'samples': [1, 2, 3]}
+
+
+def test_bundle_is_deterministic(artifacts):
+    assert write_bundle(artifacts) == write_bundle(dict(artifacts))
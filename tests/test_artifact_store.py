@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+from artifact_store import ArtifactStore
+
+
+def test_store_in_memory(tmpdir, monkeypatch):
+    '''Nothing touches the working directory unless debug_dir is set'''
+    monkeypatch.chdir(tmpdir)
+    store = ArtifactStore()
+    name = store.put_json('plan.json', {'id': 1}, compact=True)
+    assert name == 'plan.json' and 'plan.json' in store
+    assert store.load_json('plan.json') == {'id': 1}
+    assert store.open('plan.json').name == 'plan.json'
+    assert store.size('plan.json', 'missing.json') == len(b'{"id":1}')
+    assert tmpdir.listdir() == []
+
+
+def test_store_debug_dir(tmpdir):
+    '''With debug_dir every artifact is also written to disk'''
+    store = ArtifactStore(str(tmpdir.join('debug')))
+    store.put('manifest.json', b'{}')
+    assert tmpdir.join('debug', 'manifest.json').read() == '{}'
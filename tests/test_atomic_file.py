@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+import pytest
+from atomic_file import write_atomic
+
+
+def test_replaces_and_creates_directory(tmpdir):
+    path = str(tmpdir.join('a', 'b', 'index.json'))
+    write_atomic(path, lambda fh: fh.write('one'))
+    write_atomic(path, lambda fh: fh.write('two'))
+    assert open(path).read() == 'two'
+    assert os.listdir(str(tmpdir.join('a', 'b'))) == ['index.json']
+
+
+def test_failed_write_keeps_old_contents(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    write_atomic(path, lambda fh: fh.write('old'))
+
+    def fail(fh):
+        fh.write('partial')
+        raise ValueError('not serializable')
+    with pytest.raises(ValueError):
+        write_atomic(path, fail)
+    assert open(path).read() == 'old'
+    assert os.listdir(str(tmpdir)) == ['index.json']
@@ -0,0 +1,101 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+import synthetic
+from fake_agave import FakeAgave, FakeCache, FakeReactor
+
+TREE = ['exp1/manifest/manifest.json', 'exp1/manifest/notes.txt',
+        'exp1/instrument_output/manifest/stray.json',
+        'exp1/instrument_output/A1.fcs', 'exp2/manifest/manifest_v2.json',
+        'exp2/processed/manifest/old.json', 'plan.json']
+
+
+def fake_reactor(local_root=None, paths=()):
+    agave = FakeAgave()
+    for path in paths:
+        agave.store(path, b'{}')
+    return FakeReactor(agave, {
+        'source': {'system_id': 'data', 'local_root': local_root},
+        'job_params': {'data_subdir': 'instrument_output',
+                       'output_subdir': 'processed'}})
+
+
+EXPECTED = ['agave://data/biofab/q0/exp1/manifest/manifest.json',
+            'agave://data/biofab/q0/exp2/manifest/manifest_v2.json']
+
+
+def test_find_manifests_through_agave():
+    r = fake_reactor(paths=['/biofab/q0/' + p for p in TREE])
+    assert reactor.find_manifests(r, 'agave://data/biofab/q0/',
+                                  workers=2) == EXPECTED
+    assert not any('instrument_output' in p or 'processed' in p
+                   for p in r.client.listed)
+
+
+def test_find_manifests_in_mounted_tree(tmpdir):
+    for path in TREE:
+        tmpdir.join('biofab', 'q0', path).ensure()
+    r = fake_reactor(local_root=str(tmpdir))
+    assert reactor.find_manifests(
+        r, 'agave://data/biofab/q0') == EXPECTED
+    assert reactor.find_manifests(
+        r, str(tmpdir.join('biofab', 'q0'))) == EXPECTED
+    assert reactor.find_manifests(
+        r, str(tmpdir.join('biofab', 'q0', 'exp1'))) == EXPECTED[:1]
+    with pytest.raises(ValueError):
+        reactor.find_manifests(r, '/elsewhere')
+
+
+def test_parsed_inputs_shared_by_content():
+    parsed = reactor.ParsedInputs(size=2)
+    parsed.get(b'{"plan": 1}')['document'] = {'plan': 1}
+    assert parsed.get(b'{"plan": 1}') == {'document': {'plan': 1}}
+    parsed.get(b'{"plan": 2}')
+    parsed.get(b'{"plan": 3}')
+    assert parsed.get(b'{"plan": 1}') == {}
+
+
+def run_backfill(monkeypatch, agave, settings, *argv):
+    '''backfill(argv) over the synthetic collection, workers in threads'''
+    from multiprocessing.pool import ThreadPool
+    monkeypatch.setattr('multiprocessing.Pool', ThreadPool)
+    monkeypatch.setattr(reactor, 'Reactor',
+                        lambda: FakeReactor(agave, settings))
+    root = 'agave://{}{}'.format(synthetic.SYSTEM, synthetic.COLLECTION)
+    return reactor.backfill([root, '--workers', '1'] + list(argv))
+
+
+def test_backfill_skips_submitted_manifests(agave, settings, monkeypatch):
+    cache = FakeCache()
+    monkeypatch.setattr(reactor, 'artifact_cache', lambda r: cache)
+    assert run_backfill(monkeypatch, agave, settings) == 0
+    assert len(agave.submitted) == 1
+    assert run_backfill(monkeypatch, agave, settings) == 0
+    assert len(agave.submitted) == 1
+    assert run_backfill(monkeypatch, agave, settings, '--force') == 0
+    assert len(agave.submitted) == 2
+
+
+def test_backfill_plan_and_failures(agave, settings, monkeypatch, tmpdir):
+    agave.put(synthetic.COLLECTION + '/broken/manifest/manifest.json', b'{}')
+    plan = tmpdir.join('plan.json')
+    assert run_backfill(monkeypatch, agave, settings,
+                        '--plan', str(plan)) == 1
+    assert agave.submitted == []
+    written = json.loads(plan.read())
+    assert written['manifests'] == [synthetic.MANIFEST_URI]
+    assert written['failed'] == ['agave://{}{}/broken/manifest/'
+                                 'manifest.json'.format(
+                                     synthetic.SYSTEM, synthetic.COLLECTION)]
+    assert len(written['jobs']) == 1
@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/')
+
+import pytest
+from download_cache import DownloadCache
+from fake_agave import FakeAgave
+
+PLAN = b'{"initialState": []}'
+
+
+@pytest.fixture
+def agave():
+    agave = FakeAgave()
+    agave.store('/plan.json', PLAN)
+    return agave
+
+
+def download(agaveClient, systemId, agaveAbsolutePath):
+    return agaveClient.files.download(systemId=systemId,
+                                      filePath=agaveAbsolutePath).content
+
+
+def fetch(cache, agave):
+    return cache.fetch_bytes(agave, download, 'agave://sys/plan.json',
+                             'sys', '/plan.json')
+
+
+def test_hit_after_miss(tmpdir, agave):
+    '''A second fetch of an unchanged file is served from the cache'''
+    cache = DownloadCache(str(tmpdir.join('cache')), 1024)
+    assert fetch(cache, agave) == PLAN
+    assert fetch(cache, agave) == PLAN
+    assert agave.calls['download'] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_remote_refetches(tmpdir, agave):
+    '''A new lastModified invalidates the cached copy'''
+    cache = DownloadCache(str(tmpdir.join('cache')), 1024)
+    fetch(cache, agave)
+    agave.modified['/plan.json'] = '2018-02-01T00:00:00.000Z'
+    fetch(cache, agave)
+    assert agave.calls['download'] == 2
+
+
+def test_unlisted_file_is_downloaded(tmpdir, agave):
+    '''Without remote metadata the cache is bypassed, not trusted'''
+    cache = DownloadCache(str(tmpdir.join('cache')), 1024)
+    del agave.modified['/plan.json']
+    fetch(cache, agave)
+    fetch(cache, agave)
+    assert agave.calls['download'] == 2
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_lru_eviction(tmpdir):
+    '''The least recently used entry is dropped past max_bytes'''
+    cache = DownloadCache(str(tmpdir.join('cache')), 30)
+    for name in ('one', 'two'):
+        cache.store_bytes('agave://sys/' + name, 20, 'stamp', b'x' * 20)
+    assert cache.lookup('agave://sys/one', 20, 'stamp') is None
+    assert cache.lookup('agave://sys/two', 20, 'stamp') is not None
+    assert sorted(os.listdir(str(tmpdir.join('cache')))) == \
+        sorted(['index.json', DownloadCache.key('agave://sys/two')])
@@ -0,0 +1,97 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+import pytest
+from fcs_header import FCSParseError, parse_text, read_header
+from fcs_verify import FileRecord, inspect_all, scan_headers, sha1_file
+
+
+def fcs_file(path, channels, tot, delimiter=b'/', events_bytes=4096):
+    '''Write a minimal FCS 3.0 file: HEADER, TEXT and a DATA segment'''
+    pairs = [(b'$PAR', str(len(channels)).encode('ascii')),
+             (b'$TOT', str(tot).encode('ascii'))]
+    for n, name in enumerate(channels, 1):
+        pairs.append(('$P{}N'.format(n).encode('ascii'), name))
+    text = delimiter + b''.join(
+        k + delimiter + v.replace(delimiter, delimiter * 2) + delimiter
+        for (k, v) in pairs)
+    begin = 58
+    end = begin + len(text) - 1
+    header = b'FCS3.0    ' + '{:>8}{:>8}{:>8}{:>8}{:>8}{:>8}'.format(
+        begin, end, end + 1, end + events_bytes, 0, 0).encode('ascii')
+    with open(path, 'wb') as fh:
+        fh.write(header + text + b'\xff' * events_bytes)
+    return path
+
+
+def test_read_header(tmpdir):
+    path = fcs_file(str(tmpdir.join('a.fcs')), [b'FSC-A', b'FL1-A'], 1234)
+    assert read_header(path) == {'version': 'FCS3.0', 'par': 2,
+                                 'channels': ['FSC-A', 'FL1-A'],
+                                 'tot': 1234}
+
+
+def test_escaped_delimiter():
+    keywords = parse_text(b'|$P1N|FL1||A|$TOT|0|')
+    assert keywords == {'$P1N': 'FL1|A', '$TOT': '0'}
+
+
+def test_rejects_non_fcs_and_missing_keywords(tmpdir):
+    path = str(tmpdir.join('not.fcs'))
+    with open(path, 'wb') as fh:
+        fh.write(b'{"samples": []}' * 10)
+    with pytest.raises(FCSParseError):
+        read_header(path)
+    truncated = str(tmpdir.join('truncated.fcs'))
+    with open(truncated, 'wb') as fh:
+        fh.write(b'FCS3.0')
+    with pytest.raises(FCSParseError):
+        read_header(truncated)
+
+
+def test_scan_headers_reuses_record(tmpdir):
+    paths = [fcs_file(str(tmpdir.join('{}.fcs'.format(i))), [b'FL1-A'], i)
+             for i in range(3)]
+    record = str(tmpdir.join('headers.json'))
+    fetched = []
+
+    def stat(path):
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime)
+
+    def fetch(path):
+        fetched.append(path)
+        return (path, False)
+
+    for attempt in range(2):
+        headers = scan_headers(paths, stat, fetch, workers=2,
+                               record=FileRecord(record))
+        assert [headers[p]['tot'] for p in paths] == [0, 1, 2]
+    assert sorted(fetched) == sorted(paths)
+
+
+def test_inspect_all_fetches_each_file_once(tmpdir):
+    paths = [fcs_file(str(tmpdir.join('{}.fcs'.format(i))), [b'FL1-A'], i)
+             for i in range(3)]
+    fetched = []
+
+    def stat(path):
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime)
+
+    def fetch(path):
+        fetched.append(path)
+        return (path, False)
+
+    (sha1s, headers) = inspect_all(stat, fetch, [
+        (paths[:2], sha1_file, FileRecord()),
+        (paths, read_header, FileRecord())], workers=2)
+    assert sorted(fetched) == sorted(paths)
+    assert sorted(sha1s) == sorted(paths[:2])
+    assert sha1s[paths[0]] == sha1_file(paths[0])
+    assert [headers[p]['tot'] for p in paths] == [0, 1, 2]
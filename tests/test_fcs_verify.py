@@ -0,0 +1,90 @@
+import hashlib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+from fcs_verify import FileRecord, sha1_file, verify_checksums
+
+
+def write(path, data):
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return hashlib.sha1(data).hexdigest()
+
+
+def local_stat(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+
+def test_sha1_file_spans_chunks(tmpdir):
+    path = str(tmpdir.join('a.fcs'))
+    expected = write(path, b'FCS3.0' * 1000)
+    assert sha1_file(path, chunk_size=4096) == expected
+    empty = str(tmpdir.join('empty.fcs'))
+    write(empty, b'')
+    assert sha1_file(empty) == hashlib.sha1(b'').hexdigest()
+
+
+def test_mismatches_and_missing_files_are_reported(tmpdir):
+    good = str(tmpdir.join('good.fcs'))
+    bad = str(tmpdir.join('bad.fcs'))
+    good_sha1 = write(good, b'complete')
+    write(bad, b'trunc')
+    missing = str(tmpdir.join('missing.fcs'))
+    failures = verify_checksums(
+        [(good, good_sha1), (bad, hashlib.sha1(b'truncated').hexdigest()),
+         (missing, good_sha1), (good, None)],
+        local_stat, lambda path: (path, False), workers=2)
+    assert [f[0] for f in failures] == [bad, missing]
+    assert failures[0][2] == hashlib.sha1(b'trunc').hexdigest()
+    assert isinstance(failures[1][2], OSError)
+
+
+def test_verified_files_are_skipped_on_rerun(tmpdir):
+    path = str(tmpdir.join('a.fcs'))
+    sha1 = write(path, b'events')
+    record = str(tmpdir.join('cache', 'verified.json'))
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        return (path, False)
+
+    assert verify_checksums([(path, sha1)], local_stat, fetch,
+                            record=FileRecord(record)) == []
+    assert verify_checksums([(path, sha1)], local_stat, fetch,
+                            record=FileRecord(record)) == []
+    assert fetched == [path]
+    # A rewritten file no longer matches the recorded size and is re-read
+    write(path, b'events, rewritten')
+    assert len(verify_checksums([(path, sha1)], local_stat, fetch,
+                                record=FileRecord(record))) == 1
+    assert fetched == [path, path]
+
+
+def test_temporary_copies_are_removed(tmpdir):
+    copy = str(tmpdir.join('copy'))
+    sha1 = write(copy, b'remote')
+    assert verify_checksums([('agave://sys/a.fcs', sha1)],
+                            lambda key: (6, 'stamp'),
+                            lambda key: (copy, True)) == []
+    assert not os.path.exists(copy)
+
+
+def test_unwritable_record_is_only_a_warning(tmpdir):
+    path = str(tmpdir.join('a.fcs'))
+    sha1 = write(path, b'events')
+    tmpdir.join('blocked').write('a file, not a directory')
+    warnings = []
+    logger = type(str('Logger'), (object,), {'warning': lambda self, m:
+                                             warnings.append(m)})()
+    record = FileRecord(str(tmpdir.join('blocked', 'cache', 'v.json')),
+                        logger)
+    assert verify_checksums([(path, sha1)], local_stat,
+                            lambda key: (key, False), record=record) == []
+    assert len(warnings) == 1 and 'could not save' in warnings[0]
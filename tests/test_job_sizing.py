@@ -0,0 +1,76 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+from job_sizing import JobHistory, SizingModel, hms, parse_timestamp
+
+COEFFICIENTS = {'overhead': 300, 'per_sample': 2.0, 'per_event': 0.00002,
+                'per_byte': 0.0000005}
+QUEUES = [{'name': 'normal', 'max_runtime': '48:00:00'},
+          {'name': 'short', 'max_runtime': '02:00:00'}]
+
+
+def test_parse_timestamp():
+    utc = parse_timestamp('2018-03-13T15:00:00.000Z')
+    assert parse_timestamp('2018-03-13T10:00:00.000-05:00') == utc
+    assert parse_timestamp('2018-03-13T10:30:00.250-05:00') - utc == 1800.25
+
+
+def test_small_and_large_jobs_get_different_queues():
+    model = SizingModel(COEFFICIENTS)
+    small = model.size('events', 8 * 10000, 8, 2, QUEUES, min_runtime=900)
+    assert small == {'queue': 'short', 'nodes': 1, 'maxRunTime': '00:15:00',
+                     'estimate': 319, 'calibrated': False}
+    large = model.size('events', 1500 * 200000, 1500, 3, QUEUES)
+    assert large['queue'] == 'normal'
+    assert large['maxRunTime'] == hms(large['estimate'] * 1.5)
+
+
+def test_uncalibrated_floor():
+    '''The fixed maxRunTime stays the minimum until history calibrates'''
+    model = SizingModel(COEFFICIENTS)
+    sizing = model.size('events', 8 * 10000, 8, 2, QUEUES, min_runtime=900,
+                        uncalibrated_min_runtime=3300)
+    assert (sizing['queue'], sizing['maxRunTime']) == ('short', '00:55:00')
+    model.fits['events'] = (60, 1.0, 0.0)
+    sizing = model.size('events', 8 * 10000, 8, 2, QUEUES, min_runtime=900,
+                        uncalibrated_min_runtime=3300)
+    assert sizing['maxRunTime'] == '00:15:00'
+
+
+def test_longest_queue_exceeded_uses_nodes():
+    model = SizingModel(COEFFICIENTS)
+    sizing = model.size('bytes', 10 ** 12, 10, 1, QUEUES, max_nodes=4)
+    assert sizing['queue'] == 'normal'
+    assert sizing['nodes'] == 4
+    assert sizing['maxRunTime'] == '48:00:00'
+
+
+def test_calibrated_from_history(tmpdir):
+    path = str(tmpdir.join('history.jsonl'))
+    history = JobHistory(path)
+    for i in range(10):
+        samples = 10 + 7 * i
+        units = 1000 * (i % 3 + 1) * samples
+        history.add({'job_id': 'job-{}'.format(i), 'unit': 'events',
+                     'units': units, 'samples': samples, 'channels': 2,
+                     'status': 'FINISHED',
+                     'seconds': 60 + 1.5 * samples + 0.001 * units * 2})
+    history.add({'job_id': 'pending', 'unit': 'events', 'units': 1,
+                 'samples': 1, 'channels': 1, 'submitted': 0})
+    history.save()
+
+    model = SizingModel(COEFFICIENTS, JobHistory(path), min_history=8)
+    (overhead, per_sample, per_event) = model.coefficients('events')
+    assert abs(overhead - 60) < 1e-6
+    assert abs(per_sample - 1.5) < 1e-6
+    assert abs(per_event - 0.001) < 1e-9
+    assert model.size('events', 1000, 10, 2, QUEUES)['calibrated']
+    # Byte-based estimates still come from the configured coefficients
+    assert model.coefficients('bytes') == (300, 2.0, 0.0000005)
+    # A job pending for over a week is given up on
+    assert list(JobHistory(path).pending()) == []
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+import pytest
+from manifest_reader import ManifestReader, ManifestParseError
+
+MANIFESTS = ['example-manifest.json', 'biofab-manifest.json']
+
+
+@pytest.mark.parametrize('filename', MANIFESTS)
+@pytest.mark.parametrize('chunk_size', [7, 64 * 1024])
+def test_reader_matches_json_load(filename, chunk_size):
+    '''Streamed header and samples match a full json.load'''
+    path = os.path.join(HERE, 'data', filename)
+    manifest = json.load(open(path))
+    reader = ManifestReader(path, chunk_size=chunk_size)
+    header = reader.header()
+    assert 'samples' not in header
+    for key in manifest:
+        if key != 'samples':
+            assert header[key] == manifest[key]
+    assert list(reader.samples(collected=False)) == manifest['samples']
+    assert list(reader.samples()) == \
+        [s for s in manifest['samples'] if s['collected']]
+
+
+def test_reader_header_keys():
+    '''Asking for specific keys still finds them'''
+    path = os.path.join(HERE, 'data', 'biofab-manifest.json')
+    header = ManifestReader(path).header(keys=['plan'])
+    assert header['plan'].endswith('biofab_yeast_gates_q0_aq_10545/1')
+
+
+def test_reader_from_bytes():
+    '''A manifest held in memory reads the same as one on disk'''
+    path = os.path.join(HERE, 'data', 'example-manifest.json')
+    with open(path, 'rb') as fh:
+        reader = ManifestReader.from_bytes(fh.read(), chunk_size=7)
+    assert reader.header() == ManifestReader(path).header()
+    assert list(reader.samples()) == list(ManifestReader(path).samples())
+
+
+def test_reader_truncated(tmpdir):
+    '''A truncated manifest raises ManifestParseError'''
+    path = os.path.join(HERE, 'data', 'example-manifest.json')
+    truncated = tmpdir.join('manifest.json')
+    truncated.write(open(path).read()[:2000])
+    with pytest.raises(ManifestParseError):
+        list(ManifestReader(str(truncated)).samples())
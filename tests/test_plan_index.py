@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+
+CHANNELS = [{'name': 'FL1-A'}]
+
+
+@pytest.fixture(scope='session')
+def manifest():
+    return json.load(open(os.path.join(HERE, 'data', 'example-manifest.json')))
+
+
+@pytest.fixture(scope='session')
+def plan():
+    return json.load(open(os.path.join(HERE, 'data', 'example-plan.json')))
+
+
+def test_plan_index_flags(plan):
+    '''PlanIndex finds the bead and blank states in one pass'''
+    index = reactor.PlanIndex(plan)
+    assert len(index) == len(plan['initialState'])
+    assert index.bead_sample.endswith('beadcontrol')
+    assert index.bead_model == 'SpheroTech RCP-30-5A'
+    assert index.blank_sample.endswith('A01')
+    assert index.get(index.bead_sample)['is_bead'] is True
+    assert index.get(index.blank_sample)['is_blank'] is True
+
+
+def test_plan_index_reused(plan):
+    '''An existing PlanIndex is passed through rather than rebuilt'''
+    index = reactor.PlanIndex(plan)
+    assert reactor.plan_index(index) is index
+
+
+def test_sample_to_URI(plan):
+    '''sample_to_URI gives the same answer for a plan or its index'''
+    index = reactor.PlanIndex(plan)
+    for state in plan['initialState']:
+        sample = state['Sample Id']
+        assert reactor.sample_to_URI(plan, sample) == \
+            reactor.sample_to_URI(index, sample)
+    assert reactor.sample_to_URI(index, 'no-such-sample') is None
+    assert reactor.sample_to_URI(index, index.bead_sample) == 'undefined'
+
+
+def test_process_control_from_index(manifest, plan):
+    '''Bead and blank files are resolved from the plan index'''
+    index = reactor.PlanIndex(plan)
+    experimental_data = reactor.extract_experimental_data(manifest, index)
+    pcd = reactor.build_process_control_data(
+        index, CHANNELS, experimental_data, 'agave://x/cytometer.json',
+        manifest)['tasbe_process_control_data']
+    assert pcd['bead_file'].endswith('Rule30Plate_A12.fcs')
+    assert pcd['blank_file'].endswith('Rule30Plate_A1.fcs')
+    assert pcd['TASBEConfig']['beads']['beadModel'] == index.bead_model
+
+
+def test_sample_records(manifest, plan):
+    '''Entries are slotted records that are written out as plain dicts'''
+    index = reactor.PlanIndex(plan)
+    experimental_data = reactor.extract_experimental_data(manifest, index)
+    samples = experimental_data['tasbe_experimental_data']['samples']
+    first = samples[0]
+    assert isinstance(first, reactor.SampleRecord)
+    assert first['file'] == first.file and first.get('missing') is None
+    assert first == {'file': first.file, 'sample': first.sample}
+    # Replicates of one condition share a single URI string
+    uris = [s.sample for s in samples]
+    assert len(set(id(u) for u in uris)) == len(set(uris))
+    document = reactor.experimental_data_json(experimental_data, samples[:1])
+    assert json.loads(json.dumps(document))['tasbe_experimental_data'][
+        'samples'] == [first.as_dict()]
+
+
+@pytest.mark.parametrize('path', [
+    'agave://data/a/b/c.fcs', 'b/c.fcs', 'c.fcs', '/c.fcs', 'a//b/c.fcs',
+    '//c.fcs'])
+def test_file_and_parent(path):
+    expected = os.path.join(os.path.basename(os.path.dirname(path)),
+                            os.path.basename(path))
+    assert reactor.file_and_parent(path) == expected
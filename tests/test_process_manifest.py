@@ -0,0 +1,158 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+import synthetic
+from fake_agave import FakeAgave, FakeCache, FakeReactor
+
+
+def test_submits_one_job(agave, settings):
+    r = FakeReactor(agave, settings)
+    message = reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert 'submitted job bench-job-1' in message
+    assert len(agave.submitted) == 1
+    inputs = agave.submitted[0]['inputs']
+    assert sorted(inputs) == ['analysisParameters', 'colorModelParameters',
+                              'cytometerConfiguration', 'experimentalData',
+                              'inputData', 'processControl']
+    # Manifest, plan and cytometer configuration, each fetched once
+    assert agave.calls['download'] == 3
+    experimental_data = json.loads(agave.remote[
+        inputs['experimentalData'].split(synthetic.SYSTEM, 1)[1]])
+    assert len(experimental_data['tasbe_experimental_data']['samples']) == 19
+
+
+def test_job_history_kept_on_agave(agave, settings):
+    settings['sizing']['history_file'] = None
+    reactor.process_manifest(FakeReactor(agave, settings),
+                             synthetic.MANIFEST_URI, 'actor')
+    # Uncalibrated, the job keeps the fixed maxRunTime as its floor
+    assert agave.submitted[0]['maxRunTime'] == '00:55:00'
+    path = settings['sizing']['history_uri'].split(synthetic.SYSTEM, 1)[1]
+    assert json.loads(agave.remote[path])['job_id'] == 'bench-job-1'
+    # The next execution starts from that history
+    history = reactor.job_history(FakeReactor(agave, settings))
+    assert [rec['job_id'] for rec in history.records] == ['bench-job-1']
+
+
+def test_sharded_jobs_read_only_their_files(agave, settings):
+    settings['sharding'].update(shards=2, min_files=1)
+    r = FakeReactor(agave, settings)
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert len(agave.submitted) == 2
+    counts = []
+    for job in agave.submitted:
+        path = job['inputs']['experimentalData'].split(synthetic.SYSTEM, 1)[1]
+        assert path.endswith('_shard{}.json'.format(len(counts)))
+        counts.append(len(json.loads(agave.remote[path])[
+            'tasbe_experimental_data']['samples']))
+    assert sum(counts) == 19
+    assert not any(p.endswith('/experimental_data.json')
+                   for p in agave.remote)
+
+
+def test_missing_plan_is_reported(agave, settings):
+    del agave.remote[synthetic.PLAN_URI.split(synthetic.SYSTEM, 1)[1]]
+    r = FakeReactor(agave, settings)
+    with pytest.raises(RuntimeError) as e:
+        reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert 'failed to download /plan/bench-plan.json' in str(e.value)
+    assert agave.submitted == []
+
+
+def test_identical_inputs_are_not_resubmitted(agave, settings, monkeypatch):
+    cache = FakeCache()
+    monkeypatch.setattr(reactor, 'artifact_cache', lambda r: cache)
+    r = FakeReactor(agave, settings)
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert len(cache) == 1
+    message = reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert 'found existing job bench-job-1' in message
+    assert len(agave.submitted) == 1
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor', force=True)
+    assert len(agave.submitted) == 2
+
+
+def test_inputs_digest(settings):
+    r = FakeReactor(FakeAgave(), settings)
+    documents = [b'manifest', b'plan', b'cytometer']
+    digest = reactor.inputs_digest(r, synthetic.MANIFEST_URI, documents)
+    assert reactor.inputs_digest(
+        r, synthetic.MANIFEST_URI, list(documents)) == digest
+    assert reactor.inputs_digest(
+        r, synthetic.MANIFEST_URI, documents[:2] + [b'other']) != digest
+    assert reactor.inputs_digest(r, synthetic.MANIFEST_URI.replace(
+        'manifest.json', 'manifest_v2.json'), documents) != digest
+    # Settings that shape the artifacts count; others do not
+    r.settings['sharding'] = {'shards': 7}
+    sharded = reactor.inputs_digest(r, synthetic.MANIFEST_URI, documents)
+    assert sharded != digest
+    r.settings['retention'] = {'keep_runs': 1}
+    assert reactor.inputs_digest(
+        r, synthetic.MANIFEST_URI, documents) == sharded
+
+
+def mount(tmpdir, manifest):
+    '''Lay the manifest's FCS files out as a mounted source.local_root'''
+    for (path, contents) in synthetic.fcs_files(manifest):
+        tmpdir.join('mount', path).write_binary(contents, ensure=True)
+    return str(tmpdir.join('mount'))
+
+
+def test_verification_reads_only_mounted_files(agave, settings, tmpdir):
+    settings['verification'].update(
+        enabled=True, cache_file=str(tmpdir.join('verified.json')))
+    r = FakeReactor(agave, settings)
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    # No mount: skipped rather than downloading every FCS file
+    assert agave.calls['download'] == 3
+    assert len(agave.submitted) == 1
+
+    manifest = json.loads(agave.remote[synthetic.MANIFEST_PATH])
+    settings['source']['local_root'] = mount(tmpdir, manifest)
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert len(agave.submitted) == 2
+    assert agave.calls['download'] == 5
+
+    bad = manifest['samples'][5]['files'][0]['file'].split(synthetic.SYSTEM)[1]
+    tmpdir.join('mount', bad).write_binary(b'truncated')
+    with pytest.raises(RuntimeError) as e:
+        reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert 'failing verification' in str(e.value)
+    assert len(agave.submitted) == 2
+
+
+def test_prescan_reads_only_mounted_headers(agave, settings, tmpdir):
+    settings['prescan'].update(
+        enabled=True, cache_file=str(tmpdir.join('headers.json')))
+    r = FakeReactor(agave, settings)
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    # No mount: sizing falls back to the listing's file sizes
+    assert agave.calls['download'] == 3
+    assert synthetic.COLLECTION + '/instrument_output' in agave.listed
+
+    manifest = json.loads(agave.remote[synthetic.MANIFEST_PATH])
+    settings['source']['local_root'] = mount(tmpdir, manifest)
+    empty = manifest['samples'][5]['files'][0]['file']
+    name = empty.rsplit('/', 1)[1][:-len('.fcs')]
+    tmpdir.join('mount', empty.split(synthetic.SYSTEM)[1]).write_binary(
+        synthetic.fcs_file(name, events=0))
+    del agave.listed[:]
+    reactor.process_manifest(r, synthetic.MANIFEST_URI, 'actor')
+    assert agave.calls['download'] == 5
+    assert synthetic.COLLECTION + '/instrument_output' not in agave.listed
+    path = agave.submitted[1]['inputs']['experimentalData'].split(
+        synthetic.SYSTEM, 1)[1]
+    samples = json.loads(agave.remote[path])[
+        'tasbe_experimental_data']['samples']
+    assert len(samples) == 18
@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+import os
+import sys
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+from attrdict import AttrDict
+from fake_agave import FakeAgave, FakeReactor
+
+
+class Exit(Exception):
+    pass
+
+
+@pytest.fixture
+def r(monkeypatch):
+    r = FakeReactor(FakeAgave())
+
+    def on_success(message):
+        raise Exit(message)
+    r.on_success = on_success
+    return r
+
+
+@pytest.fixture
+def drains(monkeypatch):
+    calls = []
+
+    def drain_submissions(r, queue):
+        calls.append(queue)
+        return {'submitted': [], 'failed': [], 'waiting': 0,
+                'completed': [], 'abandoned': []}
+    monkeypatch.setattr(reactor, 'drain_submissions', drain_submissions)
+    return calls
+
+
+def test_drain_message(r, drains, tmpdir):
+    r.settings['submission_queue'] = {'enabled': True,
+                                      'directory': str(tmpdir)}
+    with pytest.raises(Exit) as e:
+        reactor.process_message(r, {'drain': True}, 'actor')
+    assert 'drained the submission queue' in str(e.value)
+    assert len(drains) == 1
+    assert r.client.messages == []
+
+
+def held_back(r, tmpdir):
+    r.settings['submission_queue'] = {
+        'enabled': True, 'directory': str(tmpdir),
+        'app_caps': {'default': 0}, 'execution_systems': {'app': 'hpc'},
+        'drain_seconds': 60, 'poll_seconds': 120}
+    return reactor.submission_queue(r)
+
+
+def test_waiting_jobs_request_one_drain(r, tmpdir):
+    queue = held_back(r, tmpdir)
+    for label in ('a', 'b'):
+        assert reactor.queue_jobs(r, queue, [AttrDict(appId='app')],
+                                  label) == [(None, None)]
+    assert r.client.messages == [('bench-actor', {'drain': True})]
+    assert 'get' not in r.client.calls
+
+
+def test_drainer_hands_over_while_jobs_wait(r, tmpdir):
+    queue = held_back(r, tmpdir)
+    reactor.queue_jobs(r, queue, [AttrDict(appId='app')], 'a')
+    with pytest.raises(Exit) as e:
+        reactor.process_message(r, {'drain': True}, 'actor')
+    assert '0 submitted, 0 failed, 1 waiting' in str(e.value)
+    assert len(r.client.messages) == 2
+    assert not reactor.request_drain(r, queue)
+
+
+def test_false_drain_flag_does_nothing(r, drains, tmpdir):
+    r.settings['submission_queue'] = {'enabled': True,
+                                      'directory': str(tmpdir)}
+    with pytest.raises(Exit) as e:
+        reactor.process_message(r, {'drain': False}, 'actor')
+    assert 'nothing to do' in str(e.value)
+    assert drains == []
+
+
+def test_message_uris():
+    assert list(reactor.message_uris({'uri': 'agave://a'})) == \
+        [('agave://a', False)]
+    assert list(reactor.message_uris(
+        {'uris': ['agave://a', 'agave://b'], 'force': True})) == \
+        [('agave://a', True), ('agave://b', True)]
+    assert list(reactor.message_uris({'drain': True})) == []
+
+
+def test_batch_failures_skip_only_their_manifest(monkeypatch):
+    r = FakeReactor(FakeAgave())
+    r.on_failure = types.MethodType(reactor.on_batch_failure, r)
+
+    def process_manifest(r, uri, actor_name, force=False):
+        if uri == 'agave://reported':
+            r.on_failure('could not read {}'.format(uri), 'bad JSON')
+        if uri == 'agave://crashed':
+            raise KeyError('plan')
+        return '{} done (force={})'.format(uri, force)
+    monkeypatch.setattr(reactor, 'process_manifest', process_manifest)
+    messages = [{'uris': ['agave://reported', 'agave://ok']},
+                {'uri': 'agave://crashed'}, {'uri': 'agave://ok',
+                                             'force': True}]
+    results = list(reactor.process_messages(r, messages, 'actor'))
+    assert [(uri, ok) for (uri, ok, message) in results] == [
+        ('agave://reported', False), ('agave://ok', True),
+        ('agave://crashed', False), ('agave://ok', True)]
+    assert results[0][2] == 'could not read agave://reported : bad JSON'
+    assert results[3][2] == 'agave://ok done (force=True)'
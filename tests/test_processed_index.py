@@ -0,0 +1,52 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+from processed_index import ProcessedIndex, color_model_key
+
+CHANNELS = [{'name': 'FL1-A'}]
+
+
+def key(bead='b1', blank='k1', channels=CHANNELS):
+    return color_model_key(bead, blank, 'SpheroTech RCP-30-5A', 'Lot AA01',
+                           ['agave://sys/cytometer.json', 'abc'], channels)
+
+
+def test_unprocessed_plan_has_no_diff():
+    assert ProcessedIndex().changed_files('plan', [('f1', 'a')]) is None
+
+
+def test_new_changed_and_unchecksummed_files(tmpdir):
+    index = ProcessedIndex()
+    index.merge('plan', {'manifest': 'm1'},
+                {'f1': {'checksum': 'a', 'job_id': 'job-1'},
+                 'f2': {'checksum': 'b', 'job_id': 'job-1'}},
+                {'key': key(), 'processControl': 'agave://sys/pcd.json'})
+    path = str(tmpdir.join('index.json'))
+    index.save(path)
+    index = ProcessedIndex.load(path)
+
+    changed = index.changed_files(
+        'plan', [('f1', 'a'), ('f2', 'changed'), ('f3', 'c'), ('f4', None)])
+    assert changed == ['f2', 'f3', 'f4']
+    assert index.changed_files('other-plan', [('f1', 'a')]) is None
+    assert index.last_version('plan') == {'manifest': 'm1'}
+
+
+def test_color_model_reused_only_for_same_inputs():
+    index = ProcessedIndex()
+    index.merge('plan', {'manifest': 'm1'}, {},
+                {'key': key(), 'processControl': 'agave://sys/pcd.json'})
+    assert index.color_model('plan', key())['processControl'] == \
+        'agave://sys/pcd.json'
+    assert index.color_model('plan', key(bead='b2')) is None
+    assert index.color_model('plan', key(channels=[{'name': 'FL2-A'}])) \
+        is None
+    # A later run that reused the model leaves it in place
+    index.merge('plan', {'manifest': 'm2'}, {'f1': {'checksum': 'a'}})
+    assert index.color_model('plan', key()) is not None
+    assert len(index.plan('plan')['versions']) == 2
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import replicate_groups
+from reactor import PlanIndex
+
+
+def state(sample_id, strain, iptg, ara, atc, blank=False):
+    conditions = [{'IPTG_measure': iptg}, {'Larabinose_measure': ara},
+                  {'aTc_measure': atc}]
+    if blank:
+        conditions.append({'Is_Blank': True})
+    return {'Sample Id': sample_id, 'Conditions': conditions,
+            'Strains': [{'Strain Id': 'x#{}'.format(strain)}]}
+
+
+@pytest.fixture
+def plan():
+    return PlanIndex({'initialState': [
+        state('s1', 'A', 0, 5, 0.5),
+        state('s2', 'A', 0, 5, 0.5),
+        state('s3', 'B', 1, 5, 0.5),
+        state('s4', 'B', 1, 5, 0.5, blank=True),
+        {'Sample Id': 's5', 'Conditions': []}]})
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(replicate_groups, '_numpy', lambda: None)
+    elif replicate_groups._numpy() is None:
+        pytest.skip('numpy is not installed')
+
+
+def test_groups_identical_conditions(plan, backend):
+    files = ['d/{}.fcs'.format(i) for i in range(6)]
+    owners = ['s3', 's1', 's4', 's2', 's5', 's3']
+    samples = [{'file': f, 'sample': 'uri'} for f in files]
+    groups = replicate_groups.replicate_groups(
+        samples, dict(zip(files, owners)), plan)
+    assert groups == [
+        {'label': 'B_system_5_0p5_1', 'samples': ['d/0.fcs', 'd/5.fcs']},
+        {'label': 'A_system_5_0p5_0', 'samples': ['d/1.fcs', 'd/3.fcs']},
+        {'label': 'B_system_5_0p5_1_blank', 'samples': ['d/2.fcs']}]
+
+
+def test_no_known_files(plan, backend):
+    samples = [{'file': 'd/0.fcs', 'sample': 'uri'}]
+    assert replicate_groups.replicate_groups(
+        samples, {'d/0.fcs': 's5'}, plan) == []
+
+
+def test_python_matches_numpy(monkeypatch):
+    if replicate_groups._numpy() is None:
+        pytest.skip('numpy is not installed')
+    plan = PlanIndex({'initialState': [
+        state('s{}'.format(i), 'ABC'[i % 3], i % 2, 5 * (i % 4), 0.5,
+              blank=(i % 7 == 0))
+        for i in range(60)]})
+    files = ['d/{}.fcs'.format(i) for i in range(500)]
+    owners = dict((f, 's{}'.format((i * 13) % 61))
+                  for i, f in enumerate(files))
+    samples = [{'file': f, 'sample': 'uri'} for f in files]
+    table = replicate_groups.ConditionTable(plan)
+    expected = replicate_groups.replicate_groups(samples, owners, plan)
+    monkeypatch.setattr(replicate_groups, '_numpy', lambda: None)
+    assert replicate_groups.replicate_groups(
+        samples, owners, plan, table=table) == expected
+    assert len(expected) > 1
@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+from artifact_store import ArtifactStore
+from fake_agave import FakeAgave, FakeReactor
+
+BASE = '/temp/flow_etl/launch_fcs_etl_app/'
+
+
+def fake_reactor(tree, contents):
+    '''FakeReactor over files at path -> lastModified'''
+    agave = FakeAgave()
+    for (path, modified) in tree.items():
+        agave.store(path, contents.get(path, b'{}'))
+        agave.modified[path] = modified
+    return FakeReactor(agave, {'destination': {'base_path': BASE,
+                                               'system_id': 'data'},
+                               'retention': {'keep_runs': 2,
+                                             'min_age_days': 14}})
+
+
+def test_artifacts_digest():
+    store = ArtifactStore()
+    store.put('a.json', b'{"a": 1}')
+    store.put('b.json', b'{"b": 2}')
+    first = reactor.artifacts_digest(store, {'x': 'a.json', 'y': 'b.json'})
+    assert reactor.RUN_ID.match(first)
+    assert reactor.artifacts_digest(
+        store, {'y': 'b.json', 'x': 'a.json'}) == first
+    # Swapping which input gets which file is a different run
+    assert reactor.artifacts_digest(
+        store, {'x': 'b.json', 'y': 'a.json'}) != first
+    store.put('a.json', b'{"a": 2}')
+    assert reactor.artifacts_digest(
+        store, {'x': 'a.json', 'y': 'b.json'}) != first
+
+
+def test_compact_keeps_newest_and_referenced_runs(monkeypatch):
+    runs = ['{:016x}'.format(i) for i in range(5)]
+    tree = dict((BASE + 'plan/{}/experimental_data.json'.format(run),
+                 '2017-01-0{}T00:00:00.000Z'.format(i + 1))
+                for i, run in enumerate(runs))
+    tree[BASE + 'plan/latest.json'] = '2017-01-06T00:00:00.000Z'
+    tree[BASE + 'plan/analysis_parameters.json.1520000000000'] = \
+        '2017-01-01T00:00:00.000Z'
+    tree[BASE + 'plan/notes/readme.txt'] = '2017-01-01T00:00:00.000Z'
+    latest = {'run': runs[4], 'inputs': {
+        'processControl': 'agave://data{}plan/{}/pcd.json'.format(
+            BASE, runs[1])}}
+    agaveutils = type(str('AgaveUtils'), (object,), {})()
+    agaveutils.from_agave_uri = lambda uri: ('data',) + os.path.split(
+        uri.split('data', 1)[1])
+    monkeypatch.setattr(reactor, 'agaveutils', agaveutils)
+
+    r = fake_reactor(tree, {BASE + 'plan/latest.json':
+                            json.dumps(latest).encode('utf-8')})
+    pruned = reactor.compact_runs(r)
+    assert sorted(pruned) == sorted([
+        BASE + 'plan/analysis_parameters.json.1520000000000',
+        BASE + 'plan/' + runs[0], BASE + 'plan/' + runs[2]])
+    assert r.client.calls['delete'] == len(pruned)
+    assert sorted(r.client.remote) == sorted(
+        p for p in tree if not any(p == d or p.startswith(d + '/')
+                                   for d in pruned))
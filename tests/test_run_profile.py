@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+import pytest
+from run_profile import RunProfile, Profiler, CPROFILE_ENV
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_laps_and_counts():
+    '''Each lap times the stage since the previous one'''
+    clock = Clock()
+    profile = RunProfile('agave://sys/manifest.json', 'exec', clock=clock)
+    clock.now += 1.5
+    profile.lap('download_manifest', bytes=10)
+    clock.now += 0.25
+    profile.lap('index_plan', plan_states=3)
+    profile.count(bytes_downloaded=10)
+    profile.count(bytes_downloaded=5)
+    profile.finish('ok')
+    record = json.loads(profile.to_json())
+    assert record['status'] == 'ok'
+    assert record['seconds'] == 1.75
+    assert [s['stage'] for s in record['stages']] == \
+        ['download_manifest', 'index_plan']
+    assert record['stages'][0]['bytes'] == 10
+    assert record['stages'][1]['seconds'] == 0.25
+    assert record['counts'] == {'bytes_downloaded': 15}
+
+
+def test_profiler_opt_in(tmpdir):
+    '''cProfile only runs when REACTOR_CPROFILE is set'''
+    with Profiler(environ={}) as off:
+        pass
+    assert off.profiler is None
+    stats = str(tmpdir.join('reactor.prof'))
+    with Profiler(environ={CPROFILE_ENV: stats}):
+        sum(range(1000))
+    assert os.path.isfile(stats)
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+from artifact_bundle import read_bundle
+
+
+def entries(groups):
+    '''groups: list of (sample, [file names])'''
+    return [{'sample': s, 'file': 'instrument_output/' + f}
+            for (s, files) in groups for f in files]
+
+
+def test_replicates_stay_together():
+    '''All files for one sample URI land in the same shard'''
+    samples = entries([('a', ['a1.fcs', 'a2.fcs', 'a3.fcs']),
+                       ('b', ['b1.fcs']), ('c', ['c1.fcs']),
+                       ('d', ['d1.fcs', 'd2.fcs'])])
+    shards = reactor.shard_samples(samples, 3)
+    assert sorted(len(s) for s in shards) == [2, 2, 3]
+    for sample in 'abcd':
+        assert len([s for s in shards
+                    if sample in [e['sample'] for e in s]]) == 1
+    assert sum(len(s) for s in shards) == len(samples)
+
+
+def test_weighted_by_size():
+    '''One large file balances against several small ones'''
+    samples = entries([('big', ['big.fcs'])])
+    samples.extend(entries([('s{}'.format(i), ['s{}.fcs'.format(i)])
+                            for i in range(4)]))
+    sizes = dict(('s{}.fcs'.format(i), 10) for i in range(4))
+    sizes['big.fcs'] = 40
+    shards = reactor.shard_samples(samples, 2, sizes)
+    assert sorted(len(s) for s in shards) == [1, 4]
+
+
+def test_unresolved_samples_split():
+    '''undefined sample URIs are not treated as one replicate group'''
+    samples = entries([('undefined', ['u1.fcs', 'u2.fcs'])])
+    assert len(reactor.shard_samples(samples, 2)) == 2
+
+
+def test_more_shards_than_groups():
+    '''Empty shards are dropped'''
+    samples = entries([('a', ['a1.fcs'])])
+    assert reactor.shard_samples(samples, 4) == [samples]
+
+
+def test_shard_inputs():
+    inputs = {'analysisParameters.0': 'a0', 'analysisParameters.1': 'a1',
+              'experimentalData.1': 'e1', 'inputData': 'd'}
+    assert reactor.shard_inputs(inputs, 1) == {
+        'analysisParameters': 'a1', 'experimentalData': 'e1',
+        'inputData': 'd'}
+
+
+def test_bundles_hold_their_shard_artifacts():
+    store = reactor.ArtifactStore()
+    datafiles = {'cytometerConfiguration': store.put('cyto.json', b'c')}
+    for i in range(2):
+        for name in ('experimental_data.json', 'analysis_parameters.json'):
+            store.put(reactor.shard_file(name, i),
+                      '{}{}'.format(name, i).encode('ascii'))
+        datafiles['experimentalData.{}'.format(i)] = \
+            reactor.shard_file('experimental_data.json', i)
+        datafiles['analysisParameters.{}'.format(i)] = \
+            reactor.shard_file('analysis_parameters.json', i)
+    bundles = reactor.bundle_artifacts(store, datafiles, 2, 'artifactBundle')
+    assert sorted(bundles) == ['artifactBundle.0', 'artifactBundle.1']
+    (index, contents) = read_bundle(
+        store.get(bundles['artifactBundle.1']))
+    assert index == {'analysisParameters': 'analysis_parameters.json',
+                     'cytometerConfiguration': 'cyto.json',
+                     'experimentalData': 'experimental_data.json'}
+    assert contents['analysis_parameters.json'] == b'analysis_parameters.json1'
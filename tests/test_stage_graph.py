@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+import os
+import sys
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+from stage_graph import StageFailed, StageGraph
+
+
+def test_dependencies_receive_values():
+    graph = StageGraph(workers=2)
+    graph.add('a', lambda: 2)
+    graph.add('b', lambda: 3)
+    graph.add('sum', lambda a, b: a + b, after=('a', 'b'))
+    try:
+        assert graph.result('sum') == 5
+        assert 'sum' in graph and 'c' not in graph
+        assert sorted(n for n, s in graph.timings()) == ['a', 'b', 'sum']
+    finally:
+        graph.close()
+
+
+def test_independent_stages_overlap():
+    '''Each stage waits for the other to start, so they must run together'''
+    started = [threading.Event(), threading.Event()]
+
+    def stage(mine, other):
+        started[mine].set()
+        return started[other].wait(5)
+    graph = StageGraph(workers=2)
+    graph.add('one', lambda: stage(0, 1))
+    graph.add('two', lambda: stage(1, 0))
+    try:
+        assert graph.result('one') and graph.result('two')
+    finally:
+        graph.close()
+
+
+def test_failure_cancels_dependents():
+    ran = []
+
+    def fail():
+        raise IOError('502 from storage')
+    graph = StageGraph(workers=2)
+    graph.add('download', fail)
+    graph.add('parse', lambda data: ran.append('parse'), after=('download',))
+    graph.add('other', lambda: 'ok')
+    try:
+        with pytest.raises(StageFailed) as info:
+            graph.result('parse')
+        assert info.value.stage == 'download'
+        assert isinstance(info.value.error, IOError)
+        assert graph.result('other') == 'ok'
+        assert ran == []
+    finally:
+        graph.close()
+
+
+def test_close_cancels_waiting_stages():
+    gate = threading.Event()
+    graph = StageGraph(workers=1)
+    graph.add('slow', gate.wait)
+    graph.add('after', lambda value: value, after=('slow',))
+    graph.close()
+    gate.set()
+    with pytest.raises(StageFailed):
+        graph.result('after')
+    with pytest.raises(ValueError):
+        graph.add('orphan', lambda x: x, after=('missing',))
@@ -0,0 +1,186 @@
+import fcntl
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/')
+
+import pytest
+from retry_backoff import backoff
+from submit_queue import SubmissionQueue
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Agave(object):
+    '''Submits jobs and reports their status; can be told to fail'''
+    def __init__(self):
+        self.status = {}
+        self.fail = 0
+
+    def submit(self, job_def):
+        if self.fail > 0:
+            self.fail -= 1
+            raise IOError('503 Service Unavailable')
+        job_id = 'job-{}'.format(len(self.status))
+        self.status[job_id] = 'QUEUED'
+        return job_id
+
+    def get(self, job_id):
+        return self.status[job_id]
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_queue(tmpdir, clock, **kwargs):
+    return SubmissionQueue(str(tmpdir.join('queue')), clock=clock, **kwargs)
+
+
+def test_caps_hold_back_jobs_until_slots_free(tmpdir, clock):
+    agave = Agave()
+    caps = {'system': {'default': 3}, 'app': {'fcs-etl': 2}}
+    queue = make_queue(tmpdir, clock, caps=caps)
+    for i in range(4):
+        queue.enqueue({'appId': 'fcs-etl', 'name': str(i)}, 'hpc', 'm')
+    queue.enqueue({'appId': 'other'}, 'hpc', 'm')
+    summary = queue.drain(agave.submit, agave.get)
+    assert [e['job_def']['appId'] for e in summary['submitted']] == \
+        ['fcs-etl', 'fcs-etl', 'other']
+    assert summary['waiting'] == 2
+
+    # A later execution sees the same store
+    queue = make_queue(tmpdir, clock, caps=caps)
+    assert queue.drain(agave.submit, agave.get)['submitted'] == []
+    agave.status['job-0'] = 'FINISHED'
+    summary = queue.drain(agave.submit, agave.get)
+    assert [e['job_def']['name'] for e in summary['submitted']] == ['2']
+    assert summary['waiting'] == 1
+
+
+def test_failed_submissions_back_off_then_give_up(tmpdir, clock):
+    agave = Agave()
+    agave.fail = 10
+    queue = make_queue(tmpdir, clock, max_attempts=3, backoff_seconds=10)
+    queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm')
+    assert queue.drain(agave.submit, agave.get)['waiting'] == 1
+    # Not retried before the backoff expires
+    assert queue.drain(agave.submit, agave.get)['waiting'] == 1
+    assert queue.pending()[0]['attempts'] == 1
+    clock.now += 20
+    queue.drain(agave.submit, agave.get)
+    clock.now += 40
+    summary = queue.drain(agave.submit, agave.get)
+    assert summary['waiting'] == 0
+    assert summary['failed'][0]['attempts'] == 3
+    assert '503' in summary['failed'][0]['error']
+
+
+def test_retry_succeeds(tmpdir, clock):
+    agave = Agave()
+    agave.fail = 1
+    queue = make_queue(tmpdir, clock)
+    queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm')
+    queue.drain(agave.submit, agave.get)
+    clock.now += 3600
+    summary = queue.drain(agave.submit, agave.get)
+    assert summary['submitted'][0]['job_id'] == 'job-0'
+
+
+def test_agave_calls_do_not_hold_the_lock(tmpdir, clock):
+    agave = Agave()
+    queue = make_queue(tmpdir, clock)
+
+    def unlocked(call):
+        def _call(arg):
+            with open(queue.lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            return call(arg)
+        return _call
+
+    queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm')
+    queue.drain(unlocked(agave.submit), unlocked(agave.get))
+    queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm')
+    summary = queue.drain(unlocked(agave.submit), unlocked(agave.get))
+    assert [e['job_id'] for e in summary['submitted']] == ['job-1']
+
+
+def test_status_checks_run_in_parallel_unless_skipped(tmpdir, clock):
+    agave = Agave()
+    queue = make_queue(tmpdir, clock, caps={'app': {'default': 4}})
+    calls = []
+    lock = threading.Lock()
+    running = [0]
+
+    def status(job_id):
+        with lock:
+            running[0] += 1
+            calls.append(running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return agave.get(job_id)
+
+    for i in range(5):
+        queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm')
+    queue.drain(agave.submit, status)
+    agave.status['job-0'] = 'FINISHED'
+    summary = queue.drain(agave.submit, status, refresh=False)
+    assert summary['submitted'] == [] and calls == []
+    summary = queue.drain(agave.submit, status)
+    assert [e['job_id'] for e in summary['submitted']] == ['job-4']
+    assert len(calls) == 4 and max(calls) > 1
+
+
+def test_one_drainer_at_a_time(tmpdir, clock):
+    queue = make_queue(tmpdir, clock)
+    assert queue.claim_drainer('request-1', 600, running=False)
+    assert not queue.claim_drainer('request-2', 600, running=False)
+    # The execution answering a request takes over from it
+    assert queue.claim_drainer('exec-1', 600)
+    assert not queue.claim_drainer('exec-2', 600)
+    assert not queue.claim_drainer('request-3', 600, running=False)
+    queue.release_drainer('exec-2')
+    assert not queue.claim_drainer('exec-2', 600)
+    clock.now += 600
+    assert queue.claim_drainer('exec-2', 600)
+    queue.release_drainer('exec-2')
+    assert queue.claim_drainer('request-3', 600, running=False)
+
+
+def test_group_completes_with_its_last_job(tmpdir, clock):
+    agave = Agave()
+    queue = make_queue(tmpdir, clock, caps={'app': {'default': 1}})
+    group = queue.add_group(2, {'run': 'r1'})
+    for i in range(2):
+        queue.enqueue({'appId': 'fcs-etl'}, 'hpc', 'm',
+                      {'group': group, 'position': i})
+    assert queue.drain(agave.submit, agave.get)['completed'] == []
+    assert list(queue.groups()) == [group]
+    agave.status['job-0'] = 'FINISHED'
+    summary = queue.drain(agave.submit, agave.get)
+    assert summary['completed'] == [{'id': group, 'record': {'run': 'r1'},
+                                     'job_ids': ['job-0', 'job-1']}]
+    assert queue.groups() == {}
+    assert queue.drain(agave.submit, agave.get)['completed'] == []
+
+
+def test_backoff_grows_and_is_capped():
+    class Rng(object):
+        def uniform(self, low, high):
+            return high
+    assert [backoff(n, 30, 200, Rng()) for n in (1, 2, 3, 4)] == \
+        [30, 60, 120, 200]
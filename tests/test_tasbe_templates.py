@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import tasbe_templates
+import reactor
+
+
+@pytest.mark.parametrize('name', sorted(tasbe_templates.TEMPLATES.keys()))
+def test_load_returns_copies(name):
+    '''Each load() is an independent copy of the parsed template'''
+    first = tasbe_templates.load(name)
+    assert first == json.loads(tasbe_templates.TEMPLATES[name])
+    first['_mutated'] = True
+    assert '_mutated' not in tasbe_templates.load(name)
+
+
+def test_color_model_channels():
+    '''One channel_parameters entry per channel, ERF from the first'''
+    channels = [{'name': 'FL{}-A'.format(i)} for i in range(3)]
+    params = reactor.build_color_model(
+        channels)['tasbe_color_model_parameters']
+    assert [c['name'] for c in params['channel_parameters']] == \
+        ['FL0-A', 'FL1-A', 'FL2-A']
+    assert params['ERF_channel_name'] == 'FL0-A'
+
+
+def test_values_with_quotes():
+    '''Names containing quotes are stored verbatim, not spliced into JSON'''
+    name = 'FL1 "green"'
+    params = reactor.build_color_model(
+        [{'name': name}])['tasbe_color_model_parameters']
+    assert params['channel_parameters'][0]['name'] == name
+
+
+def test_template_change_changes_inputs_digest(tmpdir, monkeypatch):
+    '''Editing a template invalidates artifacts cached under the old one'''
+    for name in reactor.ARTIFACT_MODULES:
+        tmpdir.join(name + '.py').write_binary(
+            open(os.path.join(PARENT, name + '.py'), 'rb').read())
+    before = reactor.source_digest(str(tmpdir))
+    template = tmpdir.join('tasbe_templates.py')
+    template.write_binary(template.read_binary().replace(
+        b'"pointCloudPath": "output"', b'"pointCloudPath": "points"'))
+    after = reactor.source_digest(str(tmpdir))
+    assert before != after
+
+    r = type(str('R'), (object,), {'settings': {}})()
+    digests = []
+    for source in (before, after):
+        monkeypatch.setattr(reactor, 'source_digest', lambda: source)
+        digests.append(reactor.inputs_digest(r, 'agave://data/m.json',
+                                             [b'{}']))
+    assert digests[0] != digests[1]
@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'benchmarks'))
+sys.path.append('/reactors')
+sys.path.append('/')
+
+import pytest
+import reactor
+from artifact_store import ArtifactStore
+from fake_agave import FakeAgave, FakeReactor
+
+
+def uri(path):
+    return 'agave://data{}'.format(path)
+
+
+def test_download_files_in_order():
+    agave = FakeAgave()
+    agave.store('/a/plan.json', b'plan')
+    agave.store('/b/cyto.json', b'cyto')
+    store = ArtifactStore()
+    results = reactor.download_files(
+        FakeReactor(agave), [(uri('/a/plan.json'), 'plan.json'),
+                             (uri('/b/cyto.json'), 'cyto.json')], store)
+    assert [(res['path'], res['error']) for res in results] == \
+        [('/a/plan.json', None), ('/b/cyto.json', None)]
+    assert store.get(results[1]['file']) == b'cyto'
+
+
+def test_download_errors_are_returned_per_file():
+    agave = FakeAgave()
+    agave.store('/a/plan.json', b'plan')
+    results = reactor.download_files(
+        FakeReactor(agave), [(uri('/a/missing.json'), 'missing.json'),
+                             (uri('/a/plan.json'), 'plan.json')],
+        ArtifactStore())
+    assert results[0]['file'] is None
+    assert isinstance(results[0]['error'], KeyError)
+    assert results[1]['error'] is None
+
+
+def test_download_timeout():
+    agave = FakeAgave(latency=0.5)
+    agave.store('/a/plan.json', b'plan')
+    results = reactor.download_files(
+        FakeReactor(agave), [(uri('/a/plan.json'), 'plan.json')],
+        ArtifactStore(), timeout=0.05)
+    assert 'timed out' in str(results[0]['error'])
+
+
+def artifacts(*names):
+    store = ArtifactStore()
+    for name in names:
+        store.put(name, name.encode('ascii'))
+    return store
+
+
+def test_upload_files_returns_job_inputs():
+    agave = FakeAgave()
+    store = artifacts('a.json', 'b.json')
+    (inputs, failed) = reactor.upload_files(
+        FakeReactor(agave), store, {'A': 'a.json', 'B': 'b.json'},
+        'data', '/runs/1')
+    assert failed is None
+    assert inputs == {'A': uri('/runs/1/a.json'), 'B': uri('/runs/1/b.json')}
+    assert agave.remote['/runs/1/b.json'] == b'b.json'
+
+
+def test_upload_failure_names_the_file(monkeypatch):
+    agave = FakeAgave()
+    import_data = agave.files.importData
+
+    def flaky(systemId, filePath, fileName, fileToUpload):
+        if fileName == 'b.json':
+            raise IOError('503 Service Unavailable')
+        return import_data(systemId, filePath, fileName, fileToUpload)
+    monkeypatch.setattr(agave.files, 'importData', flaky)
+    (inputs, failed) = reactor.upload_files(
+        FakeReactor(agave), artifacts('a.json', 'b.json'),
+        {'A': 'a.json', 'B': 'b.json'}, 'data', '/runs/1', workers=1)
+    assert failed[0] == 'b.json'
+    assert '503' in str(failed[1])
+    assert 'B' not in inputs
+
+
+def test_upload_timeout():
+    (inputs, failed) = reactor.upload_files(
+        FakeReactor(FakeAgave(latency=0.5)), artifacts('a.json'),
+        {'A': 'a.json'}, 'data', '/runs/1', timeout=0.05)
+    assert inputs == {}
+    assert failed[0] == 'a.json'
+    assert 'timed out' in str(failed[1])